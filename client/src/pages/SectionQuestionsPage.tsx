@@ -149,10 +149,11 @@ const SectionQuestionsPage: React.FC = () => {
     
     const result = await questionService.uploadQuestionImage(editingQuestion.id, file);
     
-    // Update the editing question state with the new image URL
+    // Update the editing question state with the new image and thumbnail URLs
     setEditingQuestion({
       ...editingQuestion,
-      image_url: result.image_url
+      image_url: result.image_url,
+      thumbnail_url: result.thumbnail_url
     });
     
     return result.image_url;
@@ -167,7 +168,8 @@ const SectionQuestionsPage: React.FC = () => {
       const newOptions = [...editingQuestion.options];
       newOptions[optionIndex] = {
         ...newOptions[optionIndex],
-        image_url: result.image_url
+        image_url: result.image_url,
+        thumbnail_url: result.thumbnail_url
       };
       
       setEditingQuestion({
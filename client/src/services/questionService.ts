@@ -1,5 +1,5 @@
 import api from './api';
-import type { QuestionResponse, QuestionUpdate } from '../types';
+import type { ImageUploadResponse, QuestionResponse, QuestionUpdate } from '../types';
 
 const questionService = {
   // Get a specific question by ID
@@ -15,7 +15,7 @@ const questionService = {
   },
   
   // Upload image for a question
-  uploadQuestionImage: async (questionId: number, imageFile: File): Promise<{ image_url: string }> => {
+  uploadQuestionImage: async (questionId: number, imageFile: File): Promise<ImageUploadResponse> => {
     const formData = new FormData();
     formData.append('file', imageFile);
     
@@ -30,7 +30,7 @@ const questionService = {
   },
   
   // Upload image for an option
-  uploadOptionImage: async (sectionId: number, imageFile: File): Promise<{ image_url: string }> => {
+  uploadOptionImage: async (sectionId: number, imageFile: File): Promise<ImageUploadResponse> => {
     const formData = new FormData();
     formData.append('file', imageFile);
     
@@ -13,6 +13,7 @@ export interface Option {
   text: string;
   is_correct: boolean;
   image_url?: string;
+  thumbnail_url?: string;
 }
 
 // Section Creation Type
@@ -80,10 +81,11 @@ export interface QuestionResponse {
   section_id: number;
   question_text: string;
   question_type: QuestionType;
-  options?: string; // JSON string
-  correct_answer?: string; // JSON string
+  options?: Option[];
+  correct_answer?: number[]; // Indexes of the correct options
   numerical_answer?: number;
   image_url?: string;
+  thumbnail_url?: string;
   last_modified?: string;
 }
 
@@ -103,4 +105,5 @@ export interface QuestionUpdate {
 // Image Upload Response
 export interface ImageUploadResponse {
   image_url: string;
+  thumbnail_url?: string;
 }
\ No newline at end of file
@@ -1,31 +1,15 @@
 import type { ParsedQuestion, Option, QuestionResponse } from '../types';
 import { QuestionType } from '../types';
 
-// Parse question data from API response
+// Map a question from the API response to the shape used by the UI
+// (options and correct answers arrive as structured JSON, no parsing needed)
 export const parseQuestion = (question: QuestionResponse): ParsedQuestion => {
-  let parsedOptions: Option[] | undefined = undefined;
-  let correctAnswers: number[] | undefined = undefined;
-  
-  if (question.options) {
-    try {
-      parsedOptions = JSON.parse(question.options);
-    } catch (error) {
-      console.error('Error parsing options:', error);
-    }
-  }
-  
-  if (question.correct_answer) {
-    try {
-      correctAnswers = JSON.parse(question.correct_answer);
-    } catch (error) {
-      console.error('Error parsing correct answers:', error);
-    }
-  }
+  const { correct_answer, ...rest } = question;
   
   return {
-    ...question,
-    options: parsedOptions,
-    correct_answers: correctAnswers,
+    ...rest,
+    options: question.options ?? undefined,
+    correct_answers: correct_answer ?? undefined,
   };
 };
 
@@ -0,0 +1,132 @@
+from contextvars import ContextVar
+from typing import Any, Optional
+import atexit
+import logging
+import queue
+import random
+import re
+import sys
+import threading
+import uuid
+
+from app.core.config import settings
+from app.utils.structured_logging import BackgroundQueueHandler, BackgroundQueueListener, ContextFilter, JsonFormatter, Truncated
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"
+
+# Loggers uvicorn gives console handlers of its own; they go through the queue like every other
+UVICORN_LOGGERS = ("uvicorn", "uvicorn.error", "uvicorn.access")
+
+# ID of the request being handled, added to every record logged for it
+request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+# Incoming IDs are only kept when they can't break a log line
+_REQUEST_ID_PATTERN = re.compile(r"[A-Za-z0-9._:-]{1,128}")
+
+_queue_handler: Optional[BackgroundQueueHandler] = None
+_listener: Optional[BackgroundQueueListener] = None
+_writer: Optional[logging.Handler] = None
+_logging_lock = threading.Lock()
+
+
+def configure_logging() -> None:
+    """Send every record through a queue to a thread that formats and writes it.
+
+    Logging then costs the caller a put on a queue, whatever the volume or
+    the speed of stderr. Safe to call more than once.
+    """
+    global _queue_handler, _listener, _writer
+    with _logging_lock:
+        if _listener is not None:
+            return
+
+        _writer = logging.StreamHandler(sys.stderr)
+        if settings.LOG_FORMAT == "json":
+            _writer.setFormatter(JsonFormatter())
+        else:
+            _writer.setFormatter(logging.Formatter(TEXT_FORMAT, defaults={"request_id": "-"}))
+
+        records = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+        _queue_handler = BackgroundQueueHandler(records)
+        _queue_handler.addFilter(ContextFilter("request_id", request_id))
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(_queue_handler)
+        root.setLevel(settings.LOG_LEVEL)
+        for name in UVICORN_LOGGERS:
+            uvicorn_logger = logging.getLogger(name)
+            uvicorn_logger.handlers.clear()
+            uvicorn_logger.propagate = True
+
+        _listener = BackgroundQueueListener(records, _writer, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_logging)
+
+
+def stop_logging() -> None:
+    """Write out the queued records and stop the writer thread; later records are written directly"""
+    global _listener
+    with _logging_lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        _listener = None
+        root = logging.getLogger()
+        root.removeHandler(_queue_handler)
+        root.addHandler(_writer)
+
+
+def logging_stats() -> dict:
+    """Records waiting for the writer thread and records dropped because the queue was full"""
+    if _queue_handler is None:
+        return {"queued": 0, "dropped": 0}
+    return _queue_handler.stats()
+
+
+def sample_payloads() -> bool:
+    """Decide whether to log the prompt and response of a Gemini call (LOG_PAYLOAD_SAMPLE_RATE)"""
+    rate = settings.LOG_PAYLOAD_SAMPLE_RATE
+    return rate > 0 and (rate >= 1 or random.random() < rate)
+
+
+def log_payload(logger: logging.Logger, label: str, payload: Any) -> None:
+    """Log a prompt or response, cut to LOG_PAYLOAD_MAX_CHARS on the writer thread"""
+    logger.info("%s: %s", label, Truncated(payload, settings.LOG_PAYLOAD_MAX_CHARS))
+
+
+class RequestIdMiddleware:
+    """Gives every HTTP request an ID, added to the records logged while handling it.
+
+    A well-formed X-Request-ID header (from a proxy or client) is kept, so
+    their logs can be matched with ours; otherwise a new ID is made. The ID
+    is sent back in the X-Request-ID response header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        value = None
+        for name, header in scope["headers"]:
+            if name == b"x-request-id":
+                header = header.decode("latin-1")
+                value = header if _REQUEST_ID_PATTERN.fullmatch(header) else None
+                break
+        value = value or uuid.uuid4().hex
+        token = request_id.set(value)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), (b"x-request-id", value.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_id.reset(token)
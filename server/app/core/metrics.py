@@ -0,0 +1,151 @@
+from contextvars import ContextVar
+from functools import lru_cache
+from sqlalchemy import event
+from typing import Optional
+import time
+
+from app.utils.metrics import MetricsRegistry
+
+# Metrics of this process; each worker process serves its own at /metrics
+registry = MetricsRegistry()
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+GEMINI_BUCKETS = (0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250, 1000)
+
+http_request_duration = registry.histogram(
+    "questcart_http_request_duration_seconds",
+    "Time from receiving a request to sending the last byte of its response",
+    ("method", "route", "status"),
+    REQUEST_BUCKETS
+)
+db_queries_per_request = registry.histogram(
+    "questcart_db_queries_per_request",
+    "SQL statements executed while handling a request",
+    ("method", "route"),
+    QUERY_COUNT_BUCKETS
+)
+db_seconds_per_request = registry.histogram(
+    "questcart_db_seconds_per_request",
+    "Time spent executing SQL statements while handling a request",
+    ("method", "route"),
+    REQUEST_BUCKETS
+)
+db_query_duration = registry.histogram(
+    "questcart_db_query_duration_seconds",
+    "Time spent executing single SQL statements",
+    ("engine", "operation"),
+    QUERY_BUCKETS
+)
+db_query_errors = registry.counter(
+    "questcart_db_query_errors_total",
+    "SQL statements that raised an error",
+    ("engine",)
+)
+gemini_request_duration = registry.histogram(
+    "questcart_gemini_request_duration_seconds",
+    "Duration of single Gemini requests (every attempt and hedge, excluding rate limiter waits)",
+    ("question_type", "profile", "outcome"),
+    GEMINI_BUCKETS
+)
+gemini_errors = registry.counter(
+    "questcart_gemini_errors_total",
+    "Gemini requests that failed",
+    ("question_type", "profile", "reason")
+)
+gemini_tokens = registry.counter(
+    "questcart_gemini_tokens_total",
+    "Tokens used by Gemini calls, from the responses' usage metadata",
+    ("question_type", "profile", "kind")
+)
+gemini_questions = registry.counter(
+    "questcart_gemini_questions_total",
+    "Questions returned by Gemini calls (divide the tokens by these for tokens per question)",
+    ("question_type", "profile")
+)
+
+
+class _QueryTally:
+    __slots__ = ("queries", "seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+
+# SQL statements of the request being handled (None outside requests, e.g. in job workers)
+_request_queries: ContextVar[Optional[_QueryTally]] = ContextVar("request_queries", default=None)
+
+
+@lru_cache(maxsize=2048)
+def _operation(statement: str) -> str:
+    """Label for a statement: its first keyword for the usual DML, "other" for anything else"""
+    words = statement.split(None, 1)
+    keyword = words[0].upper() if words else ""
+    return keyword.lower() if keyword in ("SELECT", "INSERT", "UPDATE", "DELETE") else "other"
+
+
+def instrument_queries(engine, name: str) -> None:
+    """Time every SQL statement run through an engine (a sync engine, or an async engine's sync_engine)"""
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        db_query_duration.observe(elapsed, engine=name, operation=_operation(statement))
+        tally = _request_queries.get()
+        if tally is not None:
+            tally.queries += 1
+            tally.seconds += elapsed
+
+    def handle_error(exception_context):
+        connection = exception_context.connection
+        if connection is not None and connection.info.get("query_started"):
+            connection.info["query_started"].pop()
+        db_query_errors.inc(engine=name)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(engine, "handle_error", handle_error)
+
+
+class RequestMetricsMiddleware:
+    """Times every HTTP request and counts the SQL statements it ran.
+
+    Requests are labelled with the path template of the route that handled
+    them (e.g. /api/exams/{exam_id}), so IDs don't create new series;
+    requests no route matched share the "unmatched" label. Streaming
+    responses are timed until their last chunk is sent.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500  # Unless a response is started, the server answers with a 500
+        tally = _QueryTally()
+        token = _request_queries.set(tally)
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _request_queries.reset(token)
+            # The router records the matched route in the scope
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            method = scope["method"]
+            http_request_duration.observe(time.perf_counter() - started, method=method, route=route, status=str(status))
+            db_queries_per_request.observe(tally.queries, method=method, route=route)
+            db_seconds_per_request.observe(tally.seconds, method=method, route=route)
@@ -0,0 +1,96 @@
+import logging
+from sqlalchemy import JSON, MetaData, inspect, text
+from sqlalchemy.engine import Engine
+
+from app.core.database import Base
+
+logger = logging.getLogger(__name__)
+
+
+def run_migrations(engine: Engine) -> None:
+    """Bring an existing database up to date with the models.
+    
+    `Base.metadata.create_all` only creates missing tables, so column changes to
+    existing tables are applied here. Every step checks the current schema
+    first and is safe to run on each startup.
+    """
+    migrate_question_json_columns(engine)
+    add_missing_column(engine, "questions", "thumbnail_url", "VARCHAR(1024)")
+    add_missing_column(engine, "exams", "version", "INTEGER DEFAULT 1")
+    add_missing_column(engine, "generation_jobs", "tenant", "VARCHAR(255)")
+    add_missing_column(engine, "questions", "signature", "TEXT")
+    add_missing_column(engine, "questions", "explanation", "TEXT")
+    add_missing_indexes(engine, Base.metadata)
+
+
+def add_missing_column(engine: Engine, table: str, column: str, ddl_type: str) -> None:
+    """Add a nullable column to an existing table if it isn't there yet"""
+    inspector = inspect(engine)
+    if table not in inspector.get_table_names():
+        return
+    if column in {existing["name"] for existing in inspector.get_columns(table)}:
+        return
+
+    logger.info("Adding column %s.%s", table, column)
+    with engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type} NULL"))
+
+
+def add_missing_indexes(engine: Engine, metadata: MetaData) -> None:
+    """Create the models' indexes that tables created by an older version don't have yet.
+    
+    An index counts as present when the table already has one (under any
+    name) starting with the same columns, e.g. the index MySQL creates for a
+    foreign key.
+    """
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    for table in metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = [index["column_names"] for index in inspector.get_indexes(table.name)]
+        existing += [constraint["column_names"] for constraint in inspector.get_unique_constraints(table.name)]
+        primary_key = inspector.get_pk_constraint(table.name).get("constrained_columns") or []
+        existing.append(primary_key)
+        for index in table.indexes:
+            columns = [column.name for column in index.columns]
+            if any(names[:len(columns)] == columns for names in existing):
+                continue
+            logger.info("Creating index %s on %s (%s)", index.name, table.name, ", ".join(columns))
+            index.create(bind=engine, checkfirst=True)
+
+
+def migrate_question_json_columns(engine: Engine) -> None:
+    """Convert questions.options / questions.correct_answer from JSON text to native JSON.
+    
+    Existing rows already hold valid JSON text (the repository used to
+    json.dumps them), so the database can convert them in place. SQLite has no
+    separate JSON column type: the JSON type reads and writes the same text
+    there, so existing SQLite rows need no change.
+    """
+    inspector = inspect(engine)
+    if "questions" not in inspector.get_table_names():
+        return
+
+    dialect = engine.dialect.name
+    if dialect == "sqlite":
+        return
+
+    columns = {column["name"]: column["type"] for column in inspector.get_columns("questions")}
+    pending = [name for name in ("options", "correct_answer") if name in columns and not isinstance(columns[name], JSON)]
+    if not pending:
+        return
+
+    logger.info("Migrating questions columns %s to native JSON", pending)
+    with engine.begin() as conn:
+        for name in pending:
+            if dialect == "mysql":
+                # MySQL rejects empty strings as JSON, so clear them first
+                conn.execute(text(f"UPDATE questions SET {name} = NULL WHERE {name} = ''"))
+                conn.execute(text(f"ALTER TABLE questions MODIFY {name} JSON NULL"))
+            elif dialect == "postgresql":
+                conn.execute(text(
+                    f"ALTER TABLE questions ALTER COLUMN {name} TYPE JSON USING NULLIF({name}, '')::json"
+                ))
+            else:
+                logger.warning("No JSON column migration for dialect %s; questions.%s left as is", dialect, name)
@@ -1,5 +1,5 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, Boolean, Text, Enum
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Boolean, Text, Enum, JSON, Index, UniqueConstraint
+from sqlalchemy.orm import deferred, relationship
 import enum
 from app.core.database import Base
 
@@ -16,6 +16,8 @@ class Exam(Base):
     total_marks = Column(Float)
     time_minutes = Column(Integer)
     created_at = Column(String(50))  # Added length constraint
+    # Bumped whenever a question in the exam changes; used for ETags
+    version = Column(Integer, default=1)
     
     # Relationship
     sections = relationship("Section", back_populates="exam", cascade="all, delete-orphan")
@@ -24,7 +26,7 @@ class Section(Base):
     __tablename__ = "sections"
 
     id = Column(Integer, primary_key=True, index=True)
-    exam_id = Column(Integer, ForeignKey("exams.id"))
+    exam_id = Column(Integer, ForeignKey("exams.id"), index=True)
     name = Column(String(255))  # Added length constraint
     total_questions = Column(Integer)
     questions_to_attempt = Column(Integer)
@@ -41,22 +43,68 @@ class Question(Base):
     __tablename__ = "questions"
 
     id = Column(Integer, primary_key=True, index=True)
-    section_id = Column(Integer, ForeignKey("sections.id"))
+    section_id = Column(Integer, ForeignKey("sections.id"), index=True)
     question_text = Column(Text)
     question_type = Column(Enum(QuestionType))
     
     # New field for question image
     image_url = Column(String(1024), nullable=True)  # Added length constraint
+    thumbnail_url = Column(String(1024), nullable=True)  # Small variant of image_url from the image pipeline
     
-    # For MCQ/MSQ
-    options = Column(Text, nullable=True)  # JSON string containing options with possible image URLs
-    correct_answer = Column(Text, nullable=True)  # Could be index(es) or values for different question types
+    # For MCQ/MSQ (native JSON where the dialect has it, JSON text on SQLite)
+    options = Column(JSON, nullable=True)  # List of {"text", "is_correct", "image_url"} objects
+    correct_answer = Column(JSON, nullable=True)  # List of indexes of the correct options
     
     # For numerical
     numerical_answer = Column(Float, nullable=True)
     
+    # Why the answer is correct (generated with the "full" generation profile, or imported)
+    explanation = Column(Text, nullable=True)
+    
     # Last modified timestamp
     last_modified = Column(String(50), nullable=True)  # Added length constraint
     
+    # MinHash signature of question_text for near-duplicate checks (see app.utils.near_duplicates);
+    # deferred since only the duplicate check reads it
+    signature = deferred(Column(Text, nullable=True))
+    
     # Relationship
-    section = relationship("Section", back_populates="questions")
\ No newline at end of file
+    section = relationship("Section", back_populates="questions")
+
+class JobStatus(enum.Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+class GenerationJob(Base):
+    __tablename__ = "generation_jobs"
+
+    id = Column(String(36), primary_key=True)  # UUID, so job ids can't be guessed or enumerated
+    section_id = Column(Integer, ForeignKey("sections.id"), index=True)
+    status = Column(Enum(JobStatus), default=JobStatus.QUEUED, index=True)
+    bypass_cache = Column(Boolean, default=False)
+    question_count = Column(Integer, nullable=True)
+    error = Column(Text, nullable=True)
+    worker_id = Column(String(255), nullable=True)  # Identifies the worker (host/pid/thread) running the job
+    tenant = Column(String(255), nullable=True)  # Who queued the job, for fair scheduling of Gemini calls
+    
+    # Timing (ISO timestamps, like the other tables)
+    created_at = Column(String(50))
+    started_at = Column(String(50), nullable=True)
+    finished_at = Column(String(50), nullable=True)
+
+class StoredImage(Base):
+    __tablename__ = "stored_images"
+    __table_args__ = (
+        UniqueConstraint("content_hash", "variant", name="uq_stored_images_hash_variant"),
+        Index("ix_stored_images_image_url", "image_url", mysql_length=255),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    content_hash = Column(String(64))  # SHA-256 of the uploaded bytes
+    variant = Column(String(64))  # Image pipeline settings the stored files were produced with
+    image_url = Column(String(1024))
+    thumbnail_url = Column(String(1024), nullable=True)
+    ref_count = Column(Integer, default=1)  # Uploads that were handed this URL and not yet deleted
+    created_at = Column(String(50))
@@ -1,8 +1,10 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import Select, Text, func, insert, select, type_coerce
+from sqlalchemy.orm import Session, joinedload, selectinload
 import json
 from datetime import datetime
+from typing import List, Optional
 from app.models.models import Exam, Section, Question, QuestionType
-from app.schemas.schemas import ExamCreate, SectionCreate
+from app.schemas.schemas import ExamCreate, ExamRecord, SectionCreate, SectionRecord
 
 
 class ExamRepository:
@@ -37,17 +39,133 @@ class ExamRepository:
             db.add(db_section)
 
         db.commit()
-        db.refresh(db_exam)
-        return db_exam
+        # Reload with the sections so the result can be serialized without lazy loads
+        return self.get_exam(db, db_exam.id)
 
-    def get_exam(self, db: Session, exam_id: int) -> Exam:
-        return db.query(Exam).filter(Exam.id == exam_id).first()
+    def dump_query(self, exam_ids: Optional[List[int]] = None) -> Select:
+        """One row per question (or per empty section / exam) with its exam and section, in dump order.
+        
+        Outer joins keep exams without sections and sections without
+        questions, and the ordering puts each exam's rows together, so the
+        dump can be written from a single pass over one cursor. The JSON
+        columns come back as the stored JSON text, since the dump only
+        writes them out again.
+        """
+        query = (
+            select(
+                Exam.id.label("exam_id"), Exam.name.label("exam_name"), Exam.total_marks, Exam.time_minutes,
+                Exam.created_at,
+                Section.id.label("section_id"), Section.name.label("section_name"), Section.total_questions,
+                Section.questions_to_attempt, Section.marks_per_question, Section.negative_marking_allowed,
+                Section.negative_marks, Section.question_type.label("section_type"),
+                Question.id.label("question_id"), Question.question_text, Question.question_type,
+                type_coerce(Question.options, Text).label("options"),
+                type_coerce(Question.correct_answer, Text).label("correct_answer"),
+                Question.numerical_answer, Question.explanation, Question.image_url,
+                Question.thumbnail_url, Question.last_modified,
+            )
+            .select_from(Exam)
+            .outerjoin(Section, Section.exam_id == Exam.id)
+            .outerjoin(Question, Question.section_id == Section.id)
+            .order_by(Exam.id, Section.id, Question.id)
+        )
+        if exam_ids:
+            query = query.where(Exam.id.in_(exam_ids))
+        return query
+    
+    def insert_exam_record(self, db: Session, record: ExamRecord) -> int:
+        """Insert an exam from a dump record (not committed) and return its new ID"""
+        result = db.execute(insert(Exam).values(
+            name=record.name,
+            total_marks=record.total_marks,
+            time_minutes=record.time_minutes,
+            created_at=record.created_at or datetime.now().isoformat(),
+            version=1
+        ))
+        return result.inserted_primary_key[0]
+    
+    def insert_section_record(self, db: Session, record: SectionRecord, exam_id: int) -> int:
+        """Insert a section from a dump record into an exam (not committed) and return its new ID"""
+        result = db.execute(insert(Section).values(
+            exam_id=exam_id,
+            name=record.name,
+            total_questions=record.total_questions,
+            questions_to_attempt=record.questions_to_attempt,
+            marks_per_question=record.marks_per_question,
+            negative_marking_allowed=record.negative_marking_allowed,
+            negative_marks=record.negative_marks,
+            question_type=QuestionType(record.question_type.value)
+        ))
+        return result.inserted_primary_key[0]
+    
+    def get_exam(self, db: Session, exam_id: int, include_counts: bool = False) -> Exam:
+        exam = db.query(Exam).options(selectinload(Exam.sections)).filter(Exam.id == exam_id).first()
+        if exam and include_counts:
+            self.attach_question_counts(db, [exam])
+        return exam
+
+    def get_exam_version(self, db: Session, exam_id: int) -> Optional[int]:
+        """Get an exam's version without loading it (None if the exam doesn't exist)"""
+        row = db.query(Exam.version).filter(Exam.id == exam_id).first()
+        return None if row is None else row.version or 0
+
+    def get_section_version(self, db: Session, section_id: int) -> Optional[int]:
+        """Get the version of the exam a section belongs to (None if the section doesn't exist)"""
+        row = (
+            db.query(Exam.version)
+            .join(Section, Section.exam_id == Exam.id)
+            .filter(Section.id == section_id)
+            .first()
+        )
+        return None if row is None else row.version or 0
 
-    def get_all_exams(self, db: Session, skip: int = 0, limit: int = 100):
-        return db.query(Exam).offset(skip).limit(limit).all()
+    def get_all_exams(
+        self,
+        db: Session,
+        skip: int = 0,
+        limit: int = 100,
+        after_id: Optional[int] = None,
+        include_counts: bool = False
+    ) -> List[Exam]:
+        """Get a page of exams ordered by ID.
+        
+        Pass the last ID of the previous page as `after_id` (keyset pagination);
+        `skip` is only kept for older clients since OFFSET gets slower the
+        deeper the page. Sections are loaded with one extra SELECT ... IN for
+        the whole page, so the query count doesn't grow with the page size.
+        """
+        query = db.query(Exam).options(selectinload(Exam.sections)).order_by(Exam.id)
+        if after_id is not None:
+            query = query.filter(Exam.id > after_id)
+        elif skip:
+            query = query.offset(skip)
+
+        exams = query.limit(limit).all()
+        if include_counts:
+            self.attach_question_counts(db, exams)
+        return exams
+
+    def attach_question_counts(self, db: Session, exams: List[Exam]) -> None:
+        """Set `question_count` on every section of the given exams using one aggregate query"""
+        sections = [section for exam in exams for section in exam.sections]
+        if not sections:
+            return
+
+        counts = dict(
+            db.query(Question.section_id, func.count(Question.id))
+            .filter(Question.section_id.in_([section.id for section in sections]))
+            .group_by(Question.section_id)
+            .all()
+        )
+        for section in sections:
+            section.question_count = counts.get(section.id, 0)
 
-    def get_section(self, db: Session, section_id: int) -> Section:
-        return db.query(Section).filter(Section.id == section_id).first()
+    def get_section(self, db: Session, section_id: int, include_exam: bool = False) -> Section:
+        query = db.query(Section).filter(Section.id == section_id)
+        if include_exam:
+            # Loaded up front because async sessions can't lazy load it later
+            query = query.options(joinedload(Section.exam))
+        return query.first()
 
     def get_sections_by_exam(self, db: Session, exam_id: int):
         return db.query(Section).filter(Section.exam_id == exam_id).all()
\ No newline at end of file
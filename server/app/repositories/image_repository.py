@@ -0,0 +1,111 @@
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+from app.models.models import StoredImage
+
+
+class ImageRepository:
+    def acquire_image(
+        self,
+        db: Session,
+        content_hash: str,
+        variant: str,
+        references: int = 1
+    ) -> Optional[StoredImage]:
+        """Take references (0 just looks it up) to an already stored image with this content, if there is one"""
+        if references:
+            result = db.execute(
+                update(StoredImage)
+                .where(StoredImage.content_hash == content_hash, StoredImage.variant == variant)
+                .values(ref_count=StoredImage.ref_count + references)
+            )
+            db.commit()
+            if result.rowcount == 0:
+                return None
+        return db.query(StoredImage).filter(
+            StoredImage.content_hash == content_hash,
+            StoredImage.variant == variant
+        ).first()
+
+    def add_image(
+        self,
+        db: Session,
+        content_hash: str,
+        variant: str,
+        image_url: str,
+        thumbnail_url: Optional[str] = None,
+        references: int = 1
+    ) -> Tuple[StoredImage, bool]:
+        """Index a newly stored image with the given number of references.
+
+        When another request indexed the same content first, the references
+        are taken on that entry instead. Returns the entry and whether it was created.
+        """
+        db_image = StoredImage(
+            content_hash=content_hash,
+            variant=variant,
+            image_url=image_url,
+            thumbnail_url=thumbnail_url,
+            ref_count=references,
+            created_at=datetime.now().isoformat()
+        )
+        db.add(db_image)
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            existing = self.acquire_image(db, content_hash, variant, references)
+            if existing:
+                return existing, False
+            raise
+        db.refresh(db_image)
+        return db_image, True
+
+    def add_references(self, db: Session, image_urls: Iterable[Optional[str]]) -> None:
+        """Take a reference to an indexed image for every time its URL appears (not committed).
+
+        Used when questions are imported with image URLs rather than uploads;
+        URLs that are not in the index are ignored.
+        """
+        # One statement per distinct count rather than per URL
+        urls_by_count: Dict[int, List[str]] = defaultdict(list)
+        for image_url, count in Counter(url for url in image_urls if url).items():
+            urls_by_count[count].append(image_url)
+        for count, urls in urls_by_count.items():
+            db.execute(
+                update(StoredImage)
+                .where(StoredImage.image_url.in_(urls))
+                .values(ref_count=StoredImage.ref_count + count)
+            )
+
+    def release_image(self, db: Session, image_url: str) -> Tuple[Optional[int], Optional[str]]:
+        """Drop one reference to an image.
+
+        Returns the number of references left (the entry is removed when it
+        reaches 0), or None if the URL is not in the index, together with
+        the thumbnail URL the index has for the image.
+        """
+        db_image = db.query(StoredImage).filter(StoredImage.image_url == image_url).first()
+        if not db_image:
+            return None, None
+        image_id, thumbnail_url = db_image.id, db_image.thumbnail_url
+
+        # Conditional statements, so concurrent releases can't drive the count below zero
+        db.execute(
+            update(StoredImage)
+            .where(StoredImage.id == image_id, StoredImage.ref_count > 0)
+            .values(ref_count=StoredImage.ref_count - 1)
+        )
+        removed = db.execute(
+            delete(StoredImage).where(StoredImage.id == image_id, StoredImage.ref_count <= 0)
+        ).rowcount
+        db.commit()
+        if removed:
+            return 0, thumbnail_url
+
+        db_image = db.get(StoredImage, image_id)
+        # Another request removed the entry between our two statements
+        return (db_image.ref_count if db_image else 0), thumbnail_url
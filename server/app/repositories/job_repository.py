@@ -0,0 +1,86 @@
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+from app.models.models import GenerationJob, JobStatus
+
+
+class JobRepository:
+    def create_job(self, db: Session, section_id: int, bypass_cache: bool = False, tenant: Optional[str] = None) -> GenerationJob:
+        """Queue a new generation job for a section"""
+        db_job = GenerationJob(
+            id=str(uuid.uuid4()),
+            section_id=section_id,
+            bypass_cache=bypass_cache,
+            tenant=tenant,
+            status=JobStatus.QUEUED,
+            created_at=datetime.now().isoformat()
+        )
+        db.add(db_job)
+        db.commit()
+        db.refresh(db_job)
+        return db_job
+
+    def get_job(self, db: Session, job_id: str) -> Optional[GenerationJob]:
+        """Get a job by ID"""
+        return db.query(GenerationJob).filter(GenerationJob.id == job_id).first()
+
+    def get_active_job_for_section(self, db: Session, section_id: int) -> Optional[GenerationJob]:
+        """Get a queued or running job for a section, if there is one"""
+        return db.query(GenerationJob).filter(
+            GenerationJob.section_id == section_id,
+            GenerationJob.status.in_([JobStatus.QUEUED, JobStatus.RUNNING])
+        ).first()
+
+    def claim_next_job(self, db: Session, worker_id: str) -> Optional[GenerationJob]:
+        """Claim the oldest queued job for a worker.
+        
+        The claim is a conditional UPDATE on the job's status, so when several
+        processes poll the same table only one of them can win a given job.
+        """
+        while True:
+            candidate = db.query(GenerationJob.id).filter(
+                GenerationJob.status == JobStatus.QUEUED
+            ).order_by(GenerationJob.created_at).first()
+            if not candidate:
+                return None
+
+            result = db.execute(
+                update(GenerationJob)
+                .where(GenerationJob.id == candidate.id, GenerationJob.status == JobStatus.QUEUED)
+                .values(status=JobStatus.RUNNING, worker_id=worker_id, started_at=datetime.now().isoformat())
+            )
+            db.commit()
+            if result.rowcount == 1:
+                return self.get_job(db, candidate.id)
+            # Another worker claimed it first, try the next one
+
+    def complete_job(self, db: Session, job_id: str, question_count: int) -> None:
+        """Mark a job as succeeded"""
+        db.execute(
+            update(GenerationJob)
+            .where(GenerationJob.id == job_id)
+            .values(status=JobStatus.SUCCEEDED, question_count=question_count, finished_at=datetime.now().isoformat())
+        )
+        db.commit()
+
+    def fail_job(self, db: Session, job_id: str, error: str) -> None:
+        """Mark a job as failed"""
+        db.execute(
+            update(GenerationJob)
+            .where(GenerationJob.id == job_id)
+            .values(status=JobStatus.FAILED, error=error, finished_at=datetime.now().isoformat())
+        )
+        db.commit()
+
+    def requeue_stale_jobs(self, db: Session, stale_seconds: int) -> int:
+        """Put jobs that have been running for too long (e.g. their worker died) back in the queue"""
+        cutoff = (datetime.now() - timedelta(seconds=stale_seconds)).isoformat()
+        result = db.execute(
+            update(GenerationJob)
+            .where(GenerationJob.status == JobStatus.RUNNING, GenerationJob.started_at < cutoff)
+            .values(status=JobStatus.QUEUED, worker_id=None, started_at=None)
+        )
+        db.commit()
+        return result.rowcount
@@ -1,79 +1,211 @@
+from sqlalchemy import String, cast, func, insert, or_, select, update
+from sqlalchemy.engine import Result
 from sqlalchemy.orm import Session
-import json
 import datetime
 from typing import List, Dict, Any, Optional
-from app.models.models import Question, QuestionType, Section
+from app.models.models import Exam, Question, QuestionType, Section
 from app.schemas.schemas import QuestionUnion, MCQQuestion, MSQQuestion, NumericalQuestion, QuestionUpdate, Option
+from app.utils.near_duplicates import Signature, decode_signature, encode_signature, minhash_signature
 
 
 class QuestionRepository:
     def add_questions(self, db: Session, section_id: int, questions: List[QuestionUnion]) -> List[Question]:
-        section = db.query(Section).filter(Section.id == section_id).first()
+        """Add generated questions to a section in a single bulk INSERT"""
+        # Usually already in the session's identity map, so this doesn't hit the database
+        section = db.get(Section, section_id)
         if not section:
             raise ValueError(f"Section with ID {section_id} not found")
         
-        db_questions = []
-        for question in questions:
-            # Handle different question types
-            if isinstance(question, MCQQuestion):
-                options = [{"text": opt.text, "is_correct": opt.is_correct, "image_url": opt.image_url} for opt in question.options]
-                correct_answers = [i for i, opt in enumerate(question.options) if opt.is_correct]
-                
-                db_question = Question(
-                    section_id=section_id,
-                    question_text=question.question_text,
-                    question_type=QuestionType.MCQ,
-                    options=json.dumps(options),
-                    correct_answer=json.dumps(correct_answers),
-                    image_url=question.image_url,
-                    last_modified=datetime.datetime.now().isoformat()
-                )
-            
-            elif isinstance(question, MSQQuestion):
-                options = [{"text": opt.text, "is_correct": opt.is_correct, "image_url": opt.image_url} for opt in question.options]
-                correct_answers = [i for i, opt in enumerate(question.options) if opt.is_correct]
-                
-                db_question = Question(
-                    section_id=section_id,
-                    question_text=question.question_text,
-                    question_type=QuestionType.MSQ,
-                    options=json.dumps(options),
-                    correct_answer=json.dumps(correct_answers),
-                    image_url=question.image_url,
-                    last_modified=datetime.datetime.now().isoformat()
-                )
-            
-            elif isinstance(question, NumericalQuestion):
-                db_question = Question(
-                    section_id=section_id,
-                    question_text=question.question_text,
-                    question_type=QuestionType.NUM,
-                    numerical_answer=question.answer,
-                    image_url=question.image_url,
-                    last_modified=datetime.datetime.now().isoformat()
-                )
-            
-            db.add(db_question)
-            db_questions.append(db_question)
+        # One timestamp for the whole batch
+        timestamp = datetime.datetime.now().isoformat()
+        rows = [self._question_row(section_id, question, timestamp) for question in questions]
+        return self.bulk_insert_questions(db, section_id, rows)
+    
+    def bulk_insert_questions(self, db: Session, section_id: int, rows: List[Dict[str, Any]]) -> List[Question]:
+        """Insert question rows for a section in one statement and return them with their IDs.
+        
+        Uses INSERT ... RETURNING where the dialect supports it for executemany.
+        Otherwise (MySQL) the rows go in one multi-row INSERT, whose IDs follow
+        the first one the driver reports, and are read back from that ID with
+        one SELECT. Either way there are no per-row refreshes.
+        """
+        if not rows:
+            return []
+        
+        dialect = db.get_bind().dialect
+        if dialect.insert_executemany_returning:
+            # Batched RETURNING doesn't promise row order, but IDs are assigned in insert order
+            db_questions = sorted(
+                db.scalars(insert(Question).returning(Question), rows),
+                key=lambda question: question.id
+            )
+            # Detach the freshly returned rows so the commit doesn't expire them
+            # (which would cost one SELECT per row on the next attribute access)
+            for db_question in db_questions:
+                db.expunge(db_question)
+            self.bump_exam_version(db, section_id)
+            db.commit()
+            return db_questions
         
+        # A single statement (not executemany), so its rows get consecutive IDs. MySQL reports the
+        # first of them as lastrowid; SQLite (only here before it had RETURNING) reports the last
+        last_row_id = db.execute(insert(Question.__table__).values(rows)).lastrowid
+        first_id = last_row_id - len(rows) + 1 if dialect.name == "sqlite" else last_row_id
+        self.bump_exam_version(db, section_id)
         db.commit()
-        for question in db_questions:
-            db.refresh(question)
+        return (
+            db.query(Question)
+            .filter(Question.section_id == section_id, Question.id >= first_id)
+            .order_by(Question.id)
+            .limit(len(rows))
+            .all()
+        )
+    
+    def insert_question_rows(self, db: Session, rows: List[Dict[str, Any]]) -> None:
+        """Insert prepared question rows in one executemany statement (not committed)"""
+        if rows:
+            # Against the table rather than the entity, which skips the ORM's bulk insert bookkeeping
+            db.execute(insert(Question.__table__), rows)
+    
+    def count_image_references(self, db: Session, image_url: str) -> int:
+        """Number of questions using an image URL, for the question itself or one of its options"""
+        return db.query(func.count(Question.id)).filter(
+            or_(Question.image_url == image_url, cast(Question.options, String).contains(image_url, autoescape=True))
+        ).scalar()
+    
+    def bump_exam_version(self, db: Session, section_id: int) -> None:
+        """Increment the version of the exam a section belongs to (committed with the caller's changes)"""
+        exam_id = select(Section.exam_id).where(Section.id == section_id).scalar_subquery()
+        db.execute(
+            update(Exam)
+            .where(Exam.id == exam_id)
+            .values(version=func.coalesce(Exam.version, 0) + 1)
+        )
+    
+    def _question_row(self, section_id: int, question: QuestionUnion, timestamp: str) -> Dict[str, Any]:
+        """Build the column values for a question"""
+        # Handle different question types
+        if isinstance(question, (MCQQuestion, MSQQuestion)):
+            options = [self._option_dict(opt) for opt in question.options]
+            correct_answers = [i for i, opt in enumerate(question.options) if opt.is_correct]
+            
+            return {
+                "section_id": section_id,
+                "question_text": question.question_text,
+                "question_type": QuestionType.MCQ if isinstance(question, MCQQuestion) else QuestionType.MSQ,
+                "options": options,
+                "correct_answer": correct_answers,
+                "numerical_answer": None,
+                "explanation": question.explanation,
+                "image_url": question.image_url,
+                "last_modified": timestamp,
+                "signature": encode_signature(minhash_signature(question.question_text)),
+            }
         
-        return db_questions
+        return {
+            "section_id": section_id,
+            "question_text": question.question_text,
+            "question_type": QuestionType.NUM,
+            "options": None,
+            "correct_answer": None,
+            "numerical_answer": question.answer,
+            "explanation": question.explanation,
+            "image_url": question.image_url,
+            "last_modified": timestamp,
+            "signature": encode_signature(minhash_signature(question.question_text)),
+        }
+    
+    def _option_dict(self, option: Option) -> Dict[str, Any]:
+        """Build the stored representation of an option"""
+        return {
+            "text": option.text,
+            "is_correct": option.is_correct,
+            "image_url": option.image_url,
+            "thumbnail_url": option.thumbnail_url,
+        }
     
     def get_questions_by_section(self, db: Session, section_id: int) -> List[Question]:
         return db.query(Question).filter(Question.section_id == section_id).all()
     
+    def get_questions_by_exam(self, db: Session, exam_id: int) -> List[Question]:
+        """Get every question of an exam in one query, ordered by section and ID"""
+        return (
+            db.query(Question)
+            .join(Section, Question.section_id == Section.id)
+            .filter(Section.exam_id == exam_id)
+            .order_by(Question.section_id, Question.id)
+            .all()
+        )
+    
     def check_questions_exist(self, db: Session, section_id: int) -> bool:
         """Check if questions already exist for a section"""
         count = db.query(Question).filter(Question.section_id == section_id).count()
         return count > 0
     
+    def get_exam_signatures(self, db: Session, exam_id: int) -> Dict[int, Signature]:
+        """Get the near-duplicate signature of every question in an exam, keyed by question ID.
+        
+        Questions saved before signatures existed (or with an outdated scheme)
+        get theirs computed and stored here, so this only reads text once.
+        """
+        rows = db.execute(
+            select(Question.id, Question.signature)
+            .join(Section, Question.section_id == Section.id)
+            .where(Section.exam_id == exam_id)
+        ).all()
+        
+        signatures = {}
+        missing = []
+        for question_id, stored in rows:
+            signature = decode_signature(stored)
+            if signature is None:
+                missing.append(question_id)
+            else:
+                signatures[question_id] = signature
+        
+        if missing:
+            texts = db.execute(select(Question.id, Question.question_text).where(Question.id.in_(missing))).all()
+            backfill = [{"id": question_id, "signature": minhash_signature(text or "")} for question_id, text in texts]
+            db.execute(update(Question), [{**row, "signature": encode_signature(row["signature"])} for row in backfill])
+            db.commit()
+            signatures.update((row["id"], row["signature"]) for row in backfill)
+        return signatures
+    
+    def get_bank_rows(self, db: Session, after_id: int = 0, question_ids: Optional[List[int]] = None) -> Result:
+        """Stream what the question bank indexes for each question, in ID order.
+        
+        Each row has the question's id, question_type and question_text plus
+        the exam_id and section_name it was saved under. Questions with an
+        image are left out: their image is reference-counted per question.
+        """
+        query = (
+            select(Question.id, Question.question_type, Question.question_text, Section.exam_id, Section.name.label("section_name"))
+            .join(Section, Question.section_id == Section.id)
+            .where(Question.id > after_id, Question.image_url.is_(None))
+            .order_by(Question.id)
+            .execution_options(yield_per=1000)
+        )
+        if question_ids is not None:
+            query = query.where(Question.id.in_(question_ids))
+        return db.execute(query)
+    
+    def get_questions_by_ids(self, db: Session, question_ids: List[int]) -> List[Question]:
+        """Get questions by ID (missing ones are left out)"""
+        if not question_ids:
+            return []
+        return db.query(Question).filter(Question.id.in_(question_ids)).all()
+    
     def get_question(self, db: Session, question_id: int) -> Optional[Question]:
         """Get a question by ID"""
         return db.query(Question).filter(Question.id == question_id).first()
     
+    def get_question_version(self, db: Session, question_id: int) -> Optional[str]:
+        """Get a question's last_modified without loading the row ("" if unset, None if missing)"""
+        row = db.query(Question.last_modified).filter(Question.id == question_id).first()
+        if row is None:
+            return None
+        return row.last_modified or ""
+    
     def update_question(self, db: Session, question_id: int, question_update: QuestionUpdate) -> Optional[Question]:
         """Update a question's content"""
         db_question = db.query(Question).filter(Question.id == question_id).first()
@@ -83,37 +215,44 @@ class QuestionRepository:
         # Update question text if provided
         if question_update.question_text is not None:
             db_question.question_text = question_update.question_text
+            db_question.signature = encode_signature(minhash_signature(question_update.question_text))
         
         # Update options if provided (for MCQ/MSQ)
         if question_update.options is not None and db_question.question_type in [QuestionType.MCQ, QuestionType.MSQ]:
-            options = [{"text": opt.text, "is_correct": opt.is_correct, "image_url": opt.image_url} for opt in question_update.options]
+            options = [self._option_dict(opt) for opt in question_update.options]
             correct_answers = [i for i, opt in enumerate(question_update.options) if opt.is_correct]
             
-            db_question.options = json.dumps(options)
-            db_question.correct_answer = json.dumps(correct_answers)
+            db_question.options = options
+            db_question.correct_answer = correct_answers
         
         # Update numerical answer if provided (for NUM)
         if question_update.numerical_answer is not None and db_question.question_type == QuestionType.NUM:
             db_question.numerical_answer = question_update.numerical_answer
         
+        if question_update.explanation is not None:
+            db_question.explanation = question_update.explanation
+        
         # Update last modified timestamp
         db_question.last_modified = datetime.datetime.now().isoformat()
+        self.bump_exam_version(db, db_question.section_id)
         
         db.commit()
         db.refresh(db_question)
         return db_question
     
-    def update_question_image(self, db: Session, question_id: int, image_url: str) -> Optional[Question]:
-        """Update a question's image URL"""
+    def update_question_image(self, db: Session, question_id: int, image_url: str, thumbnail_url: Optional[str] = None) -> Optional[Question]:
+        """Update a question's image and thumbnail URLs"""
         db_question = db.query(Question).filter(Question.id == question_id).first()
         if not db_question:
             return None
         
-        # Update image URL
+        # Update image URLs
         db_question.image_url = image_url
+        db_question.thumbnail_url = thumbnail_url
         
         # Update last modified timestamp
         db_question.last_modified = datetime.datetime.now().isoformat()
+        self.bump_exam_version(db, db_question.section_id)
         
         db.commit()
         db.refresh(db_question)
@@ -1,69 +1,214 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status, UploadFile, File, Form
+from fastapi.responses import FileResponse, StreamingResponse
+from pydantic import TypeAdapter
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Awaitable, Callable, Hashable, List, Literal, Optional, Tuple
 
-from app.core.database import get_db
+from app.core.database import AsyncSessionLocal, get_async_db
 from app.schemas.schemas import (
-    ExamCreate, ExamResponse, GenerateQuestionsRequest, GeneratedQuestionResponse, 
-    QuestionResponse, QuestionUpdate, ImageUploadResponse
+    ExamCreate, ExamImportResponse, ExamResponse, GenerateQuestionsRequest, GeneratedQuestionResponse, 
+    QuestionResponse, QuestionUpdate, ImageUploadResponse, ExamGenerationResponse, QuestionImportRequest
 )
 from app.repositories.exam_repository import ExamRepository
+from app.services.exam_transfer_service import ExamTransferService
+from app.services.export_service import EXPORT_FORMATS, exam_exporter
 from app.services.question_service import QuestionService
+from app.services.rate_limiter import Priority, RateLimitTimeout, generation_context
+from app.utils.helpers import format_sse, request_tenant
+from app.utils.exam_renderer import RENDER_VERSION
+from app.utils.response_cache import CachedResponse, etag_matches, http_date, not_modified_response, response_cache
 import json
+import logging
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/exams", tags=["exams"])
 exam_repository = ExamRepository()
 question_service = QuestionService()
+exam_transfer_service = ExamTransferService()
+question_list_adapter = TypeAdapter(List[QuestionResponse])
+
+
+async def conditional_json(
+    request: Request,
+    key: Tuple[Hashable, ...],
+    etag: str,
+    build: Callable[[], Awaitable[Tuple[bytes, Optional[str]]]],
+    last_modified: Optional[str] = None
+) -> Response:
+    """Answer a GET whose current ETag is known.
+    
+    Returns 304 when the client already has this version, otherwise the
+    cached body for this ETag, building (and caching) it only on a miss.
+    `build` returns the JSON body and its Last-Modified value.
+    """
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified_response(etag, last_modified)
+    
+    cached = response_cache.get(key, etag)
+    if cached is None:
+        body, built_last_modified = await build()
+        cached = CachedResponse(etag=etag, body=body, last_modified=built_last_modified or last_modified)
+        response_cache.set(key, cached)
+    return cached.to_response()
 
 
 @router.post("/", response_model=ExamResponse, status_code=status.HTTP_201_CREATED)
-def create_exam(exam: ExamCreate, db: Session = Depends(get_db)):
+async def create_exam(exam: ExamCreate, db: AsyncSession = Depends(get_async_db)):
     """Create a new exam with sections"""
     try:
-        db_exam = exam_repository.create_exam(db, exam)
+        db_exam = await db.run_sync(exam_repository.create_exam, exam)
         return db_exam
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
+# Declared before /{exam_id}, which would otherwise match "export"
+@router.get("/export")
+async def export_exams(exam_id: Optional[List[int]] = Query(None)):
+    """Stream every exam (or those given as `exam_id`) as NDJSON.
+    
+    Each exam line is followed by its sections, each section line by its
+    questions. The dump is read with a server-side cursor, so memory use
+    doesn't grow with its size.
+    """
+    async def dump():
+        # The request session may be closed before the stream finishes, so use our own
+        async with AsyncSessionLocal() as dump_db:
+            async for chunk in exam_transfer_service.export_ndjson(dump_db, exam_id):
+                yield chunk
+    
+    return StreamingResponse(
+        dump(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="exams.ndjson"'}
+    )
+
+
+@router.post("/import", response_model=ExamImportResponse, status_code=status.HTTP_201_CREATED)
+async def import_exams(request: Request, db: AsyncSession = Depends(get_async_db)):
+    """Import an NDJSON dump made by GET /api/exams/export.
+    
+    The body is read as it arrives and questions are inserted in batches.
+    Everything is imported in one transaction: an invalid line imports
+    nothing and is reported as 400.
+    """
+    try:
+        return await exam_transfer_service.import_ndjson(db, request.stream())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @router.get("/{exam_id}", response_model=ExamResponse)
-def get_exam(exam_id: int, db: Session = Depends(get_db)):
-    """Get exam details by ID"""
-    db_exam = exam_repository.get_exam(db, exam_id)
-    if db_exam is None:
+async def get_exam(exam_id: int, request: Request, include_counts: bool = False, db: AsyncSession = Depends(get_async_db)):
+    """Get exam details by ID.
+    
+    The ETag follows the exam's version, which changes whenever one of its
+    questions is added or updated; send it back in `If-None-Match` to get 304.
+    """
+    version = await db.run_sync(exam_repository.get_exam_version, exam_id)
+    if version is None:
         raise HTTPException(status_code=404, detail=f"Exam with ID {exam_id} not found")
-    return db_exam
+    etag = f'"exam-{exam_id}-v{version}{"-counts" if include_counts else ""}"'
+    
+    async def build():
+        db_exam = await db.run_sync(exam_repository.get_exam, exam_id, include_counts=include_counts)
+        return ExamResponse.model_validate(db_exam).model_dump_json().encode(), None
+    
+    return await conditional_json(request, ("exam", exam_id, include_counts), etag, build)
+
+
+@router.get("/{exam_id}/export")
+async def export_exam(
+    exam_id: int,
+    request: Request,
+    export_format: Literal["html", "pdf"] = Query("html", alias="format"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Render an exam as a printable HTML page or PDF.
+    
+    The output is streamed while it is rendered. Rendered files are kept
+    until the exam changes, so repeat downloads are served from disk, and
+    the ETag follows the exam's version for conditional requests.
+    """
+    if export_format == "pdf" and not exam_exporter.pdf_available:
+        raise HTTPException(status_code=501, detail="PDF export needs the fpdf2 package")
+    
+    version = await db.run_sync(exam_repository.get_exam_version, exam_id)
+    if version is None:
+        raise HTTPException(status_code=404, detail=f"Exam with ID {exam_id} not found")
+    
+    def export_headers(exam_version: int) -> dict:
+        return {
+            "ETag": f'"exam-{exam_id}-v{exam_version}-r{RENDER_VERSION}-{export_format}"',
+            "Content-Disposition": f'inline; filename="exam-{exam_id}.{export_format}"',
+        }
+    
+    headers = export_headers(version)
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers={"ETag": headers["ETag"]})
+    
+    media_type = EXPORT_FORMATS[export_format]
+    cached_path = exam_exporter.cached_path(exam_id, version, export_format)
+    if cached_path:
+        return FileResponse(cached_path, media_type=media_type, headers=headers)
+    
+    try:
+        snapshot = await db.run_sync(exam_exporter.snapshot, exam_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return StreamingResponse(
+        exam_exporter.stream(snapshot, export_format),
+        media_type=media_type,
+        headers=export_headers(snapshot.version)
+    )
 
 
 @router.get("/", response_model=List[ExamResponse])
-def get_all_exams(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    """Get all exams with pagination"""
-    exams = exam_repository.get_all_exams(db, skip=skip, limit=limit)
+async def get_all_exams(
+    response: Response,
+    skip: int = 0,
+    limit: int = Query(100, ge=1, le=500),
+    after_id: Optional[int] = None,
+    include_counts: bool = False,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Get all exams with pagination.
+    
+    Use `after_id` with the `X-Next-Cursor` header of the previous page for
+    keyset pagination; `skip` is deprecated.
+    """
+    exams = await db.run_sync(
+        exam_repository.get_all_exams, skip=skip, limit=limit, after_id=after_id, include_counts=include_counts
+    )
+    if len(exams) == limit:
+        response.headers["X-Next-Cursor"] = str(exams[-1].id)
     return exams
 
 
 @router.post("/sections/{section_id}/generate-questions", status_code=status.HTTP_201_CREATED)
-def generate_questions(section_id: int, db: Session = Depends(get_db)):
+async def generate_questions(section_id: int, request: Request, bypass_cache: bool = False, db: AsyncSession = Depends(get_async_db)):
     """Generate questions for a specific section"""
     try:
         # Check if section exists
-        section = exam_repository.get_section(db, section_id)
+        section = await db.run_sync(exam_repository.get_section, section_id)
         if not section:
             raise HTTPException(status_code=404, detail=f"Section with ID {section_id} not found")
         
-        # Generate questions
-        question_service.generate_questions_for_section(db, section_id)
+        # Generate questions (a user is waiting, so this goes ahead of bulk work)
+        with generation_context(Priority.INTERACTIVE, request_tenant(request)):
+            await question_service.generate_questions_for_section_async(db, section_id, bypass_cache=bypass_cache)
         
         return {"message": f"Questions generated successfully for section {section_id}"}
+    except RateLimitTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except ValueError as e:
         if "already exist" in str(e):
             raise HTTPException(status_code=400, detail=str(e))
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
-        # Log the full exception for debugging
-        import traceback
-        error_details = f"Failed to generate questions: {str(e)}\n{traceback.format_exc()}"
-        print(error_details)  # This will show in server logs
+        # The traceback is rendered by the log writer thread, not here
+        logger.exception("Failed to generate questions for section %s", section_id)
         
         if "GEMINI_API_KEY" in str(e) or "API key" in str(e):
             raise HTTPException(
@@ -74,26 +219,119 @@ def generate_questions(section_id: int, db: Session = Depends(get_db)):
             raise HTTPException(status_code=500, detail=f"Failed to generate questions: {str(e)}")
 
 
+@router.post("/sections/{section_id}/generate-questions/stream")
+async def stream_generate_questions(section_id: int, request: Request, bypass_cache: bool = False, db: AsyncSession = Depends(get_async_db)):
+    """Generate questions for a section, streaming each saved question as a Server-Sent Event.
+    
+    Events: `question` (a saved question), then `done` with the total count,
+    or `error` if generation fails part way through.
+    """
+    # Validate before the stream starts so these still return proper status codes
+    try:
+        await db.run_sync(question_service.get_section_for_generation, section_id)
+    except ValueError as e:
+        if "already exist" in str(e):
+            raise HTTPException(status_code=400, detail=str(e))
+        raise HTTPException(status_code=404, detail=str(e))
+    
+    tenant = request_tenant(request)
+    
+    async def event_stream():
+        # The request session may be closed before the stream finishes, so use our own
+        async with AsyncSessionLocal() as stream_db:
+            count = 0
+            try:
+                with generation_context(Priority.INTERACTIVE, tenant):
+                    async for question in question_service.stream_questions_for_section(stream_db, section_id, bypass_cache):
+                        count += 1
+                        yield format_sse("question", QuestionResponse.model_validate(question).model_dump_json())
+                yield format_sse("done", json.dumps({"section_id": section_id, "question_count": count}))
+            except Exception as e:
+                await stream_db.rollback()
+                yield format_sse("error", json.dumps({"detail": f"Failed to generate questions: {str(e)}", "question_count": count}))
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.post("/{exam_id}/generate-all", response_model=ExamGenerationResponse, status_code=status.HTTP_201_CREATED)
+async def generate_all_questions(exam_id: int, request: Request, bypass_cache: bool = False, db: AsyncSession = Depends(get_async_db)):
+    """Generate questions for all sections of an exam concurrently"""
+    try:
+        # A whole exam is bulk work: single-section requests are served first
+        with generation_context(Priority.BULK, request_tenant(request)):
+            results = await question_service.generate_questions_for_exam(db, exam_id, bypass_cache=bypass_cache)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to generate questions: {str(e)}")
+    
+    # Only report an error when nothing could be generated at all
+    attempted = [result for result in results if result["status"] != "skipped"]
+    if attempted and all(result["status"] == "failed" for result in attempted):
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to generate questions: {attempted[0]['detail']}"
+        )
+    
+    return {"exam_id": exam_id, "sections": results}
+
+
 @router.get("/sections/{section_id}/questions", response_model=List[QuestionResponse])
-def get_section_questions(section_id: int, db: Session = Depends(get_db)):
-    """Get all questions for a specific section"""
+async def get_section_questions(section_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
+    """Get all questions for a specific section (supports If-None-Match, like the exam)"""
     try:
-        questions = question_service.get_questions_for_section(db, section_id)
-        return questions
+        version = await db.run_sync(exam_repository.get_section_version, section_id)
+        if version is None:
+            raise ValueError(f"Section with ID {section_id} not found")
+        etag = f'"section-{section_id}-v{version}"'
+        
+        async def build():
+            questions = await db.run_sync(question_service.get_questions_for_section, section_id)
+            last_modified = max((question.last_modified or "" for question in questions), default="")
+            # Validated from the ORM objects first, like the single exam and question responses
+            body = question_list_adapter.dump_json(question_list_adapter.validate_python(questions, from_attributes=True))
+            return body, http_date(last_modified)
+        
+        return await conditional_json(request, ("section_questions", section_id), etag, build)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/sections/{section_id}/questions/import", response_model=List[QuestionResponse], status_code=status.HTTP_201_CREATED)
+async def import_section_questions(section_id: int, request: QuestionImportRequest, db: AsyncSession = Depends(get_async_db)):
+    """Bulk import questions into a section"""
+    try:
+        return await db.run_sync(question_service.import_questions, section_id, request.questions)
+    except ValueError as e:
+        if "not found" in str(e):
+            raise HTTPException(status_code=404, detail=str(e))
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 # New endpoints for question management and image upload
 
 @router.get("/questions/{question_id}", response_model=QuestionResponse)
-def get_question(question_id: int, db: Session = Depends(get_db)):
-    """Get a specific question by ID"""
+async def get_question(question_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
+    """Get a specific question by ID (ETag and Last-Modified follow its last_modified)"""
     try:
-        question = question_service.get_question(db, question_id)
-        return question
+        version = await db.run_sync(question_service.question_repository.get_question_version, question_id)
+        if version is None:
+            raise ValueError(f"Question with ID {question_id} not found")
+        etag = f'"question-{question_id}-{version}"'
+        
+        async def build():
+            question = await db.run_sync(question_service.get_question, question_id)
+            return QuestionResponse.model_validate(question).model_dump_json().encode(), None
+        
+        return await conditional_json(request, ("question", question_id), etag, build, last_modified=http_date(version))
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
@@ -101,10 +339,10 @@ def get_question(question_id: int, db: Session = Depends(get_db)):
 
 
 @router.put("/questions/{question_id}", response_model=QuestionResponse)
-def update_question(question_id: int, question_update: QuestionUpdate, db: Session = Depends(get_db)):
+async def update_question(question_id: int, question_update: QuestionUpdate, db: AsyncSession = Depends(get_async_db)):
     """Update a question's content"""
     try:
-        updated_question = question_service.update_question(db, question_id, question_update)
+        updated_question = await question_service.update_question(db, question_id, question_update)
         return updated_question
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
@@ -116,7 +354,7 @@ def update_question(question_id: int, question_update: QuestionUpdate, db: Sessi
 async def upload_question_image(
     question_id: int, 
     file: UploadFile = File(...), 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Upload an image for a question"""
     try:
@@ -132,17 +370,17 @@ async def upload_question_image(
 async def upload_option_image(
     section_id: int, 
     file: UploadFile = File(...), 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Upload an image for a question option"""
     try:
         # Verify section exists
-        section = exam_repository.get_section(db, section_id)
+        section = await db.run_sync(exam_repository.get_section, section_id)
         if not section:
             raise HTTPException(status_code=404, detail=f"Section with ID {section_id} not found")
         
         # Upload the image
-        result = await question_service.upload_option_image(file, section_id)
+        result = await question_service.upload_option_image(db, file, section_id)
         return result
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
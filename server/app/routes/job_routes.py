@@ -0,0 +1,40 @@
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.database import get_async_db
+from app.schemas.schemas import GenerateQuestionsRequest, JobResponse
+from app.services.job_service import JobService
+from app.utils.helpers import request_tenant
+
+router = APIRouter(prefix="/api/jobs", tags=["jobs"])
+job_service = JobService()
+
+
+@router.post("/generate-questions", response_model=JobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def enqueue_generate_questions(
+    request: GenerateQuestionsRequest,
+    http_request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Queue question generation for a section and return the job right away"""
+    try:
+        job = await db.run_sync(
+            job_service.enqueue_section_job, request.section_id, request.bypass_cache, request_tenant(http_request)
+        )
+    except ValueError as e:
+        if "already exist" in str(e):
+            raise HTTPException(status_code=400, detail=str(e))
+        raise HTTPException(status_code=404, detail=str(e))
+
+    response.headers["Location"] = f"{router.prefix}/{job.id}"
+    return job_service.describe_job(job)
+
+
+@router.get("/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str, db: AsyncSession = Depends(get_async_db)):
+    """Get the status and timing of a generation job"""
+    try:
+        return await db.run_sync(job_service.get_job, job_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
@@ -0,0 +1,143 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from typing import Iterable
+
+from app.core.database import async_engine, async_pool_metrics, engine, pool_metrics
+from app.core.logging_config import logging_stats
+from app.core.metrics import registry
+from app.services.export_service import exam_exporter
+from app.services.gemini_service import get_generation_cache, get_generation_scheduler, get_resilient_caller
+from app.services.question_bank_service import QuestionBankService
+from app.utils.metrics import Family
+from app.utils.response_cache import response_cache
+
+router = APIRouter(tags=["system"])
+question_bank_service = QuestionBankService()
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Get this process's metrics in the Prometheus text format"""
+    return PlainTextResponse(registry.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+
+# Collectors: stats kept by other components, read on every scrape
+
+def collect_db_pools() -> Iterable[Family]:
+    """Connection pool counters and usage of both engines (the /api/system/db-pool stats)"""
+    snapshots = {
+        "async": async_pool_metrics.snapshot(async_engine.pool),
+        "sync": pool_metrics.snapshot(engine.pool),
+    }
+    counters = [
+        ("checkouts_total", "checkouts", "Connections checked out of the pool"),
+        ("connects_total", "connects", "New database connections opened"),
+        ("invalidations_total", "invalidations", "Connections invalidated after an error"),
+        ("timeouts_total", "timeouts", "Checkouts that gave up waiting for a free connection"),
+        ("wait_seconds_total", "wait_seconds_total", "Time spent waiting for a free connection"),
+    ]
+    for name, key, documentation in counters:
+        yield (
+            f"questcart_db_pool_{name}", "counter", documentation,
+            [({"engine": label}, snapshot[key]) for label, snapshot in snapshots.items()]
+        )
+    gauges = [
+        ("size", "Persistent connections the pool keeps"),
+        ("checked_out", "Connections in use"),
+        ("checked_in", "Idle connections in the pool"),
+        ("overflow", "Connections open beyond the pool size"),
+    ]
+    for name, documentation in gauges:
+        samples = [({"engine": label}, snapshot[name]) for label, snapshot in snapshots.items() if name in snapshot]
+        if samples:
+            yield f"questcart_db_pool_{name}", "gauge", documentation, samples
+
+
+def collect_gemini() -> Iterable[Family]:
+    """Retry/hedging counters and the rate limiter's queues (the /api/system/gemini-* stats)"""
+    calls = get_resilient_caller().stats()
+    yield "questcart_gemini_calls_total", "counter", "Gemini calls, each including its retries and hedges", [({}, calls["calls"])]
+    yield "questcart_gemini_attempts_total", "counter", "Gemini requests made, retries and hedges included", [({}, calls["attempts"])]
+    yield (
+        "questcart_gemini_retries_total", "counter", "Gemini requests retried, by reason",
+        [({"reason": reason}, count) for reason, count in sorted(calls["retries_by_reason"].items())]
+    )
+    yield "questcart_gemini_failed_calls_total", "counter", "Gemini calls that failed after their retries", [({}, calls["failures"])]
+    yield (
+        "questcart_gemini_deadline_exceeded_total", "counter", "Gemini calls that ran out of time",
+        [({}, calls["deadline_exceeded"])]
+    )
+    yield "questcart_gemini_hedges_total", "counter", "Hedged Gemini requests sent", [({}, calls["hedges_fired"])]
+    yield "questcart_gemini_hedges_won_total", "counter", "Hedged Gemini requests that finished first", [({}, calls["hedges_won"])]
+
+    limiter = get_generation_scheduler().stats()
+    priorities = limiter["priorities"]
+    yield (
+        "questcart_gemini_queue_depth", "gauge", "Gemini calls waiting for the rate limiter, by priority",
+        [({"priority": priority}, stats["queue_depth"]) for priority, stats in priorities.items()]
+    )
+    yield (
+        "questcart_gemini_queue_granted_total", "counter", "Gemini calls let through by the rate limiter, by priority",
+        [({"priority": priority}, stats["granted"]) for priority, stats in priorities.items()]
+    )
+    yield (
+        "questcart_gemini_queue_timeouts_total", "counter", "Gemini calls that gave up waiting for the rate limiter",
+        [({"priority": priority}, stats["timeouts"]) for priority, stats in priorities.items()]
+    )
+    yield (
+        "questcart_gemini_queue_wait_seconds_total", "counter", "Time Gemini calls waited for the rate limiter",
+        [({"priority": priority}, stats["wait_seconds_total"]) for priority, stats in priorities.items()]
+    )
+    yield (
+        "questcart_gemini_limiter_available", "gauge", "Requests and tokens left in the rate limiter's buckets",
+        [({"bucket": bucket}, level) for bucket, level in sorted(limiter["available"].items())]
+    )
+
+
+def collect_caches() -> Iterable[Family]:
+    """Generation, response and export cache counters, and the question bank's size"""
+    generation_cache = get_generation_cache()
+    if generation_cache is not None:
+        stats = generation_cache.stats()
+        yield (
+            "questcart_generation_cache_lookups_total", "counter", "Generation cache lookups, by result",
+            [({"result": result}, stats[result]) for result in ("memory_hits", "disk_hits", "misses")]
+        )
+        yield (
+            "questcart_generation_cache_bytes", "gauge", "Size of the generation cache's disk tier",
+            [({}, stats["disk_bytes"])]
+        )
+
+    stats = response_cache.stats()
+    yield (
+        "questcart_response_cache_lookups_total", "counter", "Exam/question response cache lookups, by result",
+        [({"result": "hits"}, stats["hits"]), ({"result": "misses"}, stats["misses"])]
+    )
+
+    stats = exam_exporter.stats()
+    yield (
+        "questcart_export_cache_lookups_total", "counter", "Rendered export lookups, by result",
+        [({"result": "hits"}, stats["hits"]), ({"result": "misses"}, stats["misses"])]
+    )
+    yield "questcart_export_renders_total", "counter", "Exams rendered for export", [({}, stats["renders"])]
+    yield "questcart_export_render_seconds_total", "counter", "Time spent rendering exports", [({}, stats["render_seconds"])]
+    yield "questcart_export_cache_bytes", "gauge", "Size of the rendered exports on disk", [({}, stats["cached_bytes"])]
+
+    stats = question_bank_service.stats()
+    yield "questcart_question_bank_questions", "gauge", "Questions in this process's question bank index", [({}, stats["questions"])]
+
+
+def collect_logging() -> Iterable[Family]:
+    """Depth of the log queue and the records dropped because it was full"""
+    stats = logging_stats()
+    yield "questcart_log_queue_depth", "gauge", "Log records waiting for the writer thread", [({}, stats["queued"])]
+    yield (
+        "questcart_log_records_dropped_total", "counter", "Log records dropped because the log queue was full",
+        [({}, stats["dropped"])]
+    )
+
+
+for collector in (collect_db_pools, collect_gemini, collect_caches, collect_logging):
+    registry.register_collector(collector)
@@ -0,0 +1,71 @@
+from email.utils import formatdate, parsedate_to_datetime
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import FileResponse
+from urllib.parse import urlparse
+import mimetypes
+import os
+
+from app.core.config import settings
+from app.utils.helpers import IMAGE_TYPES
+from app.utils.response_cache import etag_matches
+from app.utils.storage_backends import LocalStorageBackend, get_storage_backend
+
+# Only included when STORAGE_BACKEND=local; the prefix is the path of LOCAL_STORAGE_URL
+router = APIRouter(prefix=urlparse(settings.LOCAL_STORAGE_URL).path.rstrip("/"), tags=["storage"])
+
+# Content types shown inline; anything else (e.g. a file stored before uploads were checked) is sent as a download
+INLINE_TYPES = frozenset(content_type for _, content_type in IMAGE_TYPES.values())
+
+
+@router.api_route("/{file_path:path}", methods=["GET", "HEAD"])
+def get_stored_file(file_path: str, request: Request):
+    """Serve an uploaded file from the local storage backend.
+
+    Responses carry a strong ETag, Last-Modified and a long-lived
+    Cache-Control; conditional requests get 304 and Range requests get
+    206 partial content. Files are served from the API's own origin, so
+    they are sandboxed and never sniffed into a type that runs scripts.
+    """
+    backend = get_storage_backend()
+    if not isinstance(backend, LocalStorageBackend):
+        raise HTTPException(status_code=404, detail="Not found")
+
+    try:
+        full_path = backend.resolve(file_path)
+        stat_result = os.stat(full_path)
+    except (ValueError, FileNotFoundError, NotADirectoryError):
+        raise HTTPException(status_code=404, detail="Not found")
+    if not os.path.isfile(full_path) or os.path.basename(full_path).startswith(".upload-"):
+        raise HTTPException(status_code=404, detail="Not found")
+
+    etag = f'"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "Cache-Control": f"public, max-age={settings.LOCAL_STORAGE_MAX_AGE}, immutable",
+        "X-Content-Type-Options": "nosniff",
+        "Content-Security-Policy": "default-src 'none'; sandbox",
+    }
+
+    if _not_modified(request, etag, stat_result.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    media_type = mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+    if media_type not in INLINE_TYPES:
+        headers["Content-Disposition"] = "attachment"
+    # FileResponse handles Range / If-Range and streams the file in chunks
+    return FileResponse(full_path, media_type=media_type, headers=headers, stat_result=stat_result)
+
+
+def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
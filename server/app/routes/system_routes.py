@@ -0,0 +1,88 @@
+from fastapi import APIRouter, Depends, status
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.database import async_engine, async_pool_metrics, engine, get_async_db, pool_metrics
+from app.services.export_service import exam_exporter
+from app.services.gemini_service import get_generation_cache, get_generation_scheduler, get_resilient_caller, token_usage_report
+from app.services.question_bank_service import QuestionBankService
+from app.utils.response_cache import response_cache
+
+router = APIRouter(prefix="/api/system", tags=["system"])
+question_bank_service = QuestionBankService()
+
+
+@router.get("/generation-cache")
+def get_generation_cache_stats():
+    """Get hit/miss counters and sizes of the generation cache"""
+    generation_cache = get_generation_cache()
+    if generation_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **generation_cache.stats()}
+
+
+@router.delete("/generation-cache", status_code=status.HTTP_204_NO_CONTENT)
+def clear_generation_cache():
+    """Remove every cached generation result"""
+    generation_cache = get_generation_cache()
+    if generation_cache is not None:
+        generation_cache.clear()
+
+
+@router.get("/gemini-limiter")
+def get_gemini_limiter_stats():
+    """Get the Gemini rate limiter's remaining quota, and queue depth and waiting times per priority.
+    
+    Queues and wait times are per process; the remaining quota is shared by
+    every worker when the limiter state lives in a file.
+    """
+    return get_generation_scheduler().stats()
+
+
+@router.get("/gemini-calls")
+def get_gemini_call_stats():
+    """Get retry, deadline and hedging counters, and recent Gemini latency per schema and batch size"""
+    return get_resilient_caller().stats()
+
+
+@router.get("/generation-tokens")
+def get_generation_token_stats():
+    """Get prompt and response tokens per generated question, by generation profile and question type"""
+    return token_usage_report()
+
+
+@router.get("/question-bank")
+def get_question_bank_stats():
+    """Get the size of this process's question bank index"""
+    return question_bank_service.stats()
+
+
+@router.post("/question-bank/rebuild")
+async def rebuild_question_bank(db: AsyncSession = Depends(get_async_db)):
+    """Rebuild this process's question bank index from the questions table"""
+    return await db.run_sync(question_bank_service.rebuild)
+
+
+@router.get("/db-pool")
+def get_db_pool_stats():
+    """Get connection pool checkout/wait counters and current pool usage.
+    
+    `async` is the pool used by request handlers, `sync` the one used by the
+    job workers.
+    """
+    return {
+        "dialect": engine.dialect.name,
+        "async": async_pool_metrics.snapshot(async_engine.pool),
+        "sync": pool_metrics.snapshot(engine.pool),
+    }
+
+
+@router.get("/export-cache")
+def get_export_cache_stats():
+    """Get hit/miss counters, render times and disk usage of rendered exam exports"""
+    return exam_exporter.stats()
+
+
+@router.get("/response-cache")
+def get_response_cache_stats():
+    """Get hit/miss counters of the exam/question response cache"""
+    return response_cache.stats()
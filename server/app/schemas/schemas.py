@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional, Union, Literal, Dict, Any
+from typing import Annotated, List, Optional, Union, Literal, Dict, Any
 from datetime import datetime
 from enum import Enum
 
@@ -28,6 +28,7 @@ class ExamCreate(BaseModel):
 class SectionResponse(SectionCreate):
     id: int
     exam_id: int
+    question_count: Optional[int] = None  # Only filled in when requested with include_counts
     
     class Config:
         from_attributes = True
@@ -49,6 +50,7 @@ class Option(BaseModel):
     text: str
     is_correct: bool
     image_url: Optional[str] = None
+    thumbnail_url: Optional[str] = None
 
 # Base Question Schema for Gemini API's structured response
 class QuestionBase(BaseModel):
@@ -74,37 +76,117 @@ QuestionUnion = Union[MCQQuestion, MSQQuestion, NumericalQuestion]
 # Request to generate questions for a section
 class GenerateQuestionsRequest(BaseModel):
     section_id: int
+    bypass_cache: bool = False  # Skip cached generation results and ask Gemini for fresh questions
 
 # Response for generated questions
 class GeneratedQuestionResponse(BaseModel):
     section_id: int
     questions: List[QuestionUnion]
     
+# Generation outcome for a single section of an exam
+class SectionGenerationResult(BaseModel):
+    section_id: int
+    status: Literal["generated", "skipped", "failed"]
+    question_count: int
+    detail: Optional[str] = None
+
+# Response for generating all sections of an exam
+class ExamGenerationResponse(BaseModel):
+    exam_id: int
+    sections: List[SectionGenerationResult]
+    
 # DB Question Schema
 class QuestionResponse(BaseModel):
     id: int
     section_id: int
     question_text: str
     question_type: QuestionType
-    options: Optional[str] = None
-    correct_answer: Optional[str] = None
+    options: Optional[List[Option]] = None
+    correct_answer: Optional[List[int]] = None  # Indexes of the correct options
     numerical_answer: Optional[float] = None
+    explanation: Optional[str] = None
     image_url: Optional[str] = None
+    thumbnail_url: Optional[str] = None
     last_modified: Optional[str] = None
     
     class Config:
         from_attributes = True
 
+# A question supplied by a client for bulk import
+class QuestionImport(BaseModel):
+    question_type: QuestionType
+    question_text: str
+    explanation: Optional[str] = None
+    image_url: Optional[str] = None
+    options: Optional[List[Option]] = None  # For MCQ/MSQ
+    answer: Optional[float] = None  # For NUM
+
+# Request to import questions into a section
+class QuestionImportRequest(BaseModel):
+    questions: List[QuestionImport]
+
+# Records of the NDJSON exam dump (one per line: each exam, then its sections, each followed by its questions).
+# IDs are those of the exporting database; sections and questions refer to records earlier in the file.
+class ExamRecord(BaseModel):
+    type: Literal["exam"] = "exam"
+    id: int
+    name: str
+    total_marks: Optional[float] = None
+    time_minutes: int
+    created_at: Optional[str] = None
+
+class SectionRecord(SectionCreate):
+    type: Literal["section"] = "section"
+    id: int
+    exam_id: int
+
+class QuestionRecord(BaseModel):
+    type: Literal["question"] = "question"
+    id: int
+    section_id: int
+    question_text: str
+    question_type: QuestionType
+    options: Optional[List[Option]] = None
+    correct_answer: Optional[List[int]] = None
+    numerical_answer: Optional[float] = None
+    explanation: Optional[str] = None
+    image_url: Optional[str] = None
+    thumbnail_url: Optional[str] = None
+    last_modified: Optional[str] = None
+
+DumpRecord = Annotated[Union[ExamRecord, SectionRecord, QuestionRecord], Field(discriminator="type")]
+
+# Result of an NDJSON import
+class ExamImportResponse(BaseModel):
+    exams: int
+    sections: int
+    questions: int
+    exam_ids: Dict[int, int]  # Exam ID in the file -> ID of the imported exam
+
 # Schema for question update
 class QuestionUpdate(BaseModel):
     question_text: Optional[str] = None
     options: Optional[List[Option]] = None
     numerical_answer: Optional[float] = None
+    explanation: Optional[str] = None
     
 # Schema for image upload response
 class ImageUploadResponse(BaseModel):
     image_url: str
+    thumbnail_url: Optional[str] = None  # Set when the image pipeline is enabled
     
 # Schema for question image update
 class QuestionImageUpdate(BaseModel):
-    image_url: str
\ No newline at end of file
+    image_url: str
+# Generation job status
+class JobResponse(BaseModel):
+    id: str
+    section_id: int
+    status: Literal["queued", "running", "succeeded", "failed"]
+    question_count: Optional[int] = None
+    error: Optional[str] = None
+    created_at: str
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+    queued_seconds: Optional[float] = None
+    run_seconds: Optional[float] = None
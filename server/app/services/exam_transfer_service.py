@@ -0,0 +1,195 @@
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+import json
+import logging
+import time
+
+from app.core.config import settings
+from app.models.models import QuestionType
+from app.repositories.exam_repository import ExamRepository
+from app.repositories.image_repository import ImageRepository
+from app.repositories.question_repository import QuestionRepository
+from app.schemas.schemas import DumpRecord, ExamRecord, QuestionRecord, SectionRecord
+from app.utils.json_stream import ndjson_lines
+
+logger = logging.getLogger(__name__)
+
+record_adapter = TypeAdapter(DumpRecord)
+
+
+class ExamTransferService:
+    """Dumps exams as NDJSON and loads such dumps back.
+
+    Both directions stream: the export reads one cursor in batches of
+    NDJSON_BATCH_SIZE rows and the import parses the request body line by
+    line, inserting questions NDJSON_BATCH_SIZE at a time. Only the ID
+    mapping of exams and sections grows with the size of a dump.
+    """
+
+    def __init__(self):
+        self.exam_repository = ExamRepository()
+        self.question_repository = QuestionRepository()
+        self.image_repository = ImageRepository()
+
+    async def export_ndjson(self, db: AsyncSession, exam_ids: Optional[List[int]] = None) -> AsyncIterator[bytes]:
+        """Yield the dump of all (or the given) exams, one batch of lines at a time"""
+        started = time.perf_counter()
+        query = self.exam_repository.dump_query(exam_ids).execution_options(yield_per=settings.NDJSON_BATCH_SIZE)
+        result = await db.stream(query)
+
+        last_exam_id = last_section_id = None
+        count = 0
+        async for rows in result.partitions():
+            lines = []
+            for row in rows:
+                if row.exam_id != last_exam_id:
+                    last_exam_id, last_section_id = row.exam_id, None
+                    lines.append(self._exam_line(row))
+                if row.section_id is not None and row.section_id != last_section_id:
+                    last_section_id = row.section_id
+                    lines.append(self._section_line(row))
+                if row.question_id is not None:
+                    lines.append(self._question_line(row))
+                    count += 1
+            yield "".join(lines).encode()
+
+        logger.info("Exported %d questions as NDJSON in %.2fs", count, time.perf_counter() - started)
+
+    async def import_ndjson(self, db: AsyncSession, chunks: AsyncIterator[bytes]) -> Dict[str, Any]:
+        """Import a dump in one transaction, so a bad line leaves nothing behind.
+
+        Raises:
+            ValueError: For lines that are not valid records or refer to records not earlier in the dump
+        """
+        started = time.perf_counter()
+        state = {"exams": {}, "sections": {}, "questions": 0}
+        batch: List[Tuple[int, Any]] = []
+        try:
+            line_number = 0
+            async for line in ndjson_lines(chunks):
+                line_number += 1
+                if not line.strip():
+                    continue
+                try:
+                    batch.append((line_number, record_adapter.validate_json(line)))
+                except ValidationError as e:
+                    error = e.errors()[0]
+                    location = ".".join(str(part) for part in error["loc"])
+                    raise ValueError(f"Line {line_number}: {location}: {error['msg']}")
+                if len(batch) >= settings.NDJSON_BATCH_SIZE:
+                    await db.run_sync(self._import_batch, state, batch)
+                    batch = []
+            if batch:
+                await db.run_sync(self._import_batch, state, batch)
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+
+        logger.info(
+            "Imported %d exams, %d sections and %d questions in %.2fs",
+            len(state["exams"]), len(state["sections"]), state["questions"], time.perf_counter() - started
+        )
+        return {
+            "exams": len(state["exams"]),
+            "sections": len(state["sections"]),
+            "questions": state["questions"],
+            "exam_ids": state["exams"],
+        }
+
+    def _import_batch(self, db: Session, state: Dict[str, Any], batch: List[Tuple[int, Any]]) -> None:
+        """Insert a batch of parsed records: exams and sections one by one, questions in one statement"""
+        rows = []
+        for line_number, record in batch:
+            if isinstance(record, ExamRecord):
+                state["exams"][record.id] = self.exam_repository.insert_exam_record(db, record)
+            elif isinstance(record, SectionRecord):
+                exam_id = state["exams"].get(record.exam_id)
+                if exam_id is None:
+                    raise ValueError(f"Line {line_number}: section {record.id} refers to exam {record.exam_id}, which is not earlier in the dump")
+                state["sections"][record.id] = self.exam_repository.insert_section_record(db, record, exam_id)
+            else:
+                section_id = state["sections"].get(record.section_id)
+                if section_id is None:
+                    raise ValueError(f"Line {line_number}: question {record.id} refers to section {record.section_id}, which is not earlier in the dump")
+                rows.append(self._question_row(record, section_id))
+        self.question_repository.insert_question_rows(db, rows)
+        # Images stored on this server gain a reference for each imported question or option using them
+        self.image_repository.add_references(
+            db,
+            [row["image_url"] for row in rows] + [option.get("image_url") for row in rows for option in row["options"] or []]
+        )
+        state["questions"] += len(rows)
+
+    def _question_row(self, record: QuestionRecord, section_id: int) -> Dict[str, Any]:
+        # Signatures are left empty; the near-duplicate check fills them in the first time it sees the exam
+        return {
+            "section_id": section_id,
+            "question_text": record.question_text,
+            "question_type": QuestionType(record.question_type.value),
+            "options": [option.model_dump() for option in record.options] if record.options is not None else None,
+            "correct_answer": record.correct_answer,
+            "numerical_answer": record.numerical_answer,
+            "explanation": record.explanation,
+            "image_url": record.image_url,
+            "thumbnail_url": record.thumbnail_url,
+            "last_modified": record.last_modified,
+        }
+
+    def _exam_line(self, row) -> str:
+        return _line({
+            "type": "exam",
+            "id": row.exam_id,
+            "name": row.exam_name,
+            "total_marks": row.total_marks,
+            "time_minutes": row.time_minutes,
+            "created_at": row.created_at,
+        })
+
+    def _section_line(self, row) -> str:
+        return _line({
+            "type": "section",
+            "id": row.section_id,
+            "exam_id": row.exam_id,
+            "name": row.section_name,
+            "total_questions": row.total_questions,
+            "questions_to_attempt": row.questions_to_attempt,
+            "marks_per_question": row.marks_per_question,
+            "negative_marking_allowed": row.negative_marking_allowed,
+            "negative_marks": row.negative_marks,
+            "question_type": row.section_type.value if row.section_type else None,
+        })
+
+    def _question_line(self, row) -> str:
+        line = _line({
+            "type": "question",
+            "id": row.question_id,
+            "section_id": row.section_id,
+            "question_text": row.question_text,
+            "question_type": row.question_type.value if row.question_type else None,
+            "numerical_answer": row.numerical_answer,
+            "explanation": row.explanation,
+            "image_url": row.image_url,
+            "thumbnail_url": row.thumbnail_url,
+            "last_modified": row.last_modified,
+        })
+        # The JSON columns are spliced in as stored rather than parsed and serialized again
+        return f'{line[:-2]},"options":{_raw_json(row.options)},"correct_answer":{_raw_json(row.correct_answer)}}}\n'
+
+
+def _line(record: Dict[str, Any]) -> str:
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+def _raw_json(value: Any) -> str:
+    """JSON text of a JSON column value read without the JSON type's processing"""
+    if value is None:
+        return "null"
+    if isinstance(value, (bytes, bytearray)):
+        value = value.decode()
+    if isinstance(value, str):
+        return value.strip() or "null"
+    # Drivers that decode JSON themselves (e.g. psycopg)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
@@ -0,0 +1,286 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from sqlalchemy.orm import Session
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+from urllib.parse import urlparse
+import asyncio
+import contextlib
+import glob
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from app.core.config import settings
+from app.repositories.exam_repository import ExamRepository
+from app.repositories.question_repository import QuestionRepository
+from app.utils.exam_renderer import (
+    PDF_AVAILABLE, RENDER_VERSION, ExamSnapshot, QuestionSnapshot, SectionSnapshot,
+    prepare_section_images, render_html_head, render_html_tail, render_pdf, render_section_html
+)
+from app.utils.storage_backends import get_storage_backend
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = {
+    "html": "text/html; charset=utf-8",
+    "pdf": "application/pdf",
+}
+
+_CHUNK_SIZE = 64 * 1024
+
+
+def _download_image(url: str) -> bytes:
+    """Fetch an image from an allowed host, without following redirects and up to MAX_UPLOAD_BYTES"""
+    import httpx
+
+    parsed = urlparse(url)
+    # Question image URLs come from users, so anything else could reach internal services
+    if parsed.scheme not in ("http", "https") or (parsed.hostname or "").lower() not in settings.EXPORT_IMAGE_HOSTS:
+        raise ValueError("not from the storage backend or EXPORT_IMAGE_HOSTS")
+
+    with httpx.stream("GET", url, timeout=settings.EXPORT_IMAGE_TIMEOUT, follow_redirects=False) as response:
+        response.raise_for_status()
+        if response.status_code != 200:
+            raise ValueError(f"unexpected response {response.status_code}")
+        data = bytearray()
+        for chunk in response.iter_bytes():
+            data += chunk
+            if len(data) > settings.MAX_UPLOAD_BYTES:
+                raise ValueError(f"larger than {settings.MAX_UPLOAD_BYTES} bytes")
+        return bytes(data)
+
+
+class ExamExporter:
+    """Renders exams to HTML or PDF and keeps the results on disk.
+
+    Sections are rendered as separate tasks in a thread pool (for PDFs
+    that includes fetching and downscaling their images, which is I/O and
+    Pillow work that releases the GIL). HTML is streamed section by section
+    as soon as each one, and those before it, are done; a PDF can only be
+    written once it is laid out, so it is streamed after that.
+
+    Rendered files are named after the exam's version, which changes with
+    every question edit, so a cached file is served for as long as the exam
+    is unchanged and never needs invalidating.
+    """
+
+    def __init__(self, workers: int = 4, cache_path: str = "", cache_max_bytes: int = 0):
+        self.workers = max(1, workers)
+        self.cache_path = cache_path
+        self.cache_max_bytes = cache_max_bytes
+        self.exam_repository = ExamRepository()
+        self.question_repository = QuestionRepository()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "renders": 0, "render_seconds": 0.0}
+
+    @property
+    def pdf_available(self) -> bool:
+        return PDF_AVAILABLE
+
+    def snapshot(self, db: Session, exam_id: int) -> ExamSnapshot:
+        """Read everything an export shows of an exam"""
+        exam = self.exam_repository.get_exam(db, exam_id)
+        if not exam:
+            raise ValueError(f"Exam with ID {exam_id} not found")
+
+        by_section: Dict[int, List] = {}
+        for question in self.question_repository.get_questions_by_exam(db, exam_id):
+            by_section.setdefault(question.section_id, []).append(question)
+
+        sections = []
+        number = 1
+        for section in sorted(exam.sections, key=lambda section: section.id):
+            questions = []
+            for question in by_section.get(section.id, []):
+                questions.append(QuestionSnapshot(
+                    number=number,
+                    text=question.question_text,
+                    question_type=question.question_type.value,
+                    image_url=question.image_url,
+                    options=[(option.get("text"), option.get("image_url")) for option in question.options or []]
+                ))
+                number += 1
+            sections.append(SectionSnapshot(
+                name=section.name,
+                question_type=section.question_type.value,
+                total_questions=section.total_questions,
+                questions_to_attempt=section.questions_to_attempt,
+                marks_per_question=section.marks_per_question,
+                negative_marks=section.negative_marks if section.negative_marking_allowed else None,
+                questions=questions
+            ))
+
+        return ExamSnapshot(
+            id=exam.id,
+            name=exam.name,
+            version=exam.version or 0,
+            total_marks=exam.total_marks,
+            time_minutes=exam.time_minutes,
+            sections=sections
+        )
+
+    def cached_path(self, exam_id: int, version: int, export_format: str) -> Optional[str]:
+        """Path of an already rendered export of this exam version, if there is one"""
+        path = self._artifact_path(exam_id, version, export_format)
+        if path is None or not os.path.isfile(path):
+            with self._lock:
+                self._counters["misses"] += 1
+            return None
+        with self._lock:
+            self._counters["hits"] += 1
+        # Touched on every hit, so pruning removes the least recently used exports
+        with contextlib.suppress(OSError):
+            os.utime(path)
+        return path
+
+    async def stream(self, exam: ExamSnapshot, export_format: str) -> AsyncIterator[bytes]:
+        """Render an exam, yielding the output as it is produced and caching it once complete"""
+        started = time.perf_counter()
+        if export_format == "html":
+            chunks = self._stream_html(exam)
+        else:
+            chunks = self._stream_pdf(exam)
+
+        with self._cache_writer(exam, export_format) as write:
+            async for chunk in chunks:
+                write(chunk)
+                yield chunk
+
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._counters["renders"] += 1
+            self._counters["render_seconds"] += elapsed
+        logger.info("Rendered exam %s v%s as %s in %.2fs", exam.id, exam.version, export_format, elapsed)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            counters = dict(self._counters)
+        counters["render_seconds"] = round(counters["render_seconds"], 3)
+        counters["cached_files"], counters["cached_bytes"] = self._cache_usage()
+        return counters
+
+    def shutdown(self) -> None:
+        """Stop the render threads"""
+        with self._lock:
+            if self._executor:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    async def _stream_html(self, exam: ExamSnapshot) -> AsyncIterator[bytes]:
+        futures = [self._get_executor().submit(render_section_html, section) for section in exam.sections]
+        try:
+            yield render_html_head(exam).encode()
+            for future in futures:
+                yield (await asyncio.wrap_future(future)).encode()
+            yield render_html_tail().encode()
+        finally:
+            for future in futures:
+                future.cancel()
+
+    async def _stream_pdf(self, exam: ExamSnapshot) -> AsyncIterator[bytes]:
+        executor = self._get_executor()
+        futures: List[Future] = [
+            executor.submit(prepare_section_images, section, self._fetch_image) for section in exam.sections
+        ]
+        try:
+            images = {}
+            for future in futures:
+                images.update(await asyncio.wrap_future(future))
+        finally:
+            for future in futures:
+                future.cancel()
+
+        document = await asyncio.wrap_future(executor.submit(render_pdf, exam, images, settings.EXPORT_PDF_FONT or None))
+        for start in range(0, len(document), _CHUNK_SIZE):
+            yield document[start:start + _CHUNK_SIZE]
+
+    def _fetch_image(self, url: str) -> Optional[bytes]:
+        """Image bytes from the storage backend, or over HTTP from EXPORT_IMAGE_HOSTS (None if unavailable)"""
+        try:
+            backend = get_storage_backend()
+            path = backend.path_for(url)
+            if path is not None:
+                return backend.read(path)
+            return _download_image(url)
+        except Exception as e:
+            logger.warning("Leaving image %s out of the export: %s", url, e)
+            return None
+
+    @contextlib.contextmanager
+    def _cache_writer(self, exam: ExamSnapshot, export_format: str) -> Iterator:
+        """Collect streamed chunks into a temporary file that replaces the cached export once complete"""
+        path = self._artifact_path(exam.id, exam.version, export_format)
+        if path is None:
+            yield lambda chunk: None
+            return
+
+        os.makedirs(self.cache_path, exist_ok=True)
+        handle = tempfile.NamedTemporaryFile(dir=self.cache_path, prefix=".render-", delete=False)
+        try:
+            yield handle.write
+            handle.close()
+            os.replace(handle.name, path)
+        except BaseException:
+            # Client went away or rendering failed; never leave a partial file behind
+            handle.close()
+            with contextlib.suppress(OSError):
+                os.remove(handle.name)
+            raise
+        self._prune(exam.id, export_format, keep=path)
+
+    def _artifact_path(self, exam_id: int, version: int, export_format: str) -> Optional[str]:
+        if not self.cache_path:
+            return None
+        return os.path.join(self.cache_path, f"exam-{exam_id}-v{version}-r{RENDER_VERSION}.{export_format}")
+
+    def _prune(self, exam_id: int, export_format: str, keep: str) -> None:
+        """Remove older versions of this export, then the least recently used files above the size limit"""
+        for path in glob.glob(os.path.join(self.cache_path, f"exam-{exam_id}-v*.{export_format}")):
+            if path != keep:
+                with contextlib.suppress(OSError):
+                    os.remove(path)
+
+        if self.cache_max_bytes <= 0:
+            return
+        files = []
+        for path in glob.glob(os.path.join(self.cache_path, "exam-*")):
+            with contextlib.suppress(OSError):
+                stat_result = os.stat(path)
+                files.append((stat_result.st_mtime, stat_result.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.cache_max_bytes:
+                break
+            if path == keep:
+                continue
+            with contextlib.suppress(OSError):
+                os.remove(path)
+                total -= size
+
+    def _cache_usage(self):
+        if not self.cache_path:
+            return 0, 0
+        sizes = []
+        for path in glob.glob(os.path.join(self.cache_path, "exam-*")):
+            with contextlib.suppress(OSError):
+                sizes.append(os.path.getsize(path))
+        return len(sizes), sum(sizes)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # Created on first use, like the image pipeline's pool
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="exam-export")
+            return self._executor
+
+
+if settings.EXPORT_PDF_FONT and not os.path.isfile(settings.EXPORT_PDF_FONT):
+    logger.warning("EXPORT_PDF_FONT %s does not exist; PDF exports will fail", settings.EXPORT_PDF_FONT)
+
+exam_exporter = ExamExporter(
+    workers=settings.EXPORT_WORKERS,
+    cache_path=settings.EXPORT_CACHE_PATH,
+    cache_max_bytes=settings.EXPORT_CACHE_MAX_BYTES
+)
@@ -0,0 +1,424 @@
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait as wait_futures
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, Optional, TypeVar
+import asyncio
+import contextvars
+import logging
+import math
+import random
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# HTTP status codes worth retrying: rate limited, or a server-side failure
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class CallDeadlineExceeded(TimeoutError):
+    """Raised when a call (including its retries) ran out of time"""
+
+
+def error_status(exc: BaseException) -> Optional[int]:
+    """HTTP status of an API error (google-genai errors carry it as `code`)"""
+    for attribute in ("code", "status_code"):
+        value = getattr(exc, attribute, None)
+        if isinstance(value, int):
+            return value
+    return None
+
+
+def is_transient(exc: BaseException) -> bool:
+    """Whether an error from a Gemini call is worth retrying"""
+    if isinstance(exc, CallDeadlineExceeded):
+        return False
+    if isinstance(exc, (TimeoutError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    status = error_status(exc)
+    if status is not None:
+        return status in TRANSIENT_STATUS_CODES
+    try:
+        import httpx
+    except ImportError:
+        return False
+    return isinstance(exc, (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError))
+
+
+def retry_reason(exc: BaseException) -> str:
+    """Label for the retry counters"""
+    status = error_status(exc)
+    if status == 429:
+        return "rate_limited"
+    if status is not None:
+        return "server_error"
+    if isinstance(exc, (TimeoutError, asyncio.TimeoutError)) or "Timeout" in type(exc).__name__:
+        return "timeout"
+    return "connection"
+
+
+def retry_after_seconds(exc: BaseException) -> Optional[float]:
+    """The delay the server asked for: a Retry-After header, or the RetryInfo detail of a 429"""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers is not None:
+        value = headers.get("retry-after")
+        if value:
+            try:
+                return max(0.0, float(value))
+            except ValueError:
+                pass  # HTTP-date form, not used by the API
+
+    details = getattr(exc, "details", None)
+    if isinstance(details, dict):
+        for detail in details.get("error", {}).get("details", []) or []:
+            delay = detail.get("retryDelay") if isinstance(detail, dict) else None
+            match = re.fullmatch(r"([\d.]+)s", delay or "")
+            if match:
+                return float(match.group(1))
+    return None
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter, capped, and never shorter than Retry-After"""
+
+    def __init__(
+        self,
+        max_attempts: int = 4,
+        base_delay: float = 1.0,
+        max_delay: float = 30.0,
+        rng: Callable[[float, float], float] = random.uniform
+    ):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rng = rng
+
+    def backoff(self, retry: int, retry_after: Optional[float] = None) -> float:
+        """Seconds to wait before retry number `retry` (0-based)"""
+        delay = self.rng(0, min(self.max_delay, self.base_delay * 2 ** retry))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+
+class LatencyTracker:
+    """Recent successful call latencies, kept per kind of call (e.g. batch size)"""
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._samples: Dict[Hashable, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, key: Hashable, seconds: float) -> None:
+        with self._lock:
+            self._samples.setdefault(key, deque(maxlen=self.window)).append(seconds)
+
+    def quantile(self, key: Hashable, q: float, min_samples: int = 1) -> Optional[float]:
+        """The q-quantile of the recent latencies, or None with fewer than min_samples"""
+        with self._lock:
+            samples = sorted(self._samples.get(key, ()))
+        if not samples or len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, math.ceil(q * len(samples)) - 1)]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = {key: len(samples) for key, samples in self._samples.items()}
+        return {
+            str(key): {
+                "samples": count,
+                "p50_seconds": self.quantile(key, 0.5),
+                "p95_seconds": self.quantile(key, 0.95),
+            }
+            for key, count in counts.items()
+        }
+
+
+class ResilientCaller:
+    """Runs Gemini calls with retries, a deadline and optional hedging.
+
+    An attempt is a callable taking the seconds it may run for. Transient
+    failures (429, 5xx, timeouts, dropped connections) are retried with
+    jittered exponential backoff, waiting at least as long as the server's
+    Retry-After, until `max_attempts` or the call's `deadline` is reached.
+
+    With hedging on, an attempt that is still running after the recent p95
+    latency for its kind of call gets a second, identical attempt, and
+    whichever succeeds first is used. Async losers are cancelled; a sync
+    loser can't be interrupted and finishes in the background.
+
+    `on_attempt`, if given, is called after every finished attempt with its
+    key, duration and error (None on success), e.g. to export metrics.
+    """
+
+    def __init__(
+        self,
+        policy: RetryPolicy,
+        attempt_timeout: float = 120.0,
+        deadline: float = 300.0,
+        hedging: bool = False,
+        hedge_quantile: float = 0.95,
+        hedge_min_samples: int = 20,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+        on_attempt: Optional[Callable[[Hashable, float, Optional[BaseException]], None]] = None
+    ):
+        self.policy = policy
+        self.attempt_timeout = attempt_timeout
+        self.deadline = deadline
+        self.hedging = hedging
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.clock = clock
+        self.sleep = sleep
+        self.on_attempt = on_attempt
+        self.latencies = LatencyTracker()
+
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Any] = {
+            "calls": 0,
+            "attempts": 0,
+            "retries": 0,
+            "retries_by_reason": {},
+            "retry_after_honoured": 0,
+            "failures": 0,
+            "deadline_exceeded": 0,
+            "hedges_fired": 0,
+            "hedges_won": 0,
+        }
+
+    def call(
+        self,
+        attempt: Callable[[float], T],
+        key: Hashable = None,
+        acquire: Optional[Callable[[], None]] = None,
+        hedge: bool = True
+    ) -> T:
+        """Run a sync attempt until it succeeds, retrying transient errors.
+
+        `acquire` runs before every attempt (e.g. waiting for the rate
+        limiter) and doesn't count towards the attempt's time. Calls with
+        `hedge=False` are never hedged.
+        """
+        self._increment("calls")
+        deadline = self.clock() + self.deadline
+        retry = 0
+        while True:
+            timeout = self._attempt_timeout(deadline)
+            try:
+                return self._run_hedged(attempt, timeout, key, acquire, hedge)
+            except Exception as e:
+                delay = self._retry_delay(e, retry, deadline)
+                logger.warning("Gemini call failed (%s: %s), retrying in %.2fs", retry_reason(e), e, delay)
+            self.sleep(delay)
+            retry += 1
+
+    async def call_async(
+        self,
+        attempt: Callable[[float], Awaitable[T]],
+        key: Hashable = None,
+        acquire: Optional[Callable[[], Awaitable[None]]] = None,
+        hedge: bool = True
+    ) -> T:
+        """Run an async attempt until it succeeds, retrying transient errors (see `call`)"""
+        self._increment("calls")
+        deadline = self.clock() + self.deadline
+        retry = 0
+        while True:
+            timeout = self._attempt_timeout(deadline)
+            try:
+                return await self._run_hedged_async(attempt, timeout, key, acquire, hedge)
+            except Exception as e:
+                delay = self._retry_delay(e, retry, deadline)
+                logger.warning("Gemini call failed (%s: %s), retrying in %.2fs", retry_reason(e), e, delay)
+            await asyncio.sleep(delay)
+            retry += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Retry and hedge counters, and recent latency per kind of call"""
+        with self._lock:
+            counters = {**self._counters, "retries_by_reason": dict(self._counters["retries_by_reason"])}
+        return {
+            **counters,
+            "hedging": self.hedging,
+            "max_attempts": self.policy.max_attempts,
+            "latency": self.latencies.stats(),
+        }
+
+    def shutdown(self) -> None:
+        """Stop the hedging thread pool, if it was started"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    # Retry bookkeeping
+
+    def _attempt_timeout(self, deadline: float) -> float:
+        remaining = deadline - self.clock()
+        if remaining <= 0:
+            self._increment("failures")
+            self._increment("deadline_exceeded")
+            raise CallDeadlineExceeded(f"Gemini call exceeded its {self.deadline:g}s deadline")
+        return min(self.attempt_timeout, remaining)
+
+    def _retry_delay(self, exc: Exception, retry: int, deadline: float) -> float:
+        """Seconds to back off before the next attempt; re-raises when the error is final"""
+        if not is_transient(exc) or retry + 1 >= self.policy.max_attempts:
+            self._increment("failures")
+            raise exc
+        retry_after = retry_after_seconds(exc)
+        delay = self.policy.backoff(retry, retry_after)
+        if self.clock() + delay >= deadline:
+            self._increment("failures")
+            self._increment("deadline_exceeded")
+            raise CallDeadlineExceeded(f"Gemini call would exceed its {self.deadline:g}s deadline before retrying") from exc
+
+        reason = retry_reason(exc)
+        with self._lock:
+            self._counters["retries"] += 1
+            self._counters["retries_by_reason"][reason] = self._counters["retries_by_reason"].get(reason, 0) + 1
+            if retry_after is not None:
+                self._counters["retry_after_honoured"] += 1
+        return delay
+
+    def _increment(self, counter: str) -> None:
+        with self._lock:
+            self._counters[counter] += 1
+
+    def _record_latency(self, key: Hashable, seconds: float) -> None:
+        self.latencies.record(key, seconds)
+        self._observe(key, seconds, None)
+
+    def _observe(self, key: Hashable, seconds: float, error: Optional[BaseException]) -> None:
+        if self.on_attempt is None:
+            return
+        try:
+            self.on_attempt(key, seconds, error)
+        except Exception:
+            logger.exception("Gemini attempt observer failed")
+
+    def _hedge_delay(self, key: Hashable) -> Optional[float]:
+        if not self.hedging:
+            return None
+        return self.latencies.quantile(key, self.hedge_quantile, self.hedge_min_samples)
+
+    def _timed(self, attempt: Callable[[float], T], timeout: float, key: Hashable, acquire: Optional[Callable[[], None]] = None) -> T:
+        if acquire:
+            acquire()
+        self._increment("attempts")
+        start = self.clock()
+        try:
+            result = attempt(timeout)
+        except Exception as e:
+            self._observe(key, self.clock() - start, e)
+            raise
+        self._record_latency(key, self.clock() - start)
+        return result
+
+    async def _timed_async(
+        self,
+        attempt: Callable[[float], Awaitable[T]],
+        timeout: float,
+        key: Hashable,
+        acquire: Optional[Callable[[], Awaitable[None]]] = None
+    ) -> T:
+        if acquire:
+            await acquire()
+        self._increment("attempts")
+        start = self.clock()
+        try:
+            result = await attempt(timeout)
+        except Exception as e:
+            self._observe(key, self.clock() - start, e)
+            raise
+        self._record_latency(key, self.clock() - start)
+        return result
+
+    # Hedging (the primary attempt acquires before the race starts; a hedge acquires for itself)
+
+    def _run_hedged(
+        self,
+        attempt: Callable[[float], T],
+        timeout: float,
+        key: Hashable,
+        acquire: Optional[Callable[[], None]],
+        hedge: bool
+    ) -> T:
+        hedge_delay = self._hedge_delay(key) if hedge else None
+        if hedge_delay is None or hedge_delay >= timeout:
+            return self._timed(attempt, timeout, key, acquire)
+
+        if acquire:
+            acquire()
+        executor = self._get_executor()
+        # Copies of this context, so both attempts keep the caller's priority and tenant
+        primary = executor.submit(contextvars.copy_context().run, self._timed, attempt, timeout, key)
+        done, _ = wait_futures([primary], timeout=hedge_delay)
+        if done:
+            return primary.result()
+
+        self._increment("hedges_fired")
+        second = executor.submit(contextvars.copy_context().run, self._timed, attempt, timeout - hedge_delay, key, acquire)
+        pending = {primary, second}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait_futures(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is second:
+                        self._increment("hedges_won")
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+    async def _run_hedged_async(
+        self,
+        attempt: Callable[[float], Awaitable[T]],
+        timeout: float,
+        key: Hashable,
+        acquire: Optional[Callable[[], Awaitable[None]]],
+        hedge: bool
+    ) -> T:
+        hedge_delay = self._hedge_delay(key) if hedge else None
+        if hedge_delay is None or hedge_delay >= timeout:
+            return await self._timed_async(attempt, timeout, key, acquire)
+
+        if acquire:
+            await acquire()
+        primary = asyncio.ensure_future(self._timed_async(attempt, timeout, key))
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=hedge_delay)
+            if done:
+                return primary.result()
+
+            self._increment("hedges_fired")
+            second = asyncio.ensure_future(self._timed_async(attempt, timeout - hedge_delay, key, acquire))
+            tasks.append(second)
+            pending = {primary, second}
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self._increment("hedges_won")
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            # Cancelling the loser (or both, if the caller was cancelled) closes its request
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(thread_name_prefix="gemini-hedge")
+            return self._executor
@@ -1,25 +1,152 @@
-from google import genai
-from google.genai import types
-from typing import List, Dict, Any, Union, Optional
+from typing import List, Dict, Any, AsyncIterator, Union, Optional
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import contextvars
 import os
 import json
 import logging
+import threading
 from dotenv import load_dotenv
 from pydantic import BaseModel, Field
 
+from app.core.config import settings
+from app.core.logging_config import log_payload, sample_payloads
+from app.core.metrics import gemini_errors, gemini_questions, gemini_request_duration, gemini_tokens
 from app.models.models import Section, QuestionType
 from app.schemas.schemas import QuestionUnion, MCQQuestion, MSQQuestion, NumericalQuestion, Option
+from app.services.gemini_stub import StubGeminiClient
+from app.services.gemini_retry import CallDeadlineExceeded, ResilientCaller, RetryPolicy, is_transient, retry_reason
+from app.services.generation_cache import GenerationCache
+from app.services.rate_limiter import GenerationScheduler, RateLimiter, SqliteTokenBucketStore
+from app.utils.helpers import normalize_question_text
+from app.utils.json_stream import JsonArrayStreamParser
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-# Initialize the Gemini client
-api_key = os.getenv("GEMINI_API_KEY", "your-api-key")
-logger.info(f"Initializing Gemini client with API key {'provided' if api_key != 'your-api-key' else 'NOT PROVIDED'}")
-client = genai.Client(api_key=api_key)
+# Shared Gemini client and generation cache, created on first use (see get_gemini_client)
+_client = None
+_generation_cache: Optional[GenerationCache] = None
+_generation_scheduler: Optional[GenerationScheduler] = None
+_resilient_caller: Optional[ResilientCaller] = None
+_client_lock = threading.Lock()
+
+
+def get_gemini_client():
+    """Get the shared Gemini client, creating it on first use.
+    
+    The google-genai SDK is only imported here, so importing this module (and
+    starting the API) doesn't pay for it.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            if settings.GEMINI_USE_STUB:
+                logger.info("Using the offline Gemini stub client (GEMINI_USE_STUB is set)")
+                _client = StubGeminiClient(latency=settings.GEMINI_STUB_LATENCY, failure_rate=settings.GEMINI_STUB_FAILURE_RATE)
+            else:
+                from google import genai
+                
+                api_key = os.getenv("GEMINI_API_KEY", "your-api-key")
+                logger.info("Initializing Gemini client with API key %s", "provided" if api_key != "your-api-key" else "NOT PROVIDED")
+                _client = genai.Client(api_key=api_key)
+        return _client
+
+
+def get_generation_cache() -> Optional[GenerationCache]:
+    """Get the shared cache of generation results, creating it on first use (None when disabled)"""
+    global _generation_cache
+    if not settings.GENERATION_CACHE_ENABLED:
+        return None
+    with _client_lock:
+        if _generation_cache is None:
+            _generation_cache = GenerationCache(
+                path=settings.GENERATION_CACHE_PATH or None,
+                memory_entries=settings.GENERATION_CACHE_MEMORY_ENTRIES,
+                disk_max_bytes=settings.GENERATION_CACHE_DISK_MAX_BYTES,
+                ttl_seconds=settings.GENERATION_CACHE_TTL_SECONDS,
+            )
+        return _generation_cache
+
+
+def get_generation_scheduler() -> GenerationScheduler:
+    """Get the shared rate limiter and priority queue for Gemini calls, creating it on first use"""
+    global _generation_scheduler
+    with _client_lock:
+        if _generation_scheduler is None:
+            store = SqliteTokenBucketStore(settings.GEMINI_RATE_LIMIT_PATH) if settings.GEMINI_RATE_LIMIT_PATH else None
+            limiter = RateLimiter(settings.GEMINI_RPM_LIMIT, settings.GEMINI_TPM_LIMIT, store=store)
+            _generation_scheduler = GenerationScheduler(limiter, queue_timeout=settings.GEMINI_QUEUE_TIMEOUT)
+        return _generation_scheduler
+
+
+def get_resilient_caller() -> ResilientCaller:
+    """Get the shared retry/hedging layer for Gemini calls, creating it on first use"""
+    global _resilient_caller
+    with _client_lock:
+        if _resilient_caller is None:
+            _resilient_caller = ResilientCaller(
+                RetryPolicy(
+                    max_attempts=settings.GEMINI_MAX_ATTEMPTS,
+                    base_delay=settings.GEMINI_RETRY_BASE_DELAY,
+                    max_delay=settings.GEMINI_RETRY_MAX_DELAY,
+                ),
+                attempt_timeout=settings.GEMINI_ATTEMPT_TIMEOUT,
+                deadline=settings.GEMINI_CALL_DEADLINE,
+                hedging=settings.GEMINI_HEDGING_ENABLED,
+                hedge_quantile=settings.GEMINI_HEDGE_QUANTILE,
+                hedge_min_samples=settings.GEMINI_HEDGE_MIN_SAMPLES,
+                on_attempt=_observe_attempt,
+            )
+        return _resilient_caller
+
+
+def _observe_attempt(key, seconds: float, error: Optional[BaseException]) -> None:
+    """Export the duration and outcome of one Gemini request (keys start with the schema name)"""
+    question_type, profile = _CALL_LABELS.get(key[0] if isinstance(key, tuple) else key, (str(key), "none"))
+    gemini_request_duration.observe(seconds, question_type=question_type, profile=profile, outcome="error" if error else "success")
+    if error is not None:
+        reason = retry_reason(error) if is_transient(error) else "permanent"
+        gemini_errors.inc(question_type=question_type, profile=profile, reason=reason)
+
+
+def token_usage_report() -> Dict[str, Dict[str, Dict[str, float]]]:
+    """Tokens per generated question by generation profile and question type, since the process started"""
+    report: Dict[str, Dict[str, Dict[str, float]]] = {}
+    for labels, questions in gemini_questions.samples():
+        prompt_tokens = gemini_tokens.value(kind="prompt", **labels)
+        response_tokens = gemini_tokens.value(kind="response", **labels)
+        report.setdefault(labels["profile"], {})[labels["question_type"]] = {
+            "questions": questions,
+            "prompt_tokens": prompt_tokens,
+            "response_tokens": response_tokens,
+            "prompt_tokens_per_question": round(prompt_tokens / questions, 1),
+            "response_tokens_per_question": round(response_tokens / questions, 1),
+        }
+    return report
+
+
+def stop_generation_scheduler() -> None:
+    """Stop the scheduler's dispatcher thread, if the scheduler was created"""
+    with _client_lock:
+        scheduler = _generation_scheduler
+    if scheduler is not None:
+        scheduler.stop()
+
+
+async def close_gemini_client() -> None:
+    """Close the shared Gemini client's connections and hedging threads, if they were created"""
+    global _client
+    with _client_lock:
+        client, _client = _client, None
+        caller = _resilient_caller
+    if caller is not None:
+        caller.shutdown()
+    if client is None or isinstance(client, StubGeminiClient):
+        return
+    await client.aio.aclose()
+    client.close()
 
 # Define Pydantic models for schema validation
 class OptionModel(BaseModel):
@@ -28,7 +155,6 @@ class OptionModel(BaseModel):
 
 class MCQModel(BaseModel):
     question_text: str
-    explanation: str
     options: List[OptionModel]
 
 class MCQBatchModel(BaseModel):
@@ -36,7 +162,6 @@ class MCQBatchModel(BaseModel):
 
 class MSQModel(BaseModel):
     question_text: str
-    explanation: str
     options: List[OptionModel]
 
 class MSQBatchModel(BaseModel):
@@ -44,188 +169,599 @@ class MSQBatchModel(BaseModel):
 
 class NumericalModel(BaseModel):
     question_text: str
-    explanation: str
     answer: float
 
 class NumericalBatchModel(BaseModel):
     questions: List[NumericalModel]
 
+# The full profile also asks for an explanation, written before the answer as it was originally
+class MCQExplainedModel(BaseModel):
+    question_text: str
+    explanation: str
+    options: List[OptionModel]
+
+class MCQExplainedBatchModel(BaseModel):
+    questions: List[MCQExplainedModel]
+
+class MSQExplainedModel(BaseModel):
+    question_text: str
+    explanation: str
+    options: List[OptionModel]
+
+class MSQExplainedBatchModel(BaseModel):
+    questions: List[MSQExplainedModel]
+
+class NumericalExplainedModel(BaseModel):
+    question_text: str
+    explanation: str
+    answer: float
+
+class NumericalExplainedBatchModel(BaseModel):
+    questions: List[NumericalExplainedModel]
+
+class TopicPlanModel(BaseModel):
+    topics: List[str]
+
+# Response schema per generation profile and question type: "lean" asks only for what a question
+# needs, "full" adds an explanation of the answer, which is saved with the question
+GENERATION_PROFILES = {
+    "lean": {
+        QuestionType.MCQ: MCQBatchModel,
+        QuestionType.MSQ: MSQBatchModel,
+        QuestionType.NUM: NumericalBatchModel,
+    },
+    "full": {
+        QuestionType.MCQ: MCQExplainedBatchModel,
+        QuestionType.MSQ: MSQExplainedBatchModel,
+        QuestionType.NUM: NumericalExplainedBatchModel,
+    },
+}
+
+# Metric labels (question type, profile) for the calls of each response schema
+_CALL_LABELS = {
+    schema.__name__: (question_type.value, profile)
+    for profile, schemas in GENERATION_PROFILES.items()
+    for question_type, schema in schemas.items()
+}
+_CALL_LABELS[TopicPlanModel.__name__] = ("topic_plan", "none")
+
+# Rules shared by every question generation call, sent as the system instruction so the per-section
+# prompt only says what to generate
+SYSTEM_INSTRUCTION = """You write questions for competitive exams.
+- Questions are challenging but fair, unambiguous and answerable without outside material.
+- MCQ: exactly 4 options, exactly one of them correct.
+- MSQ: exactly 4 options, between 1 and 3 of them correct.
+- Numerical: one precise numerical answer.
+- When the response schema has an explanation field, explain the answer in at most two sentences.
+- Respond only with JSON matching the response schema."""
+
+_TYPE_NAMES = {
+    QuestionType.MCQ: "multiple-choice (MCQ)",
+    QuestionType.MSQ: "multiple-select (MSQ)",
+    QuestionType.NUM: "numerical",
+}
+
 class GeminiService:
-    def __init__(self):
-        self.client = client
+    def __init__(
+        self,
+        gemini_client=None,
+        cache: Optional[GenerationCache] = None,
+        scheduler: Optional[GenerationScheduler] = None,
+        resilience: Optional[ResilientCaller] = None,
+        profile: Optional[str] = None
+    ):
+        self._client = gemini_client
+        self._cache = cache
+        self._scheduler = scheduler
+        self._resilience = resilience
+        self.profile = profile or settings.GENERATION_PROFILE
+        if self.profile not in GENERATION_PROFILES:
+            raise ValueError(f"Unknown generation profile {self.profile}; use one of {', '.join(GENERATION_PROFILES)}")
         self.model = "gemini-2.0-flash"  # Using Gemini 2.0 Flash model
     
-    def generate_questions(self, section: Section) -> List[QuestionUnion]:
-        """Generate questions using Gemini API based on section requirements"""
+    @property
+    def client(self):
+        """The injected client, or the shared one"""
+        return self._client or get_gemini_client()
+    
+    @property
+    def cache(self) -> Optional[GenerationCache]:
+        """The injected cache, or the shared one"""
+        return self._cache or get_generation_cache()
+    
+    @property
+    def scheduler(self) -> GenerationScheduler:
+        """The injected scheduler, or the shared one"""
+        return self._scheduler or get_generation_scheduler()
+    
+    @property
+    def resilience(self) -> ResilientCaller:
+        """The injected retry/hedging layer, or the shared one"""
+        return self._resilience or get_resilient_caller()
+    
+    def generate_questions(self, section: Section, bypass_cache: bool = False, count: Optional[int] = None) -> List[QuestionUnion]:
+        """Generate questions using Gemini API based on section requirements (`count` defaults to the whole section)"""
         try:
             # Generate questions based on section type
             question_type = section.question_type
+            count = count or section.total_questions
             
-            logger.info(f"Generating {section.total_questions} questions of type {question_type} for section {section.name}")
+            logger.info("Generating %d questions of type %s for section %s", count, question_type, section.name)
             
-            if question_type == QuestionType.MCQ:
-                return self._generate_mcq_questions(section)
-            elif question_type == QuestionType.MSQ:
-                return self._generate_msq_questions(section)
-            elif question_type == QuestionType.NUM:
-                return self._generate_numerical_questions(section)
-            else:
+            if question_type not in (QuestionType.MCQ, QuestionType.MSQ, QuestionType.NUM):
                 raise ValueError(f"Unsupported question type: {question_type}")
+            
+            if self._should_chunk(count):
+                return self._generate_chunked(section, count, bypass_cache)
+            
+            return self._generate_batch(section, count, bypass_cache=bypass_cache)
         except Exception as e:
-            logger.error(f"Error generating questions: {str(e)}")
+            logger.error("Error generating questions: %s", e)
             raise
     
-    def _generate_mcq_questions(self, section: Section) -> List[MCQQuestion]:
-        """Generate MCQ questions using Gemini"""
+    async def generate_questions_async(self, section: Section, bypass_cache: bool = False, count: Optional[int] = None) -> List[QuestionUnion]:
+        """Generate questions for a section using the async Gemini client"""
         try:
-            # Get exam name from the relationship
-            exam_name = section.exam.name if section.exam else "Exam"
+            question_type = section.question_type
+            if question_type not in (QuestionType.MCQ, QuestionType.MSQ, QuestionType.NUM):
+                raise ValueError(f"Unsupported question type: {question_type}")
+            count = count or section.total_questions
             
-            prompt = f"""Generate {section.total_questions} high-quality multiple-choice questions (MCQs) for a section named "{section.name}" for exam "{exam_name}".
+            logger.info("Generating %d questions of type %s for section %s (async)", count, question_type, section.name)
             
-            Requirements:
-            - Each question must have exactly 4 options
-            - Only one option should be correct
-            - Questions should be challenging but fair
-            - Each question is worth {section.marks_per_question} marks
-            - If applicable, negative marking is {section.negative_marks} marks
+            if self._should_chunk(count):
+                return await self._generate_chunked_async(section, count, bypass_cache)
             
-            Please provide your response in a structured JSON format without any extra text or explanations.
+            return await self._generate_batch_async(section, count, bypass_cache=bypass_cache)
+        except Exception as e:
+            logger.error("Error generating questions: %s", e)
+            raise
+    
+    def generate_replacements(self, section: Section, count: int, avoid: List[QuestionUnion], bypass_cache: bool = False) -> List[QuestionUnion]:
+        """Generate extra questions for a section, steering away from questions it already has"""
+        return self._generate_batch(section, count, self._covered_hint(avoid), bypass_cache)
+    
+    async def generate_replacements_async(self, section: Section, count: int, avoid: List[QuestionUnion], bypass_cache: bool = False) -> List[QuestionUnion]:
+        """Async version of generate_replacements"""
+        return await self._generate_batch_async(section, count, self._covered_hint(avoid), bypass_cache)
+    
+    def _generate_batch(self, section: Section, count: int, hint: Optional[str] = None, bypass_cache: bool = False) -> List[QuestionUnion]:
+        """Generate a single batch of questions with the sync client"""
+        if section.question_type == QuestionType.MCQ:
+            return self._generate_mcq_questions(section, count, hint, bypass_cache)
+        elif section.question_type == QuestionType.MSQ:
+            return self._generate_msq_questions(section, count, hint, bypass_cache)
+        return self._generate_numerical_questions(section, count, hint, bypass_cache)
+    
+    async def _generate_batch_async(self, section: Section, count: int, hint: Optional[str] = None, bypass_cache: bool = False) -> List[QuestionUnion]:
+        """Generate a single batch of questions with the async client"""
+        question_type = section.question_type
+        prompt = self._build_prompt(section, count, hint)
+        result = await self._generate_content_async(prompt, self._response_config(question_type), bypass_cache, count)
+        
+        questions = self._convert_questions(question_type, result, count)
+        logger.info("Successfully generated %d %s questions for section %s", len(questions), question_type.value, section.name)
+        return questions
+    
+    async def stream_questions(self, section: Section, bypass_cache: bool = False, count: Optional[int] = None) -> AsyncIterator[QuestionUnion]:
+        """Generate questions for a section, yielding each one as soon as it has been parsed.
+        
+        Uses generate_content_stream and an incremental parser over the batch
+        array, so the first question is available long before the response is
+        complete. The full batch is cached once the stream ends.
+        """
+        question_type = section.question_type
+        if question_type not in (QuestionType.MCQ, QuestionType.MSQ, QuestionType.NUM):
+            raise ValueError(f"Unsupported question type: {question_type}")
+        count = count or section.total_questions
+        
+        logger.info("Streaming %d questions of type %s for section %s", count, question_type, section.name)
+        
+        prompt = self._build_prompt(section, count)
+        config = self._response_config(question_type)
+        schema = config['response_schema']
+        key = GenerationCache.make_key(self.model, prompt, schema, config.get('system_instruction', ''))
+        
+        if self.cache and not bypass_cache:
+            cached = await asyncio.to_thread(self.cache.get, key)
+            if cached is not None:
+                logger.info("Generation cache hit for %s", schema.__name__)
+                for question in self._convert_questions(question_type, schema.model_validate_json(cached), count):
+                    yield question
+                return
+        
+        item_model = schema.model_fields['questions'].annotation.__args__[0]
+        parser = JsonArrayStreamParser()
+        parsed_items = []
+        estimated_tokens = self._estimate_tokens(prompt, count, config)
+        # Chunks are only kept when this call's response is logged
+        response_chunks = [] if sample_payloads() else None
+        if response_chunks is not None:
+            log_payload(logger, "Gemini prompt", prompt)
+        
+        async def open_stream(timeout: float):
+            return await asyncio.wait_for(
+                self.client.aio.models.generate_content_stream(model=self.model, contents=prompt, config=config),
+                timeout
+            )
+        
+        # The whole call, reading the chunks included, gets the deadline of a retried call
+        deadline = self.resilience.clock() + self.resilience.deadline
+        # Opening the stream is retried; once questions have been yielded a failure ends the stream
+        stream = await self.resilience.call_async(
+            open_stream,
+            key=(schema.__name__, "stream"),
+            acquire=lambda: self.scheduler.acquire_async(estimated_tokens),
+            hedge=False
+        )
+        last_chunk = None
+        async for chunk in self._read_stream(stream, deadline):
+            last_chunk = chunk
+            if response_chunks is not None:
+                response_chunks.append(chunk.text or "")
+            for item in parser.feed(chunk.text or ""):
+                if len(parsed_items) >= count:
+                    break
+                parsed = item_model.model_validate(item)
+                parsed_items.append(parsed)
+                yield self._convert_question(question_type, parsed)
+        
+        # The final chunk carries the usage metadata for the whole response
+        await asyncio.to_thread(self._record_usage, schema, estimated_tokens, last_chunk, len(parsed_items))
+        logger.info("Streamed %d %s questions for section %s", len(parsed_items), question_type.value, section.name)
+        if response_chunks is not None:
+            log_payload(logger, "Gemini response", "".join(response_chunks))
+        
+        if self.cache and parsed_items:
+            await asyncio.to_thread(self.cache.set, key, schema(questions=parsed_items).model_dump_json())
+    
+    async def _read_stream(self, stream: AsyncIterator[Any], deadline: float) -> AsyncIterator[Any]:
+        """Yield a response stream's chunks, giving up when one takes longer than an attempt may or the deadline passes"""
+        chunks = stream.__aiter__()
+        while True:
+            remaining = deadline - self.resilience.clock()
+            if remaining <= 0:
+                raise CallDeadlineExceeded(f"Gemini stream exceeded its {self.resilience.deadline:g}s deadline")
+            timeout = min(self.resilience.attempt_timeout, remaining)
+            try:
+                chunk = await asyncio.wait_for(chunks.__anext__(), timeout)
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError:
+                raise CallDeadlineExceeded(f"Gemini stream sent nothing for {timeout:g}s")
+            yield chunk
+    
+    # Chunked generation for large sections
+    
+    def _should_chunk(self, count: int) -> bool:
+        """Check whether a question count is large enough to be split into batches"""
+        batch_size = settings.GENERATION_BATCH_SIZE
+        return batch_size > 0 and count > batch_size
+    
+    def _split_batches(self, total: int) -> List[int]:
+        """Split a question count into batch sizes of at most GENERATION_BATCH_SIZE"""
+        batch_size = settings.GENERATION_BATCH_SIZE
+        sizes = [batch_size] * (total // batch_size)
+        if total % batch_size:
+            sizes.append(total % batch_size)
+        return sizes
+    
+    def _generate_chunked(self, section: Section, count: int, bypass_cache: bool = False) -> List[QuestionUnion]:
+        """Generate a large section as concurrent batches using a thread pool"""
+        sizes = self._split_batches(count)
+        logger.info("Splitting section %s into %d batches", section.name, len(sizes))
+        
+        topics = self._plan_topics(section, len(sizes), bypass_cache)
+        with ThreadPoolExecutor(max_workers=len(sizes)) as executor:
+            # Each batch runs in a copy of this context, so it keeps the caller's priority and tenant
+            futures = [
+                executor.submit(
+                    contextvars.copy_context().run,
+                    self._generate_batch, section, size, self._batch_hint(topics, index, len(sizes)), bypass_cache
+                )
+                for index, size in enumerate(sizes)
+            ]
+            batches = [future.result() for future in futures]
+        
+        questions = self._merge_batches(batches, count)
+        shortfall = count - len(questions)
+        if shortfall > 0:
+            logger.info("Topping up %d questions removed as duplicates for section %s", shortfall, section.name)
+            extra = self._generate_batch(section, shortfall, self._covered_hint(questions), bypass_cache)
+            questions = self._merge_batches([questions, extra], count)
+        return questions
+    
+    async def _generate_chunked_async(self, section: Section, count: int, bypass_cache: bool = False) -> List[QuestionUnion]:
+        """Generate a large section as concurrent batches with the async client"""
+        sizes = self._split_batches(count)
+        logger.info("Splitting section %s into %d batches", section.name, len(sizes))
+        
+        topics = await self._plan_topics_async(section, len(sizes), bypass_cache)
+        batches = await asyncio.gather(*(
+            self._generate_batch_async(section, size, self._batch_hint(topics, index, len(sizes)), bypass_cache)
+            for index, size in enumerate(sizes)
+        ))
+        
+        questions = self._merge_batches(batches, count)
+        shortfall = count - len(questions)
+        if shortfall > 0:
+            logger.info("Topping up %d questions removed as duplicates for section %s", shortfall, section.name)
+            extra = await self._generate_batch_async(section, shortfall, self._covered_hint(questions), bypass_cache)
+            questions = self._merge_batches([questions, extra], count)
+        return questions
+    
+    def _plan_topics(self, section: Section, batch_count: int, bypass_cache: bool = False) -> Optional[List[str]]:
+        """Ask Gemini for one distinct sub-topic per batch (sync)"""
+        try:
+            result = self._generate_content(
+                self._topic_plan_prompt(section, batch_count),
+                {'response_mime_type': 'application/json', 'response_schema': TopicPlanModel},
+                bypass_cache,
+                expected_items=0
+            )
+            return self._parse_topic_plan(result, batch_count)
+        except Exception as e:
+            logger.warning("Topic planning failed, batches will only be told their position: %s", e)
+            return None
+    
+    async def _plan_topics_async(self, section: Section, batch_count: int, bypass_cache: bool = False) -> Optional[List[str]]:
+        """Ask Gemini for one distinct sub-topic per batch (async)"""
+        try:
+            result = await self._generate_content_async(
+                self._topic_plan_prompt(section, batch_count),
+                {'response_mime_type': 'application/json', 'response_schema': TopicPlanModel},
+                bypass_cache,
+                expected_items=0
+            )
+            return self._parse_topic_plan(result, batch_count)
+        except Exception as e:
+            logger.warning("Topic planning failed, batches will only be told their position: %s", e)
+            return None
+    
+    def _topic_plan_prompt(self, section: Section, batch_count: int) -> str:
+        """Build the prompt that splits a section into non-overlapping sub-topics"""
+        exam_name = section.exam.name if section.exam else "Exam"
+        return f"""List {batch_count} distinct, non-overlapping sub-topics for the section "{section.name}" of exam "{exam_name}".
+            Each sub-topic should be broad enough for {settings.GENERATION_BATCH_SIZE} questions. Return only the sub-topic names.
             """
-            
-            logger.info(f"Sending MCQ prompt to Gemini: {prompt[:100]}...")
-            
-            response = self.client.models.generate_content(
-                model=self.model,
-                contents=prompt,
-                config={
-                    'response_mime_type': 'application/json',
-                    'response_schema': MCQBatchModel,
-                },
+    
+    def _parse_topic_plan(self, result: Optional[TopicPlanModel], batch_count: int) -> Optional[List[str]]:
+        """Validate a topic plan, returning None when it cannot be used"""
+        if not result:
+            return None
+        topics = [topic.strip() for topic in result.topics if topic and topic.strip()]
+        if len(topics) < batch_count:
+            return None
+        return topics[:batch_count]
+    
+    def _batch_hint(self, topics: Optional[List[str]], index: int, batch_count: int) -> str:
+        """Build the hint that keeps concurrent batches from overlapping"""
+        if not topics:
+            return (
+                f"This is batch {index + 1} of {batch_count} generated in parallel for this section. "
+                f"Cover different sub-topics than the other batches would naturally start with."
             )
+        other_topics = [topic for i, topic in enumerate(topics) if i != index]
+        return (
+            f"Focus only on the sub-topic: {topics[index]}. "
+            f"Topics already covered by other batches (do not write questions on these): {'; '.join(other_topics)}"
+        )
+    
+    def _covered_hint(self, questions: List[QuestionUnion]) -> str:
+        """Build a hint listing questions that have already been generated"""
+        covered = "\n".join(f"- {q.question_text[:120]}" for q in questions)
+        return f"Questions already covered (do not repeat or paraphrase these):\n{covered}"
+    
+    def _merge_batches(self, batches: List[List[QuestionUnion]], limit: int) -> List[QuestionUnion]:
+        """Merge batches into one list, dropping duplicate questions"""
+        seen = set()
+        merged = []
+        for batch in batches:
+            for question in batch:
+                key = normalize_question_text(question.question_text)
+                if key in seen:
+                    continue
+                seen.add(key)
+                merged.append(question)
+        return merged[:limit]
+    
+    def _generate_mcq_questions(self, section: Section, count: Optional[int] = None, hint: Optional[str] = None, bypass_cache: bool = False) -> List[MCQQuestion]:
+        """Generate MCQ questions using Gemini"""
+        try:
+            count = count or section.total_questions
+            prompt = self._build_prompt(section, count, hint)
             
-            logger.info("Received response from Gemini")
-            
-            # Log the raw response for debugging
-            logger.info(f"Raw response: {response.text}")
-            
-            result = response.parsed
+            result = self._generate_content(prompt, self._response_config(QuestionType.MCQ), bypass_cache, count)
             
-            # Convert to our schema
-            questions = []
-            for q in result.questions[:section.total_questions]:  # Ensure we only take the needed number
-                mcq = MCQQuestion(
-                    question_text=q.question_text,
-                    explanation=q.explanation,
-                    options=[Option(text=opt.text, is_correct=opt.is_correct) for opt in q.options]
-                )
-                questions.append(mcq)
+            questions = self._convert_questions(QuestionType.MCQ, result, count)
             
-            logger.info(f"Successfully generated {len(questions)} MCQ questions")
+            logger.info("Successfully generated %d MCQ questions", len(questions))
             return questions
         except Exception as e:
-            logger.error(f"Error generating MCQ questions: {str(e)}")
+            logger.error("Error generating MCQ questions: %s", e)
             raise
     
-    def _generate_msq_questions(self, section: Section) -> List[MSQQuestion]:
+    def _generate_msq_questions(self, section: Section, count: Optional[int] = None, hint: Optional[str] = None, bypass_cache: bool = False) -> List[MSQQuestion]:
         """Generate MSQ (multiple select) questions using Gemini"""
         try:
-            # Get exam name from the relationship
-            exam_name = section.exam.name if section.exam else "Exam"
-            
-            prompt = f"""Generate {section.total_questions} high-quality multiple-select questions (MSQs) for a section named "{section.name}" for exam "{exam_name}".
+            count = count or section.total_questions
+            prompt = self._build_prompt(section, count, hint)
             
-            Requirements:
-            - Each question must have exactly 4 options
-            - Multiple options can be correct (between 1-3 options can be correct)
-            - Questions should be challenging but fair
-            - Each question is worth {section.marks_per_question} marks
-            - If applicable, negative marking is {section.negative_marks} marks
-            
-            Please provide your response in a structured JSON format without any extra text or explanations.
-            """
+            result = self._generate_content(prompt, self._response_config(QuestionType.MSQ), bypass_cache, count)
             
-            logger.info(f"Sending MSQ prompt to Gemini: {prompt[:100]}...")
+            questions = self._convert_questions(QuestionType.MSQ, result, count)
             
-            response = self.client.models.generate_content(
-                model=self.model,
-                contents=prompt,
-                config={
-                    'response_mime_type': 'application/json',
-                    'response_schema': MSQBatchModel,
-                },
-            )
-            
-            logger.info("Received response from Gemini")
-            
-            # Log the raw response for debugging
-            logger.info(f"Raw response: {response.text}")
-            
-            result = response.parsed
-            
-            # Convert to our schema
-            questions = []
-            for q in result.questions[:section.total_questions]:  # Ensure we only take the needed number
-                msq = MSQQuestion(
-                    question_text=q.question_text,
-                    explanation=q.explanation,
-                    options=[Option(text=opt.text, is_correct=opt.is_correct) for opt in q.options]
-                )
-                questions.append(msq)
-            
-            logger.info(f"Successfully generated {len(questions)} MSQ questions")
+            logger.info("Successfully generated %d MSQ questions", len(questions))
             return questions
         except Exception as e:
-            logger.error(f"Error generating MSQ questions: {str(e)}")
+            logger.error("Error generating MSQ questions: %s", e)
             raise
     
-    def _generate_numerical_questions(self, section: Section) -> List[NumericalQuestion]:
+    def _generate_numerical_questions(self, section: Section, count: Optional[int] = None, hint: Optional[str] = None, bypass_cache: bool = False) -> List[NumericalQuestion]:
         """Generate numerical questions using Gemini"""
         try:
-            # Get exam name from the relationship
-            exam_name = section.exam.name if section.exam else "Exam"
-            
-            prompt = f"""Generate {section.total_questions} high-quality numerical questions for a section named "{section.name}" for exam "{exam_name}".
-            
-            Requirements:
-            - Each question should have a precise numerical answer
-            - Questions should be challenging but fair
-            - Each question is worth {section.marks_per_question} marks
-            - If applicable, negative marking is {section.negative_marks} marks
+            count = count or section.total_questions
+            prompt = self._build_prompt(section, count, hint)
             
-            Please provide your response in a structured JSON format without any extra text or explanations.
-            """
+            result = self._generate_content(prompt, self._response_config(QuestionType.NUM), bypass_cache, count)
             
-            logger.info(f"Sending numerical prompt to Gemini: {prompt[:100]}...")
+            questions = self._convert_questions(QuestionType.NUM, result, count)
             
+            logger.info("Successfully generated %d numerical questions", len(questions))
+            return questions
+        except Exception as e:
+            logger.error("Error generating numerical questions: %s", e)
+            raise
+    
+    def _generate_content(self, prompt: str, config: Dict[str, Any], bypass_cache: bool = False, expected_items: int = 1) -> BaseModel:
+        """Run a structured generation request with the sync client, going through the cache and rate limiter"""
+        schema = config['response_schema']
+        key = GenerationCache.make_key(self.model, prompt, schema, config.get('system_instruction', ''))
+        if self.cache and not bypass_cache:
+            cached = self.cache.get(key)
+            if cached is not None:
+                logger.info("Generation cache hit for %s", schema.__name__)
+                return schema.model_validate_json(cached)
+        
+        estimated_tokens = self._estimate_tokens(prompt, expected_items, config)
+        log_payloads = sample_payloads()
+        if log_payloads:
+            log_payload(logger, "Gemini prompt", prompt)
+        
+        def attempt(timeout: float):
             response = self.client.models.generate_content(
                 model=self.model,
                 contents=prompt,
-                config={
-                    'response_mime_type': 'application/json',
-                    'response_schema': NumericalBatchModel,
-                },
+                # The sync client can't be cancelled, so the timeout goes to the HTTP request (in ms)
+                config={**config, 'http_options': {'timeout': int(timeout * 1000)}},
             )
-            
-            logger.info("Received response from Gemini")
-            
-            # Log the raw response for debugging
-            logger.info(f"Raw response: {response.text}")
-            
-            result = response.parsed
-            
-            # Convert to our schema
-            questions = []
-            for q in result.questions[:section.total_questions]:  # Ensure we only take the needed number
-                numerical = NumericalQuestion(
-                    question_text=q.question_text,
-                    explanation=q.explanation,
-                    answer=q.answer
-                )
-                questions.append(numerical)
-            
-            logger.info(f"Successfully generated {len(questions)} numerical questions")
-            return questions
-        except Exception as e:
-            logger.error(f"Error generating numerical questions: {str(e)}")
-            raise
\ No newline at end of file
+            self._record_usage(schema, estimated_tokens, response)
+            return response
+        
+        response = self.resilience.call(
+            attempt, key=(schema.__name__, expected_items), acquire=lambda: self.scheduler.acquire(estimated_tokens)
+        )
+        
+        logger.info("Received response from Gemini")
+        if log_payloads:
+            log_payload(logger, "Gemini response", response.text or "")
+        
+        result = response.parsed
+        if self.cache and result is not None:
+            self.cache.set(key, result.model_dump_json())
+        return result
+    
+    async def _generate_content_async(self, prompt: str, config: Dict[str, Any], bypass_cache: bool = False, expected_items: int = 1) -> BaseModel:
+        """Run a structured generation request with the async client, going through the cache and rate limiter"""
+        schema = config['response_schema']
+        key = GenerationCache.make_key(self.model, prompt, schema, config.get('system_instruction', ''))
+        if self.cache and not bypass_cache:
+            # The disk tier is SQLite, so keep it off the event loop
+            cached = await asyncio.to_thread(self.cache.get, key)
+            if cached is not None:
+                logger.info("Generation cache hit for %s", schema.__name__)
+                return schema.model_validate_json(cached)
+        
+        estimated_tokens = self._estimate_tokens(prompt, expected_items, config)
+        log_payloads = sample_payloads()
+        if log_payloads:
+            log_payload(logger, "Gemini prompt", prompt)
+        
+        async def attempt(timeout: float):
+            response = await asyncio.wait_for(
+                self.client.aio.models.generate_content(model=self.model, contents=prompt, config=config),
+                timeout
+            )
+            await asyncio.to_thread(self._record_usage, schema, estimated_tokens, response)
+            return response
+        
+        response = await self.resilience.call_async(
+            attempt, key=(schema.__name__, expected_items), acquire=lambda: self.scheduler.acquire_async(estimated_tokens)
+        )
+        
+        logger.info("Received response from Gemini")
+        if log_payloads:
+            log_payload(logger, "Gemini response", response.text or "")
+        
+        result = response.parsed
+        if self.cache and result is not None:
+            await asyncio.to_thread(self.cache.set, key, result.model_dump_json())
+        return result
+    
+    def _record_usage(self, schema: type, estimated_tokens: int, response: Any, questions: Optional[int] = None) -> None:
+        """Correct the rate limiter's estimate with a response's usage metadata, and export its token and question counts.
+        
+        `questions` defaults to the size of the parsed batch.
+        """
+        self.scheduler.record_usage(estimated_tokens, response)
+        usage = getattr(response, "usage_metadata", None)
+        if usage is None:
+            return
+        question_type, profile = _CALL_LABELS.get(schema.__name__, (schema.__name__, "none"))
+        for kind, attribute in (("prompt", "prompt_token_count"), ("response", "candidates_token_count")):
+            count = getattr(usage, attribute, None)
+            if count:
+                gemini_tokens.inc(count, question_type=question_type, profile=profile, kind=kind)
+        if questions is None:
+            questions = len(getattr(getattr(response, "parsed", None), "questions", None) or [])
+        if questions:
+            gemini_questions.inc(questions, question_type=question_type, profile=profile)
+    
+    def _estimate_tokens(self, prompt: str, expected_items: int, config: Dict[str, Any]) -> int:
+        """Rough size of a call for the tokens-per-minute limit (about 4 characters per prompt token)"""
+        prompt_chars = len(prompt) + len(config.get('system_instruction', ''))
+        return prompt_chars // 4 + max(expected_items, 1) * settings.GEMINI_TOKENS_PER_QUESTION
+    
+    def _build_prompt(self, section: Section, count: Optional[int] = None, hint: Optional[str] = None) -> str:
+        """Build the generation prompt for a section based on its question type"""
+        prompt = self._base_prompt(section, count or section.total_questions)
+        if hint:
+            prompt += f"\nAdditional instructions:\n- {hint}"
+        return prompt
+    
+    def _base_prompt(self, section: Section, count: int) -> str:
+        """Build the per-section part of the prompt (the shared rules are in SYSTEM_INSTRUCTION)"""
+        # Get exam name from the relationship
+        exam_name = section.exam.name if section.exam else "Exam"
+        marking = f"Each question is worth {section.marks_per_question:g} marks"
+        if section.negative_marking_allowed and section.negative_marks:
+            marking += f", with {section.negative_marks:g} deducted for a wrong answer"
+        return (
+            f'Generate {count} {_TYPE_NAMES[section.question_type]} questions for the section "{section.name}" '
+            f'of exam "{exam_name}". {marking}.'
+        )
+    
+    def _response_config(self, question_type: QuestionType) -> Dict[str, Any]:
+        """Get the structured output config for a question type under this service's profile"""
+        return {
+            'response_mime_type': 'application/json',
+            'response_schema': GENERATION_PROFILES[self.profile][question_type],
+            'system_instruction': SYSTEM_INSTRUCTION,
+        }
+    
+    def _convert_questions(self, question_type: QuestionType, result: BaseModel, limit: int) -> List[QuestionUnion]:
+        """Convert a parsed Gemini batch into our question schemas"""
+        # Ensure we only take the needed number
+        return [self._convert_question(question_type, q) for q in result.questions[:limit]]
+    
+    def _convert_question(self, question_type: QuestionType, q: BaseModel) -> QuestionUnion:
+        """Convert a single parsed Gemini question into our question schema"""
+        # Only the full profile's schemas have an explanation
+        explanation = getattr(q, "explanation", None)
+        if question_type == QuestionType.MCQ:
+            return MCQQuestion(
+                question_text=q.question_text,
+                explanation=explanation,
+                options=[Option(text=opt.text, is_correct=opt.is_correct) for opt in q.options]
+            )
+        elif question_type == QuestionType.MSQ:
+            return MSQQuestion(
+                question_text=q.question_text,
+                explanation=explanation,
+                options=[Option(text=opt.text, is_correct=opt.is_correct) for opt in q.options]
+            )
+        return NumericalQuestion(
+            question_text=q.question_text,
+            explanation=explanation,
+            answer=q.answer
+        )
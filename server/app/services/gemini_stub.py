@@ -0,0 +1,124 @@
+import asyncio
+import random
+import re
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, List, Type
+
+from pydantic import BaseModel
+
+
+class StubAPIError(Exception):
+    """Stand-in for google.genai.errors.APIError (carries the HTTP status as `code`)"""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(f"{code} {message}")
+        self.code = code
+        self.response = None
+
+
+class StubModels:
+    """Offline stand-in for `genai.Client().models`.
+
+    Builds deterministic placeholder questions that satisfy the requested
+    response schema, so the generation flow (jobs, batching, persistence) can
+    be exercised locally without an API key. The number of questions is taken
+    from the "Generate N ..." line of the prompt. A `failure_rate` fraction of
+    calls fail with a 503, and the sync client honours the request timeout in
+    `http_options`, so retries and timeouts can be exercised too.
+    """
+
+    def __init__(self, latency: float = 0.0, failure_rate: float = 0.0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.calls = 0
+
+    def generate_content(self, model: str, contents: str, config: Dict[str, Any]):
+        timeout_ms = (config.get('http_options') or {}).get('timeout')
+        if timeout_ms is not None and self.latency > timeout_ms / 1000:
+            time.sleep(timeout_ms / 1000)
+            raise TimeoutError("Stub request timed out")
+        if self.latency:
+            time.sleep(self.latency)
+        return self._build_response(contents, config)
+
+    def _build_response(self, contents: str, config: Dict[str, Any]):
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise StubAPIError(503, "Stub service unavailable")
+        self.calls += 1
+        schema = config['response_schema']
+        parsed = schema(**self._fake_payload(schema, contents))
+        text = parsed.model_dump_json()
+        # Like the API, the system instruction counts as prompt tokens
+        prompt = (config.get('system_instruction') or '') + contents
+        return SimpleNamespace(parsed=parsed, text=text, usage_metadata=self._usage(prompt, text))
+
+    def _usage(self, contents: str, text: str) -> SimpleNamespace:
+        """Token counts in the shape of the API's usage metadata (about 4 characters per token)"""
+        prompt_tokens, output_tokens = len(contents) // 4, len(text) // 4
+        return SimpleNamespace(
+            prompt_token_count=prompt_tokens,
+            candidates_token_count=output_tokens,
+            total_token_count=prompt_tokens + output_tokens,
+        )
+
+    def _fake_payload(self, schema: Type[BaseModel], prompt: str) -> Dict[str, Any]:
+        match = re.search(r"(?:Generate|List) (\d+)", prompt)
+        count = int(match.group(1)) if match else 1
+
+        if "topics" in schema.model_fields:
+            return {"topics": [f"Stub topic {i + 1}" for i in range(count)]}
+
+        item_schema = schema.model_fields["questions"].annotation.__args__[0]
+        fields = item_schema.model_fields
+        questions: List[Dict[str, Any]] = []
+        for i in range(count):
+            question: Dict[str, Any] = {"question_text": f"Stub question {self.calls}.{i + 1}"}
+            if "explanation" in fields:
+                # About as long as the two sentences the system instruction allows
+                question["explanation"] = (
+                    f"Stub explanation of question {i + 1}: the correct answer follows from the definition in the "
+                    f"question, while the other choices each misapply one step of it."
+                )
+            if "options" in fields:
+                question["options"] = [
+                    {"text": f"Option {letter}", "is_correct": letter == "A"} for letter in "ABCD"
+                ]
+            if "answer" in fields:
+                question["answer"] = float(i + 1)
+            questions.append(question)
+        return {"questions": questions}
+
+
+class StubAsyncModels(StubModels):
+    """Async counterpart of StubModels (`client.aio.models`)"""
+
+    async def generate_content(self, model: str, contents: str, config: Dict[str, Any]):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._build_response(contents, config)
+
+    async def generate_content_stream(self, model: str, contents: str, config: Dict[str, Any]):
+        """Stream the stub response in small text chunks, spreading the latency over them"""
+        response = self._build_response(contents, config)
+        text = response.text
+        chunk_size = 64
+        chunks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+
+        async def stream():
+            for index, chunk in enumerate(chunks):
+                if self.latency:
+                    await asyncio.sleep(self.latency / len(chunks))
+                # Like the API, only the final chunk reports usage for the whole response
+                usage = response.usage_metadata if index == len(chunks) - 1 else None
+                yield SimpleNamespace(text=chunk, usage_metadata=usage)
+
+        return stream()
+
+
+class StubGeminiClient:
+    """Drop-in replacement for `genai.Client` used when GEMINI_USE_STUB is enabled"""
+
+    def __init__(self, latency: float = 0.0, failure_rate: float = 0.0):
+        self.models = StubModels(latency, failure_rate)
+        self.aio = SimpleNamespace(models=StubAsyncModels(latency, failure_rate))
@@ -0,0 +1,204 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional, Type
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationCache:
+    """Two-tier cache for Gemini generation results.
+
+    Entries are keyed by a hash of the model, the fully rendered prompt and the
+    response schema, so two sections that render to the same prompt share one
+    result. Lookups go to an in-memory LRU first and then to a SQLite file that
+    survives restarts and is shared by every worker on the host. Both tiers
+    expire entries after `ttl_seconds`; the memory tier is capped by entry
+    count and the disk tier by total payload bytes (least recently used
+    entries are evicted first).
+    """
+
+    def __init__(
+        self,
+        path: Optional[str],
+        memory_entries: int = 256,
+        disk_max_bytes: int = 64 * 1024 * 1024,
+        ttl_seconds: int = 7 * 24 * 3600,
+        clock: Callable[[], float] = time.time
+    ):
+        self.path = path
+        self.memory_entries = memory_entries
+        self.disk_max_bytes = disk_max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "writes": 0,
+            "evictions": 0,
+        }
+
+        if self.path:
+            self._init_disk()
+
+    @staticmethod
+    def make_key(model: str, prompt: str, schema: Type[BaseModel], system_instruction: str = "") -> str:
+        """Build the cache key for a generation request"""
+        request = {"model": model, "prompt": prompt, "schema": schema.model_json_schema()}
+        if system_instruction:
+            request["system_instruction"] = system_instruction
+        payload = json.dumps(request, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Get a cached response, checking memory first and then disk"""
+        now = self.clock()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self._counters["memory_hits"] += 1
+                    return value
+                del self._memory[key]
+
+        value = self._disk_get(key, now) if self.path else None
+        with self._lock:
+            if value is None:
+                self._counters["misses"] += 1
+                return None
+            self._counters["disk_hits"] += 1
+            self._memory_set(key, value, now)
+        return value
+
+    def set(self, key: str, value: str) -> None:
+        """Store a response in both tiers"""
+        now = self.clock()
+        with self._lock:
+            self._memory_set(key, value, now)
+            self._counters["writes"] += 1
+        if self.path:
+            self._disk_set(key, value, now)
+
+    def clear(self) -> None:
+        """Remove every entry from both tiers"""
+        with self._lock:
+            self._memory.clear()
+        if self.path:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM generation_cache")
+
+    def stats(self) -> Dict[str, Any]:
+        """Get hit/miss counters and tier sizes"""
+        with self._lock:
+            stats = dict(self._counters)
+            stats["memory_entries"] = len(self._memory)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_ratio"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+
+        stats["disk_entries"] = 0
+        stats["disk_bytes"] = 0
+        if self.path:
+            with self._connect() as conn:
+                count, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM generation_cache").fetchone()
+            stats["disk_entries"] = count
+            stats["disk_bytes"] = size
+        return stats
+
+    # Memory tier (callers hold self._lock)
+
+    def _memory_set(self, key: str, value: str, now: float) -> None:
+        self._memory[key] = (now + self.ttl_seconds, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+            self._counters["evictions"] += 1
+
+    # Disk tier
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """A connection that commits (or rolls back) and is closed when the block ends"""
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            # The connection's own context manager only ends the transaction; it never closes
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _init_disk(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS generation_cache ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_generation_cache_last_access ON generation_cache (last_access)")
+
+    def _disk_get(self, key: str, now: float) -> Optional[str]:
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT value, expires_at FROM generation_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                value, expires_at = row
+                if expires_at <= now:
+                    conn.execute("DELETE FROM generation_cache WHERE key = ?", (key,))
+                    return None
+                conn.execute("UPDATE generation_cache SET last_access = ? WHERE key = ?", (now, key))
+                return value
+        except sqlite3.Error as e:
+            # The disk tier is best effort; a broken cache file must not fail generation
+            logger.warning("Generation cache read failed: %s", e)
+            return None
+
+    def _disk_set(self, key: str, value: str, now: float) -> None:
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO generation_cache (key, value, size, expires_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                    (key, value, len(value.encode("utf-8")), now + self.ttl_seconds, now)
+                )
+                evicted = conn.execute("DELETE FROM generation_cache WHERE expires_at <= ?", (now,)).rowcount
+                evicted += self._disk_evict_to_size(conn)
+            if evicted:
+                with self._lock:
+                    self._counters["evictions"] += evicted
+        except sqlite3.Error as e:
+            logger.warning("Generation cache write failed: %s", e)
+
+    def _disk_evict_to_size(self, conn: sqlite3.Connection) -> int:
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM generation_cache").fetchone()[0]
+        evicted = 0
+        if total <= self.disk_max_bytes:
+            return evicted
+        for key, size in conn.execute("SELECT key, size FROM generation_cache ORDER BY last_access").fetchall():
+            conn.execute("DELETE FROM generation_cache WHERE key = ?", (key,))
+            evicted += 1
+            total -= size
+            if total <= self.disk_max_bytes:
+                break
+        return evicted
@@ -0,0 +1,170 @@
+from sqlalchemy.orm import Session
+from typing import Any, Callable, Dict, List, Optional
+from datetime import datetime
+import logging
+import os
+import socket
+import threading
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.logging_config import request_id
+from app.models.models import GenerationJob
+from app.repositories.exam_repository import ExamRepository
+from app.repositories.job_repository import JobRepository
+from app.repositories.question_repository import QuestionRepository
+from app.services.question_service import QuestionService
+from app.services.rate_limiter import Priority, generation_context
+
+logger = logging.getLogger(__name__)
+
+
+class JobService:
+    def __init__(
+        self,
+        question_service: Optional[QuestionService] = None,
+        session_factory: Callable[[], Session] = SessionLocal
+    ):
+        self.exam_repository = ExamRepository()
+        self.question_repository = QuestionRepository()
+        self.job_repository = JobRepository()
+        self.question_service = question_service or QuestionService()
+        self.session_factory = session_factory
+        # Set when a job is queued so idle workers in this process don't wait for the next poll
+        self.wakeup = threading.Event()
+
+    def enqueue_section_job(self, db: Session, section_id: int, bypass_cache: bool = False, tenant: Optional[str] = None) -> GenerationJob:
+        """Queue question generation for a section, reusing an active job for the same section"""
+        section = self.exam_repository.get_section(db, section_id)
+        if not section:
+            raise ValueError(f"Section with ID {section_id} not found")
+
+        active_job = self.job_repository.get_active_job_for_section(db, section_id)
+        if active_job:
+            return active_job
+
+        if self.question_repository.check_questions_exist(db, section_id):
+            raise ValueError(f"Questions already exist for section with ID {section_id}")
+
+        job = self.job_repository.create_job(db, section_id, bypass_cache, tenant)
+        self.wakeup.set()
+        return job
+
+    def get_job(self, db: Session, job_id: str) -> Dict[str, Any]:
+        """Get a job's status and timing"""
+        job = self.job_repository.get_job(db, job_id)
+        if not job:
+            raise ValueError(f"Job with ID {job_id} not found")
+        return self.describe_job(job)
+
+    def describe_job(self, job: GenerationJob) -> Dict[str, Any]:
+        """Build the status response for a job, including queue and run times"""
+        created_at = _parse_timestamp(job.created_at)
+        started_at = _parse_timestamp(job.started_at)
+        finished_at = _parse_timestamp(job.finished_at)
+
+        return {
+            "id": job.id,
+            "section_id": job.section_id,
+            "status": job.status.value,
+            "question_count": job.question_count,
+            "error": job.error,
+            "created_at": job.created_at,
+            "started_at": job.started_at,
+            "finished_at": job.finished_at,
+            "queued_seconds": (started_at - created_at).total_seconds() if started_at and created_at else None,
+            "run_seconds": (finished_at - started_at).total_seconds() if finished_at and started_at else None,
+        }
+
+    def run_next_job(self, worker_id: str) -> bool:
+        """Claim and run one queued job. Returns False when the queue is empty."""
+        db = self.session_factory()
+        try:
+            job = self.job_repository.claim_next_job(db, worker_id)
+            if not job:
+                return False
+
+            # The job's records are tagged like a request's, with the job ID
+            token = request_id.set(f"job-{job.id}")
+            try:
+                logger.info("Worker %s running job %s for section %s", worker_id, job.id, job.section_id)
+                try:
+                    # Jobs are bulk work: interactive requests get Gemini capacity first
+                    with generation_context(Priority.BULK, job.tenant):
+                        questions = self.question_service.generate_questions_for_section(
+                            db, job.section_id, bypass_cache=bool(job.bypass_cache)
+                        )
+                except Exception as e:
+                    db.rollback()
+                    logger.error("Job %s failed: %s", job.id, e)
+                    self.job_repository.fail_job(db, job.id, str(e))
+                else:
+                    self.job_repository.complete_job(db, job.id, len(questions))
+            finally:
+                request_id.reset(token)
+            return True
+        finally:
+            db.close()
+
+    def requeue_stale_jobs(self) -> int:
+        """Requeue jobs left running by workers that are gone"""
+        db = self.session_factory()
+        try:
+            return self.job_repository.requeue_stale_jobs(db, settings.JOB_STALE_SECONDS)
+        finally:
+            db.close()
+
+
+class JobWorkerPool:
+    """In-process pool of threads that poll the jobs table.
+
+    Jobs are claimed through the database, so every uvicorn worker can run its
+    own pool against the same table without running a job twice.
+    """
+
+    def __init__(self, job_service: JobService, workers: int = None, poll_interval: float = None):
+        self.job_service = job_service
+        self.workers = settings.JOB_WORKERS if workers is None else workers
+        self.poll_interval = settings.JOB_POLL_INTERVAL if poll_interval is None else poll_interval
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        """Start the worker threads"""
+        if self._threads or self.workers <= 0:
+            return
+
+        requeued = self.job_service.requeue_stale_jobs()
+        if requeued:
+            logger.info("Requeued %d stale generation jobs", requeued)
+
+        self._stop.clear()
+        for index in range(self.workers):
+            worker_id = f"{socket.gethostname()}:{os.getpid()}:{index}"
+            thread = threading.Thread(target=self._run, args=(worker_id,), name=f"job-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Stop the worker threads, letting running jobs finish up to the timeout"""
+        self._stop.set()
+        self.job_service.wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self, worker_id: str) -> None:
+        while not self._stop.is_set():
+            try:
+                if self.job_service.run_next_job(worker_id):
+                    continue
+            except Exception as e:
+                logger.error("Job worker %s error: %s", worker_id, e)
+
+            # Queue is empty: sleep until the next poll or until a job is queued here
+            self.job_service.wakeup.wait(self.poll_interval)
+            self.job_service.wakeup.clear()
+
+
+def _parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
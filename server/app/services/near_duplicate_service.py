@@ -0,0 +1,64 @@
+from sqlalchemy.orm import Session
+from typing import List, Optional, Tuple
+import itertools
+import logging
+
+from app.core.config import settings
+from app.repositories.question_repository import QuestionRepository
+from app.schemas.schemas import QuestionUnion
+from app.utils.near_duplicates import NearDuplicateIndex, minhash_signature
+from app.utils.structured_logging import Truncated
+
+logger = logging.getLogger(__name__)
+
+
+class NearDuplicateService:
+    """Drops generated questions that are near-duplicates of ones already in the exam.
+
+    The exam's stored signatures are loaded into an LSH index once per
+    generation run; each candidate is then checked in well under a
+    millisecond and, when kept, added to the index so later candidates
+    (including other sections generated at the same time) are checked
+    against it too.
+    """
+
+    def __init__(self, threshold: Optional[float] = None):
+        self.question_repository = QuestionRepository()
+        self.threshold = settings.NEAR_DUPLICATE_THRESHOLD if threshold is None else threshold
+        self._pending_keys = itertools.count()
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def load_index(self, db: Session, exam_id: int) -> Optional[NearDuplicateIndex]:
+        """Index the signatures of an exam's saved questions (None when the check is disabled)"""
+        if not self.enabled:
+            return None
+        index = NearDuplicateIndex(self.threshold)
+        for question_id, signature in self.question_repository.get_exam_signatures(db, exam_id).items():
+            index.add(question_id, signature)
+        return index
+
+    def filter_questions(
+        self,
+        index: Optional[NearDuplicateIndex],
+        questions: List[QuestionUnion]
+    ) -> Tuple[List[QuestionUnion], List[QuestionUnion]]:
+        """Split questions into (kept, rejected), adding the kept ones to the index"""
+        if index is None:
+            return list(questions), []
+
+        kept, rejected = [], []
+        for question in questions:
+            signature = minhash_signature(question.question_text)
+            match = index.find(signature)
+            if match:
+                matched, score = match
+                source = f"question {matched}" if isinstance(matched, int) else "a question generated in this run"
+                logger.info("Dropping near-duplicate of %s (similarity %.2f): %s", source, score, Truncated(question.question_text, 80))
+                rejected.append(question)
+                continue
+            index.add(("pending", next(self._pending_keys)), signature)
+            kept.append(question)
+        return kept, rejected
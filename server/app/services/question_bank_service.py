@@ -0,0 +1,170 @@
+from sqlalchemy.orm import Session
+from typing import Any, Dict, List, Optional
+import logging
+import math
+import threading
+import time
+
+from app.core.config import settings
+from app.models.models import Question, QuestionType, Section
+from app.repositories.question_repository import QuestionRepository
+from app.schemas.schemas import MCQQuestion, MSQQuestion, NumericalQuestion, Option, QuestionUnion
+from app.services.near_duplicate_service import NearDuplicateService
+from app.utils.helpers import normalize_question_text
+from app.utils.near_duplicates import NearDuplicateIndex
+from app.utils.question_bank import BankEntry, QuestionBankIndex, terms
+
+logger = logging.getLogger(__name__)
+
+# Shared by every QuestionBankService in the process; built from the database on first use
+_index: Optional[QuestionBankIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_question_bank_index() -> QuestionBankIndex:
+    """Get the process-wide question bank index"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = QuestionBankIndex()
+    return _index
+
+
+class QuestionBankService:
+    """Fills sections with matching questions already saved in other exams.
+
+    The index is built from the questions table the first time it is used
+    (or by `rebuild`). Before each lookup it picks up questions inserted
+    since then, by any worker, with one query on the primary key; edits
+    made through this process are re-indexed right away.
+    """
+
+    def __init__(self, index: Optional[QuestionBankIndex] = None, enabled: Optional[bool] = None):
+        self.question_repository = QuestionRepository()
+        self.near_duplicate_service = NearDuplicateService()
+        self._index = index
+        self.enabled = settings.QUESTION_BANK_ENABLED if enabled is None else enabled
+
+    @property
+    def index(self) -> QuestionBankIndex:
+        """The injected index, or the shared one"""
+        # Not `or`: an empty index is falsy (it has a length), and would be swapped for the shared one
+        return self._index if self._index is not None else get_question_bank_index()
+
+    def rebuild(self, db: Session) -> Dict[str, Any]:
+        """Index every saved question from scratch"""
+        started = time.perf_counter()
+        index = self.index
+        with index.lock:
+            index.clear()
+            count = index.add_many(self._entry(row) for row in self.question_repository.get_bank_rows(db))
+            index.built = True
+        elapsed = time.perf_counter() - started
+        logger.info("Question bank index built with %d questions in %.2fs", count, elapsed)
+        return {"questions": count, "seconds": round(elapsed, 3)}
+
+    def refresh(self, db: Session) -> None:
+        """Build the index on first use, otherwise add questions inserted since the last refresh"""
+        index = self.index
+        with index.lock:
+            if not index.built:
+                self.rebuild(db)
+                return
+            rows = self.question_repository.get_bank_rows(db, after_id=index.last_question_id)
+            added = index.add_many(self._entry(row) for row in rows)
+        if added:
+            logger.debug("Question bank index picked up %d new questions", added)
+
+    def index_questions(self, db: Session, question_ids: List[int]) -> None:
+        """Re-index questions that changed (dropping ones the bank no longer uses)"""
+        index = self.index
+        if not self.enabled or not index.built or not question_ids:
+            return
+        rows = {row.id: row for row in self.question_repository.get_bank_rows(db, question_ids=question_ids)}
+        with index.lock:
+            for question_id in question_ids:
+                if question_id in rows:
+                    index.add(self._entry(rows[question_id]))
+                else:
+                    index.remove(question_id)
+
+    def take(self, db: Session, section: Section, near_duplicates: Optional[NearDuplicateIndex] = None) -> List[QuestionUnion]:
+        """Pick bank questions for a section, up to QUESTION_BANK_MAX_SHARE of its questions.
+
+        Picks pass the same near-duplicate check as generated questions and
+        are added to `near_duplicates`, so what is generated for the
+        remainder is checked against them.
+        """
+        if not self.enabled:
+            return []
+        wanted = math.floor(section.total_questions * min(max(settings.QUESTION_BANK_MAX_SHARE, 0.0), 1.0))
+        if wanted <= 0:
+            return []
+
+        self.refresh(db)
+        exam_name = section.exam.name if section.exam else ""
+        # Extra candidates make up for copies of the same question and near-duplicates
+        matches = self.index.search(
+            section.question_type.value,
+            terms(section.name),
+            terms(exam_name),
+            limit=wanted * 3,
+            exclude_exam_id=section.exam_id
+        )
+        if not matches:
+            return []
+
+        db_questions = {
+            db_question.id: db_question
+            for db_question in self.question_repository.get_questions_by_ids(db, [question_id for question_id, _ in matches])
+        }
+        picked = []
+        seen = set()
+        for question_id, _ in matches:
+            db_question = db_questions.get(question_id)
+            if db_question is None:
+                self.index.remove(question_id)
+                continue
+            key = normalize_question_text(db_question.question_text)
+            question = self._to_question(db_question)
+            if key in seen or question is None:
+                continue
+            seen.add(key)
+            kept, _ = self.near_duplicate_service.filter_questions(near_duplicates, [question])
+            picked += kept
+            if len(picked) >= wanted:
+                break
+
+        logger.info("Filled %d of %d questions for section %s from the question bank", len(picked), section.total_questions, section.name)
+        return picked
+
+    def stats(self) -> Dict[str, Any]:
+        return {"enabled": self.enabled, "built": self.index.built, **self.index.stats()}
+
+    def _entry(self, row) -> BankEntry:
+        """Build the index entry for a row of get_bank_rows"""
+        return BankEntry(
+            question_id=row.id,
+            exam_id=row.exam_id,
+            question_type=row.question_type.value,
+            topic=frozenset(terms(row.section_name)),
+            text=frozenset(terms(row.question_text))
+        )
+
+    def _to_question(self, db_question: Question) -> Optional[QuestionUnion]:
+        """Copy a saved question into the schema used for new questions (None if it is incomplete)"""
+        if db_question.question_type == QuestionType.NUM:
+            if db_question.numerical_answer is None:
+                return None
+            return NumericalQuestion(
+                question_text=db_question.question_text,
+                explanation=db_question.explanation,
+                answer=db_question.numerical_answer
+            )
+
+        if not db_question.options:
+            return None
+        options = [Option.model_validate(option) for option in db_question.options]
+        question_class = MCQQuestion if db_question.question_type == QuestionType.MCQ else MSQQuestion
+        return question_class(question_text=db_question.question_text, explanation=db_question.explanation, options=options)
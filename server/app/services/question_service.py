@@ -1,27 +1,144 @@
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List, Dict, Any, Optional
+from collections import Counter
+from typing import List, Dict, Any, AsyncIterator, Optional
 from fastapi import UploadFile, HTTPException, status
+import asyncio
 import json
+import logging
+import uuid
 
+from app.core.config import settings
 from app.repositories.exam_repository import ExamRepository
+from app.repositories.image_repository import ImageRepository
 from app.repositories.question_repository import QuestionRepository
 from app.services.gemini_service import GeminiService
+from app.services.near_duplicate_service import NearDuplicateService
+from app.services.question_bank_service import QuestionBankService
 from app.utils.firebase_utils import FirebaseStorageService
-from app.models.models import Section, QuestionType
-from app.schemas.schemas import QuestionUnion, QuestionUpdate
+from app.utils.helpers import hash_upload, read_upload, sniff_image_type
+from app.utils.image_pipeline import ImagePipeline, image_pipeline
+from app.utils.near_duplicates import NearDuplicateIndex
+from app.utils.response_cache import response_cache
+from app.models.models import Question, Section, QuestionType
+from app.schemas.schemas import (
+    QuestionUnion, QuestionUpdate, QuestionImport, MCQQuestion, MSQQuestion, NumericalQuestion
+)
+
+logger = logging.getLogger(__name__)
 
 
 class QuestionService:
-    def __init__(self):
+    def __init__(self, gemini_service: Optional[GeminiService] = None, pipeline: Optional[ImagePipeline] = None):
         self.exam_repository = ExamRepository()
         self.question_repository = QuestionRepository()
-        self.gemini_service = GeminiService()
+        self.image_repository = ImageRepository()
+        self.gemini_service = gemini_service or GeminiService()
+        self.near_duplicate_service = NearDuplicateService()
+        self.question_bank_service = QuestionBankService()
         self.firebase_service = FirebaseStorageService()
+        self.image_pipeline = pipeline or image_pipeline
     
-    def generate_questions_for_section(self, db: Session, section_id: int) -> List[QuestionUnion]:
+    def generate_questions_for_section(self, db: Session, section_id: int, bypass_cache: bool = False) -> List[QuestionUnion]:
         """Generate questions for a section and save them to the database"""
-        # Get section details
-        section = self.exam_repository.get_section(db, section_id)
+        section = self.get_section_for_generation(db, section_id)
+        index = self.near_duplicate_service.load_index(db, section.exam_id)
+        
+        # Take what the question bank has, then generate the rest using Gemini
+        banked = [] if bypass_cache else self.question_bank_service.take(db, section, index)
+        questions = banked + self._generate_shortfall(index, section, banked, bypass_cache)
+        
+        # Save questions to database
+        self._save_questions(db, section_id, questions)
+        
+        return questions
+    
+    async def generate_questions_for_section_async(self, db: AsyncSession, section_id: int, bypass_cache: bool = False) -> List[QuestionUnion]:
+        """Async version of generate_questions_for_section for request handlers"""
+        section = await db.run_sync(self.get_section_for_generation, section_id)
+        index = await db.run_sync(self.near_duplicate_service.load_index, section.exam_id)
+        
+        banked = [] if bypass_cache else await db.run_sync(self.question_bank_service.take, section, index)
+        questions = banked + await self._generate_shortfall_async(index, section, banked, bypass_cache)
+        
+        await db.run_sync(self._save_questions, section_id, questions)
+        
+        return questions
+    
+    def _generate_shortfall(
+        self,
+        index: Optional[NearDuplicateIndex],
+        section: Section,
+        banked: List[QuestionUnion],
+        bypass_cache: bool = False
+    ) -> List[QuestionUnion]:
+        """Generate the questions the bank didn't supply, dropping near-duplicates and asking for replacements"""
+        count = section.total_questions - len(banked)
+        if count <= 0:
+            return []
+        questions = self.gemini_service.generate_questions(section, bypass_cache=bypass_cache, count=count)
+        questions, rejected = self.near_duplicate_service.filter_questions(index, questions)
+        return questions + self._replace_near_duplicates(index, section, banked + questions, rejected, bypass_cache)
+    
+    async def _generate_shortfall_async(
+        self,
+        index: Optional[NearDuplicateIndex],
+        section: Section,
+        banked: List[QuestionUnion],
+        bypass_cache: bool = False
+    ) -> List[QuestionUnion]:
+        """Async version of _generate_shortfall"""
+        count = section.total_questions - len(banked)
+        if count <= 0:
+            return []
+        questions = await self.gemini_service.generate_questions_async(section, bypass_cache=bypass_cache, count=count)
+        questions, rejected = self.near_duplicate_service.filter_questions(index, questions)
+        return questions + await self._replace_near_duplicates_async(index, section, banked + questions, rejected, bypass_cache)
+    
+    def _replace_near_duplicates(
+        self,
+        index: Optional[NearDuplicateIndex],
+        section: Section,
+        kept: List[QuestionUnion],
+        rejected: List[QuestionUnion],
+        bypass_cache: bool = False
+    ) -> List[QuestionUnion]:
+        """Generate replacements for rejected near-duplicates, returning the ones that pass the check"""
+        replacements = []
+        for _ in range(settings.NEAR_DUPLICATE_REPLACE_ROUNDS):
+            shortfall = section.total_questions - len(kept) - len(replacements)
+            if not rejected or shortfall <= 0:
+                break
+            logger.info("Requesting %d replacements for near-duplicates in section %s", shortfall, section.name)
+            extra = self.gemini_service.generate_replacements(section, shortfall, kept + replacements + rejected, bypass_cache)
+            accepted, rejected = self.near_duplicate_service.filter_questions(index, extra[:shortfall])
+            replacements += accepted
+        return replacements
+    
+    async def _replace_near_duplicates_async(
+        self,
+        index: Optional[NearDuplicateIndex],
+        section: Section,
+        kept: List[QuestionUnion],
+        rejected: List[QuestionUnion],
+        bypass_cache: bool = False
+    ) -> List[QuestionUnion]:
+        """Async version of _replace_near_duplicates"""
+        replacements = []
+        for _ in range(settings.NEAR_DUPLICATE_REPLACE_ROUNDS):
+            shortfall = section.total_questions - len(kept) - len(replacements)
+            if not rejected or shortfall <= 0:
+                break
+            logger.info("Requesting %d replacements for near-duplicates in section %s", shortfall, section.name)
+            extra = await self.gemini_service.generate_replacements_async(section, shortfall, kept + replacements + rejected, bypass_cache)
+            accepted, rejected = self.near_duplicate_service.filter_questions(index, extra[:shortfall])
+            replacements += accepted
+        return replacements
+    
+    def get_section_for_generation(self, db: Session, section_id: int) -> Section:
+        """Get a section that is ready for question generation"""
+        # Get section details (with the exam, which the prompts use)
+        section = self.exam_repository.get_section(db, section_id, include_exam=True)
         if not section:
             raise ValueError(f"Section with ID {section_id} not found")
         
@@ -29,13 +146,141 @@ class QuestionService:
         if self.question_repository.check_questions_exist(db, section_id):
             raise ValueError(f"Questions already exist for section with ID {section_id}")
         
-        # Generate questions using Gemini
-        questions = self.gemini_service.generate_questions(section)
+        return section
+    
+    async def stream_questions_for_section(self, db: AsyncSession, section_id: int, bypass_cache: bool = False) -> AsyncIterator[Question]:
+        """Generate questions for a section, saving and yielding each one as soon as it is parsed"""
+        section = await db.run_sync(self.get_section_for_generation, section_id)
+        index = await db.run_sync(self.near_duplicate_service.load_index, section.exam_id)
         
-        # Save questions to database
-        self.question_repository.add_questions(db, section_id, questions)
+        # Bank questions are ready right away
+        kept = [] if bypass_cache else await db.run_sync(self.question_bank_service.take, section, index)
+        if kept:
+            for db_question in await db.run_sync(self._save_questions, section_id, kept):
+                yield db_question
         
-        return questions
+        rejected = []
+        count = section.total_questions - len(kept)
+        if count > 0:
+            async for question in self.gemini_service.stream_questions(section, bypass_cache=bypass_cache, count=count):
+                accepted, dropped = self.near_duplicate_service.filter_questions(index, [question])
+                rejected += dropped
+                for fresh in accepted:
+                    db_questions = await db.run_sync(self._save_questions, section_id, [fresh])
+                    kept.append(fresh)
+                    yield db_questions[0]
+        
+        # Replacements for near-duplicates come after the stream
+        replacements = await self._replace_near_duplicates_async(index, section, kept, rejected, bypass_cache)
+        if replacements:
+            for db_question in await db.run_sync(self._save_questions, section_id, replacements):
+                yield db_question
+    
+    async def generate_questions_for_exam(self, db: AsyncSession, exam_id: int, bypass_cache: bool = False) -> List[Dict[str, Any]]:
+        """Generate questions for every section of an exam concurrently.
+        
+        Sections run in parallel (capped by GENERATION_CONCURRENCY) and each one
+        is saved as soon as its generation finishes. Sections that already have
+        questions are skipped; a failing section does not affect the others.
+        """
+        exam = await db.run_sync(self.exam_repository.get_exam, exam_id)
+        if not exam:
+            raise ValueError(f"Exam with ID {exam_id} not found")
+        
+        # One index for the whole run, so sections generated side by side are checked against each other
+        index = await db.run_sync(self.near_duplicate_service.load_index, exam_id)
+        semaphore = asyncio.Semaphore(max(1, settings.GENERATION_CONCURRENCY))
+        # A session can't run statements concurrently, so sections take turns saving
+        db_lock = asyncio.Lock()
+        
+        async def generate_section(section: Section) -> Dict[str, Any]:
+            async with semaphore:
+                try:
+                    banked = []
+                    if not bypass_cache:
+                        async with db_lock:
+                            banked = await db.run_sync(self.question_bank_service.take, section, index)
+                    questions = banked + await self._generate_shortfall_async(index, section, banked, bypass_cache)
+                except Exception as e:
+                    logger.error("Failed to generate questions for section %s: %s", section.id, e)
+                    return {"section_id": section.id, "status": "failed", "question_count": 0, "detail": str(e)}
+            
+            # Save this section right away instead of waiting for the others
+            try:
+                async with db_lock:
+                    await db.run_sync(self._save_questions, section.id, questions)
+            except Exception as e:
+                async with db_lock:
+                    await db.rollback()
+                logger.error("Failed to save questions for section %s: %s", section.id, e)
+                return {"section_id": section.id, "status": "failed", "question_count": 0, "detail": str(e)}
+            
+            return {"section_id": section.id, "status": "generated", "question_count": len(questions), "detail": None}
+        
+        results = {}
+        pending = []
+        for section in exam.sections:
+            if await db.run_sync(self.question_repository.check_questions_exist, section.id):
+                results[section.id] = {
+                    "section_id": section.id,
+                    "status": "skipped",
+                    "question_count": 0,
+                    "detail": f"Questions already exist for section with ID {section.id}",
+                }
+            else:
+                pending.append(section)
+        
+        for result in await asyncio.gather(*(generate_section(section) for section in pending)):
+            results[result["section_id"]] = result
+        
+        # Keep the response in section order
+        return [results[section.id] for section in exam.sections]
+    
+    def import_questions(self, db: Session, section_id: int, items: List[QuestionImport]) -> List[Question]:
+        """Import client-supplied questions into a section using the bulk insert path"""
+        section = self.exam_repository.get_section(db, section_id)
+        if not section:
+            raise ValueError(f"Section with ID {section_id} not found")
+        
+        questions = []
+        for index, item in enumerate(items):
+            if item.question_type.value != section.question_type.value:
+                raise ValueError(
+                    f"Question {index} has type {item.question_type.value}, "
+                    f"but section {section_id} holds {section.question_type.value} questions"
+                )
+            
+            if item.question_type.value == QuestionType.NUM.value:
+                if item.answer is None:
+                    raise ValueError(f"Question {index} is numerical but has no answer")
+                questions.append(NumericalQuestion(
+                    question_text=item.question_text,
+                    explanation=item.explanation,
+                    image_url=item.image_url,
+                    answer=item.answer
+                ))
+            else:
+                if not item.options:
+                    raise ValueError(f"Question {index} has no options")
+                question_class = MCQQuestion if item.question_type.value == QuestionType.MCQ.value else MSQQuestion
+                questions.append(question_class(
+                    question_text=item.question_text,
+                    explanation=item.explanation,
+                    image_url=item.image_url,
+                    options=item.options
+                ))
+        
+        return self._save_questions(db, section_id, questions)
+    
+    def _save_questions(self, db: Session, section_id: int, questions: List[QuestionUnion]) -> List[Question]:
+        """Save questions to a section.
+        
+        Images already stored here gain a reference for each question or
+        option using them (bank copies and imports carry image URLs), in the
+        same commit as the insert.
+        """
+        self.image_repository.add_references(db, _image_urls(questions))
+        return self.question_repository.add_questions(db, section_id, questions)
     
     def get_questions_for_section(self, db: Session, section_id: int):
         """Get already generated questions for a section"""
@@ -54,22 +299,39 @@ class QuestionService:
         
         return question
     
-    def update_question(self, db: Session, question_id: int, question_update: QuestionUpdate):
-        """Update a question's content"""
+    async def update_question(self, db: AsyncSession, question_id: int, question_update: QuestionUpdate):
+        """Update a question's content, releasing the images of options that were removed"""
         # Check if question exists
-        question = self.question_repository.get_question(db, question_id)
+        question = await db.run_sync(self.question_repository.get_question, question_id)
         if not question:
             raise ValueError(f"Question with ID {question_id} not found")
+        old_option_images = _option_images(question.options)
+        new_option_images = old_option_images
+        if question_update.options is not None and question.question_type in (QuestionType.MCQ, QuestionType.MSQ):
+            new_option_images = _option_images([option.model_dump() for option in question_update.options])
+        
+        # Option uploads take no reference: each option starts holding one when it is saved with the image,
+        # in the same commit as the update
+        await db.run_sync(self.image_repository.add_references, list((new_option_images - old_option_images).elements()))
         
         # Update the question
-        updated_question = self.question_repository.update_question(db, question_id, question_update)
+        updated_question = await db.run_sync(self.question_repository.update_question, question_id, question_update)
+        await db.run_sync(self.question_bank_service.index_questions, [question_id])
+        
+        section = await db.run_sync(self.exam_repository.get_section, updated_question.section_id)
+        self._invalidate_question_responses(question_id, section)
+        
+        # Each option image was referenced once per option using it
+        for image_url, count in (old_option_images - new_option_images).items():
+            for _ in range(count):
+                await self._release_image(db, image_url)
         
         return updated_question
     
-    async def upload_question_image(self, db: Session, question_id: int, file: UploadFile):
+    async def upload_question_image(self, db: AsyncSession, question_id: int, file: UploadFile):
         """Upload an image for a question and update the question's image URL"""
         # Check if question exists
-        question = self.question_repository.get_question(db, question_id)
+        question = await db.run_sync(self.question_repository.get_question, question_id)
         if not question:
             raise ValueError(f"Question with ID {question_id} not found")
         
@@ -79,37 +341,132 @@ class QuestionService:
             raise ValueError("File must be an image")
         
         try:
-            # Upload the image to Firebase Storage
-            image_url = await self.firebase_service.upload_image(
-                file, 
-                folder=f"questions/{question.section_id}"
+            # Upload the image (and its thumbnail) to Firebase Storage
+            urls = await self._store_image(db, file, folder=f"questions/{question.section_id}")
+            
+            # The previous image loses this question's reference once the new one is saved
+            old_image_url = question.image_url
+            
+            # Update the question with the new image URLs
+            updated_question = await db.run_sync(
+                self.question_repository.update_question_image, question_id, urls["image_url"], urls["thumbnail_url"]
             )
+            # Questions with an image leave the question bank
+            await db.run_sync(self.question_bank_service.index_questions, [question_id])
             
-            # If the question already has an image, delete the old one
-            if question.image_url:
-                self.firebase_service.delete_image(question.image_url)
+            section = await db.run_sync(self.exam_repository.get_section, question.section_id)
+            self._invalidate_question_responses(question_id, section)
             
-            # Update the question with the new image URL
-            updated_question = self.question_repository.update_question_image(db, question_id, image_url)
+            if old_image_url:
+                await self._release_image(db, old_image_url)
             
-            return {"image_url": image_url}
+            return urls
         except Exception as e:
             raise ValueError(f"Failed to upload image: {str(e)}")
     
-    async def upload_option_image(self, file: UploadFile, section_id: int):
-        """Upload an image for an option and return the URL"""
+    def _invalidate_question_responses(self, question_id: int, section: Optional[Section]) -> None:
+        """Drop cached GET responses that include a question"""
+        response_cache.invalidate("question", question_id)
+        if section:
+            response_cache.invalidate("section_questions", section.id)
+            response_cache.invalidate("exam", section.exam_id)
+    
+    async def upload_option_image(self, db: AsyncSession, file: UploadFile, section_id: int):
+        """Upload an image for an option and return the URL.
+        
+        The upload takes no reference on the stored image; update_question
+        takes one for every option that is saved with it.
+        """
         # Check if the file is an image
         content_type = file.content_type
         if not content_type or not content_type.startswith('image/'):
             raise ValueError("File must be an image")
         
         try:
-            # Upload the image to Firebase Storage
-            image_url = await self.firebase_service.upload_image(
-                file, 
-                folder=f"options/{section_id}"
-            )
-            
-            return {"image_url": image_url}
+            # Upload the image (and its thumbnail) to Firebase Storage
+            return await self._store_image(db, file, folder=f"options/{section_id}", references=0)
         except Exception as e:
-            raise ValueError(f"Failed to upload image: {str(e)}")
\ No newline at end of file
+            raise ValueError(f"Failed to upload image: {str(e)}")
+    
+    async def _store_image(self, db: AsyncSession, file: UploadFile, folder: str, references: int = 1) -> Dict[str, Optional[str]]:
+        """Store an uploaded image, reusing the stored copy when the same content was uploaded before.
+        
+        The upload is hashed as it is read, and the hash (together with the
+        pipeline settings) is looked up in the stored_images index. A known
+        image only gains `references`: nothing is processed or uploaded.
+        """
+        # Checked before anything is stored or looked up; the client's content type is not trusted
+        header = await file.read(64)
+        await file.seek(0)
+        if sniff_image_type(header) is None:
+            raise ValueError("File must be a PNG, JPEG, GIF, WebP or AVIF image")
+        
+        content_hash = await hash_upload(file, settings.MAX_UPLOAD_BYTES)
+        variant = self.image_pipeline.variant
+        
+        stored = await db.run_sync(self.image_repository.acquire_image, content_hash, variant, references)
+        if stored:
+            return {"image_url": stored.image_url, "thumbnail_url": stored.thumbnail_url}
+        
+        # A fresh name for every stored copy: a copy being deleted after its last release is never
+        # the one a concurrent upload of the same content has just written
+        urls = await self._upload_image(file, folder, f"{content_hash}-{uuid.uuid4().hex[:12]}")
+        stored, created = await db.run_sync(
+            self.image_repository.add_image, content_hash, variant, urls["image_url"], urls["thumbnail_url"], references
+        )
+        if not created:
+            # A concurrent request stored the same image first; keep its copy
+            for url in (urls["image_url"], urls["thumbnail_url"]):
+                if url and url not in (stored.image_url, stored.thumbnail_url):
+                    await self.firebase_service.delete_image(url)
+        return {"image_url": stored.image_url, "thumbnail_url": stored.thumbnail_url}
+    
+    async def _upload_image(self, file: UploadFile, folder: str, name: str) -> Dict[str, Optional[str]]:
+        """Upload an image, running it through the image pipeline when enabled"""
+        if not self.image_pipeline.enabled:
+            image_url = await self.firebase_service.upload_image(file, folder=folder, name=name)
+            return {"image_url": image_url, "thumbnail_url": None}
+        
+        # The pipeline needs the whole image to decode it; the size limit still applies while reading
+        data = await read_upload(file, settings.MAX_UPLOAD_BYTES)
+        processed = await self.image_pipeline.process(data)
+        
+        image_url, thumbnail_url = await asyncio.gather(
+            self.firebase_service.upload_bytes(processed.data, folder, processed.extension, processed.content_type, name),
+            self.firebase_service.upload_bytes(
+                processed.thumbnail, f"{folder}/thumbnails", processed.extension, processed.content_type, name
+            ),
+        )
+        return {"image_url": image_url, "thumbnail_url": thumbnail_url}
+    
+    async def _release_image(self, db: AsyncSession, image_url: str) -> None:
+        """Drop a reference to a stored image, deleting the files once nothing refers to them.
+        
+        The thumbnail deleted is the one the index has for the image, never
+        a URL that came with a request.
+        """
+        remaining, thumbnail_url = await db.run_sync(self.image_repository.release_image, image_url)
+        if remaining:
+            return
+        if remaining is None and await db.run_sync(self.question_repository.count_image_references, image_url):
+            # Not in the index (uploaded before it existed) and still used by other questions
+            return
+        
+        # Last reference, or an unindexed image nothing uses any more
+        await self.firebase_service.delete_image(image_url)
+        if thumbnail_url:
+            await self.firebase_service.delete_image(thumbnail_url)
+
+
+def _option_images(options: Optional[List[Dict[str, Any]]]) -> Counter:
+    """Image URLs of the options that have one, with how many options use each"""
+    return Counter(option["image_url"] for option in options or [] if option.get("image_url"))
+
+
+def _image_urls(questions: List[Any]) -> List[Optional[str]]:
+    """Image URLs of questions and their options, once per use"""
+    urls = []
+    for question in questions:
+        urls.append(question.image_url)
+        urls.extend(option.image_url for option in getattr(question, "options", None) or [])
+    return urls
@@ -0,0 +1,495 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+import asyncio
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    """Scheduling class of a Gemini call (lower values go first)"""
+    INTERACTIVE = 0  # A user is waiting on a single section
+    BULK = 1  # Background jobs and generate-all
+
+
+class RateLimitTimeout(Exception):
+    """Raised when a call waited longer than the queue timeout for its turn"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# Priority and tenant of the Gemini calls made in the current context. Asyncio
+# tasks and asyncio.to_thread inherit it; plain thread pools need copy_context().
+_generation_context: ContextVar[Tuple[Priority, str]] = ContextVar(
+    "generation_context", default=(Priority.INTERACTIVE, "default")
+)
+
+
+@contextmanager
+def generation_context(priority: Priority, tenant: str) -> Iterator[None]:
+    """Run Gemini calls made inside the block with this priority and tenant"""
+    token = _generation_context.set((priority, tenant or "default"))
+    try:
+        yield
+    finally:
+        try:
+            _generation_context.reset(token)
+        except ValueError:
+            pass  # Closed from another context (e.g. a finalized async generator): nothing to restore
+
+
+def current_generation_context() -> Tuple[Priority, str]:
+    return _generation_context.get()
+
+
+@dataclass(frozen=True)
+class Bucket:
+    """A token bucket holding at most `capacity` tokens, refilled continuously"""
+    name: str
+    capacity: float
+    refill_per_second: float
+
+    def level(self, tokens: Optional[float], updated_at: Optional[float], now: float) -> float:
+        """Tokens available now, given the last stored level (a missing bucket is full)"""
+        if tokens is None:
+            return self.capacity
+        return min(self.capacity, tokens + max(0.0, now - updated_at) * self.refill_per_second)
+
+
+def _shortfall_seconds(costs: List[Tuple[Bucket, float]], levels: Dict[str, float]) -> float:
+    """Seconds until every bucket can cover its cost (0 when they all can now)"""
+    wait = 0.0
+    for bucket, cost in costs:
+        missing = cost - levels[bucket.name]
+        if missing > 0:
+            wait = max(wait, missing / bucket.refill_per_second)
+    return wait
+
+
+class TokenBucketStore(ABC):
+    """Where bucket levels are kept: in this process, or in a file shared by the workers"""
+
+    @abstractmethod
+    def take(self, costs: List[Tuple[Bucket, float]], now: float) -> float:
+        """Take every cost from its bucket, or nothing at all.
+
+        Returns 0 when the tokens were taken, otherwise the seconds until
+        they would all be available.
+        """
+
+    @abstractmethod
+    def add(self, bucket: Bucket, amount: float, now: float) -> None:
+        """Add tokens to a bucket (negative amounts may leave it in debt)"""
+
+    @abstractmethod
+    def levels(self, buckets: List[Bucket], now: float) -> Dict[str, float]:
+        """Current level of each bucket"""
+
+
+class MemoryTokenBucketStore(TokenBucketStore):
+    """Bucket levels for a single process"""
+
+    def __init__(self):
+        self._state: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def take(self, costs: List[Tuple[Bucket, float]], now: float) -> float:
+        with self._lock:
+            levels = {bucket.name: bucket.level(*self._state.get(bucket.name, (None, None)), now) for bucket, _ in costs}
+            wait = _shortfall_seconds(costs, levels)
+            if wait == 0:
+                for bucket, cost in costs:
+                    self._state[bucket.name] = (levels[bucket.name] - cost, now)
+            return wait
+
+    def add(self, bucket: Bucket, amount: float, now: float) -> None:
+        with self._lock:
+            level = bucket.level(*self._state.get(bucket.name, (None, None)), now)
+            self._state[bucket.name] = (min(bucket.capacity, level + amount), now)
+
+    def levels(self, buckets: List[Bucket], now: float) -> Dict[str, float]:
+        with self._lock:
+            return {bucket.name: bucket.level(*self._state.get(bucket.name, (None, None)), now) for bucket in buckets}
+
+
+class SqliteTokenBucketStore(TokenBucketStore):
+    """Bucket levels in a SQLite file, shared by every worker process on the host.
+
+    Each take is one IMMEDIATE transaction, so concurrent workers can't both
+    spend the same tokens. Levels are stored with the wall-clock time they
+    were computed at, which every process agrees on.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limit_buckets ("
+                " name TEXT PRIMARY KEY,"
+                " tokens REAL NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+
+    def take(self, costs: List[Tuple[Bucket, float]], now: float) -> float:
+        with self._transaction() as conn:
+            state = self._read(conn, [bucket for bucket, _ in costs])
+            levels = {bucket.name: bucket.level(*state.get(bucket.name, (None, None)), now) for bucket, _ in costs}
+            wait = _shortfall_seconds(costs, levels)
+            if wait == 0:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO rate_limit_buckets (name, tokens, updated_at) VALUES (?, ?, ?)",
+                    [(bucket.name, levels[bucket.name] - cost, now) for bucket, cost in costs]
+                )
+            return wait
+
+    def add(self, bucket: Bucket, amount: float, now: float) -> None:
+        with self._transaction() as conn:
+            level = bucket.level(*self._read(conn, [bucket]).get(bucket.name, (None, None)), now)
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_limit_buckets (name, tokens, updated_at) VALUES (?, ?, ?)",
+                (bucket.name, min(bucket.capacity, level + amount), now)
+            )
+
+    def levels(self, buckets: List[Bucket], now: float) -> Dict[str, float]:
+        # A deferred transaction only takes a shared lock, so reading never waits on writers
+        with self._transaction(write=False) as conn:
+            state = self._read(conn, buckets)
+        return {bucket.name: bucket.level(*state.get(bucket.name, (None, None)), now) for bucket in buckets}
+
+    def _read(self, conn: sqlite3.Connection, buckets: List[Bucket]) -> Dict[str, Tuple[float, float]]:
+        names = [bucket.name for bucket in buckets]
+        rows = conn.execute(
+            f"SELECT name, tokens, updated_at FROM rate_limit_buckets WHERE name IN ({', '.join('?' * len(names))})",
+            names
+        ).fetchall()
+        return {name: (tokens, updated_at) for name, tokens, updated_at in rows}
+
+    @contextmanager
+    def _transaction(self, write: bool = True) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("BEGIN IMMEDIATE" if write else "BEGIN DEFERRED")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute buckets for the Gemini API.
+
+    Each bucket holds one minute of quota, so short bursts are allowed as long
+    as the average stays under the limit. A limit of 0 disables its bucket.
+    Token costs are estimates taken before the call; `record_usage` corrects
+    the bucket with the real count once the response arrives.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: int,
+        tokens_per_minute: int,
+        store: Optional[TokenBucketStore] = None,
+        clock: Callable[[], float] = time.time
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.store = store or MemoryTokenBucketStore()
+        self.clock = clock
+        self.requests = Bucket("requests", requests_per_minute, requests_per_minute / 60) if requests_per_minute > 0 else None
+        self.tokens = Bucket("tokens", tokens_per_minute, tokens_per_minute / 60) if tokens_per_minute > 0 else None
+
+    @property
+    def enabled(self) -> bool:
+        return self.requests is not None or self.tokens is not None
+
+    def try_acquire(self, tokens: int) -> float:
+        """Take one request and `tokens` tokens. Returns 0 on success, else the seconds to wait."""
+        costs = []
+        if self.requests:
+            costs.append((self.requests, 1))
+        if self.tokens:
+            # A single call larger than the whole bucket could never run otherwise
+            costs.append((self.tokens, min(tokens, self.tokens.capacity)))
+        if not costs:
+            return 0.0
+        return self.store.take(costs, self.clock())
+
+    def release(self, tokens: int) -> None:
+        """Give back what a successful try_acquire took, for a call that won't be made"""
+        now = self.clock()
+        if self.requests:
+            self.store.add(self.requests, 1, now)
+        if self.tokens:
+            self.store.add(self.tokens, min(tokens, self.tokens.capacity), now)
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: Optional[int]) -> None:
+        """Correct the token bucket once a call's real token count is known"""
+        if not self.tokens or actual_tokens is None or actual_tokens == estimated_tokens:
+            return
+        self.store.add(self.tokens, min(estimated_tokens, self.tokens.capacity) - actual_tokens, self.clock())
+
+    def levels(self) -> Dict[str, float]:
+        buckets = [bucket for bucket in (self.requests, self.tokens) if bucket]
+        return self.store.levels(buckets, self.clock()) if buckets else {}
+
+
+@dataclass(eq=False)
+class _Ticket:
+    """A call waiting in the scheduler queue"""
+    priority: Priority
+    tenant: str
+    tokens: int
+    enqueued_at: float
+    state: str = "queued"  # queued, granted or cancelled
+    granted: threading.Event = field(default_factory=threading.Event)
+    loop: Optional[asyncio.AbstractEventLoop] = None
+    future: Optional[asyncio.Future] = None
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class GenerationScheduler:
+    """Priority queue in front of the rate limiter.
+
+    Calls wait in one queue per priority; interactive calls are always granted
+    before bulk ones. Within a priority, tenants take turns (round robin), so
+    one tenant's large job can't starve another's. A dispatcher thread grants
+    the head of the queue whenever the limiter has room, and both sync and
+    async callers can wait on it.
+
+    The condition only guards the queues: the limiter's store (a SQLite file
+    shared with other workers) is used without holding it, so queueing a
+    call never waits on another process.
+
+    With `background=False` no thread is started and `dispatch()` must be
+    called explicitly, which together with a fake clock makes the scheduling
+    deterministic.
+    """
+
+    # Upper bound on a dispatcher sleep: other workers may return tokens early
+    MAX_POLL_SECONDS = 1.0
+
+    def __init__(
+        self,
+        limiter: RateLimiter,
+        queue_timeout: float = 120.0,
+        clock: Callable[[], float] = time.time,
+        background: bool = True
+    ):
+        self.limiter = limiter
+        self.queue_timeout = queue_timeout
+        self.clock = clock
+        self.background = background
+
+        self._queues: Dict[Priority, "OrderedDict[str, Deque[_Ticket]]"] = {priority: OrderedDict() for priority in Priority}
+        self._condition = threading.Condition()
+        # Serializes dispatching, which runs outside the condition
+        self._dispatch_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+        self._woken = False  # A call was queued since the dispatcher last looked
+        self._metrics = {
+            priority: {"granted": 0, "timeouts": 0, "wait_seconds_total": 0.0, "wait_seconds_max": 0.0}
+            for priority in Priority
+        }
+
+    def acquire(self, tokens: int) -> None:
+        """Block until a call of this size may be made"""
+        if not self.limiter.enabled:
+            return
+        ticket = self.submit(tokens)
+        if not ticket.granted.wait(self.queue_timeout):
+            self._give_up(ticket)
+
+    async def acquire_async(self, tokens: int) -> None:
+        """Wait, without blocking the event loop, until a call of this size may be made"""
+        if not self.limiter.enabled:
+            return
+        loop = asyncio.get_running_loop()
+        ticket = self.submit(tokens, loop=loop)
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._give_up(ticket)
+        except asyncio.CancelledError:
+            self._cancel(ticket)
+            raise
+
+    def submit(self, tokens: int, loop: Optional[asyncio.AbstractEventLoop] = None) -> _Ticket:
+        """Queue a call under the current generation context"""
+        priority, tenant = current_generation_context()
+        ticket = _Ticket(priority=priority, tenant=tenant, tokens=tokens, enqueued_at=self.clock(), loop=loop)
+        if loop is not None:
+            ticket.future = loop.create_future()
+        with self._condition:
+            self._queues[priority].setdefault(tenant, deque()).append(ticket)
+            if self.background and self._thread is None:
+                self._start()
+            self._woken = True
+            self._condition.notify()
+        return ticket
+
+    def dispatch(self) -> Optional[float]:
+        """Grant queued calls while the limiter allows.
+
+        Returns None when the queue is empty, otherwise the seconds until the
+        next call could be granted.
+        """
+        with self._dispatch_lock:
+            return self._dispatch()
+
+    def record_usage(self, estimated_tokens: int, response: Any) -> None:
+        """Correct the token bucket from a response's usage metadata"""
+        usage = getattr(response, "usage_metadata", None)
+        self.limiter.record_usage(estimated_tokens, getattr(usage, "total_token_count", None))
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Stop the dispatcher thread"""
+        with self._condition:
+            self._stopped = True
+            thread, self._thread = self._thread, None
+            self._condition.notify_all()
+        if thread is not None:
+            thread.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth, grants and waiting times per priority, and the limiter's levels"""
+        with self._condition:
+            priorities = {}
+            for priority in Priority:
+                metrics = dict(self._metrics[priority])
+                tenants = self._queues[priority]
+                metrics["queue_depth"] = sum(len(tickets) for tickets in tenants.values())
+                metrics["tenants_waiting"] = len(tenants)
+                metrics["wait_seconds_avg"] = metrics["wait_seconds_total"] / metrics["granted"] if metrics["granted"] else 0.0
+                priorities[priority.name.lower()] = metrics
+        return {
+            "enabled": self.limiter.enabled,
+            "requests_per_minute": self.limiter.requests_per_minute,
+            "tokens_per_minute": self.limiter.tokens_per_minute,
+            "shared": isinstance(self.limiter.store, SqliteTokenBucketStore),
+            "available": self.limiter.levels(),
+            "priorities": priorities,
+        }
+
+    # Queue handling (callers hold self._condition, except for _dispatch)
+
+    def _head(self) -> Optional[_Ticket]:
+        for priority in Priority:
+            tenants = self._queues[priority]
+            if tenants:
+                return next(iter(tenants.values()))[0]
+        return None
+
+    def _dispatch(self) -> Optional[float]:
+        while True:
+            with self._condition:
+                ticket = self._head()
+            if ticket is None:
+                return None
+            # The store may be a SQLite file locked by another worker, so it is used without the condition
+            try:
+                wait = self.limiter.try_acquire(ticket.tokens)
+            except Exception as e:
+                logger.error("Rate limiter store failed, retrying: %s", e)
+                return self.MAX_POLL_SECONDS
+            if wait > 0:
+                return min(wait, self.MAX_POLL_SECONDS)
+            with self._condition:
+                granted = ticket.state == "queued"
+                if granted:
+                    self._remove(ticket, rotate=True)
+                    self._grant(ticket)
+            if not granted:
+                # Timed out or cancelled while its tokens were being taken
+                self._release(ticket)
+
+    def _release(self, ticket: _Ticket) -> None:
+        try:
+            self.limiter.release(ticket.tokens)
+        except Exception as e:
+            logger.error("Rate limiter store failed, tokens of a cancelled call not returned: %s", e)
+
+    def _remove(self, ticket: _Ticket, rotate: bool = False) -> None:
+        """Take a ticket out of its queue; with rotate, its tenant goes to the back of the line"""
+        tenants = self._queues[ticket.priority]
+        tickets = tenants[ticket.tenant]
+        tickets.remove(ticket)
+        if not tickets:
+            del tenants[ticket.tenant]
+        elif rotate:
+            tenants.move_to_end(ticket.tenant)
+
+    def _grant(self, ticket: _Ticket) -> None:
+        ticket.state = "granted"
+        waited = self.clock() - ticket.enqueued_at
+        metrics = self._metrics[ticket.priority]
+        metrics["granted"] += 1
+        metrics["wait_seconds_total"] += waited
+        metrics["wait_seconds_max"] = max(metrics["wait_seconds_max"], waited)
+        ticket.granted.set()
+        if ticket.future is not None:
+            try:
+                ticket.loop.call_soon_threadsafe(_resolve, ticket.future)
+            except RuntimeError:
+                pass  # The waiting event loop is gone
+
+    def _cancel(self, ticket: _Ticket) -> bool:
+        """Withdraw a queued ticket. Returns False if it was granted in the meantime."""
+        with self._condition:
+            if ticket.state != "queued":
+                return ticket.state == "cancelled"
+            self._remove(ticket)
+            ticket.state = "cancelled"
+            return True
+
+    def _give_up(self, ticket: _Ticket) -> None:
+        if not self._cancel(ticket):
+            return
+        with self._condition:
+            self._metrics[ticket.priority]["timeouts"] += 1
+        raise RateLimitTimeout(
+            f"Gemini rate limit: call waited more than {self.queue_timeout:g}s for its turn",
+            retry_after=max(1, math.ceil(self.queue_timeout))
+        )
+
+    # Dispatcher thread
+
+    def _start(self) -> None:
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="gemini-scheduler", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        wait = None
+        while True:
+            with self._condition:
+                if not self._stopped and not self._woken:
+                    self._condition.wait(wait)
+                if self._stopped:
+                    return
+                self._woken = False
+            wait = self.dispatch()
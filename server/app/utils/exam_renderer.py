@@ -0,0 +1,233 @@
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+import html
+import importlib.util
+import io
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it PDFs are built from the images as stored
+    Image = None
+
+# fpdf2 is optional (without it only HTML exports are available) and slow to import, so it is
+# imported by render_pdf
+PDF_AVAILABLE = importlib.util.find_spec("fpdf") is not None
+
+# Bump when the output changes, so cached exports made by older code are not served
+RENDER_VERSION = 1
+
+PDF_IMAGE_MAX_PIXELS = 1200  # Longest side of an image embedded in a PDF
+PDF_PX_TO_MM = 25.4 / 150  # Images are placed at 150 dpi
+
+_INSTRUCTIONS = {
+    "MCQ": "Choose the one correct option.",
+    "MSQ": "Choose all the correct options.",
+    "NUM": "Answer with a number.",
+}
+
+# Typographic characters outside Latin-1 with a close ASCII equivalent, for PDFs without EXPORT_PDF_FONT
+_LATIN1_FALLBACKS = str.maketrans({
+    "\u2013": "-", "\u2014": "-", "\u2212": "-", "\u2018": "'", "\u2019": "'",
+    "\u201c": '"', "\u201d": '"', "\u2026": "...", "\u2264": "<=", "\u2265": ">=", "\u2260": "!=",
+})
+
+_HTML_STYLE = """
+body { font-family: Georgia, "Times New Roman", serif; max-width: 52rem; margin: 2rem auto; padding: 0 1rem; color: #111; }
+header { border-bottom: 2px solid #111; margin-bottom: 1.5rem; }
+h1 { margin-bottom: 0.25rem; }
+section { margin-bottom: 2rem; }
+section h2 { margin-bottom: 0.25rem; }
+.meta { color: #444; margin-top: 0; }
+.question { break-inside: avoid; margin: 1rem 0; }
+.question p { white-space: pre-wrap; margin: 0.25rem 0; }
+.question img { max-width: 100%; max-height: 20rem; display: block; margin: 0.5rem 0; }
+ol.options { list-style-type: upper-alpha; margin: 0.25rem 0; }
+ol.options img { max-height: 8rem; }
+.answer-box { border: 1px solid #888; display: inline-block; min-width: 10rem; height: 1.5rem; }
+@media print { body { margin: 0; max-width: none; } section { break-before: page; } section:first-of-type { break-before: auto; } }
+"""
+
+
+@dataclass
+class QuestionSnapshot:
+    number: int
+    text: str
+    question_type: str
+    image_url: Optional[str] = None
+    options: List[Tuple[str, Optional[str]]] = field(default_factory=list)  # (text, image URL)
+
+
+@dataclass
+class SectionSnapshot:
+    name: str
+    question_type: str
+    total_questions: int
+    questions_to_attempt: int
+    marks_per_question: float
+    negative_marks: Optional[float]
+    questions: List[QuestionSnapshot]
+
+    def image_urls(self) -> List[str]:
+        urls = []
+        for question in self.questions:
+            if question.image_url:
+                urls.append(question.image_url)
+            urls.extend(image_url for _, image_url in question.options if image_url)
+        return urls
+
+
+@dataclass
+class ExamSnapshot:
+    """What an export shows of an exam, detached from the database session"""
+    id: int
+    name: str
+    version: int
+    total_marks: float
+    time_minutes: int
+    sections: List[SectionSnapshot]
+
+
+def section_summary(section: SectionSnapshot) -> str:
+    """The marking line printed under a section heading"""
+    summary = (
+        f"{section.total_questions} questions, attempt {section.questions_to_attempt}. "
+        f"{section.marks_per_question:g} marks each"
+    )
+    if section.negative_marks:
+        summary += f", {section.negative_marks:g} deducted for a wrong answer"
+    return f"{summary}. {_INSTRUCTIONS.get(section.question_type, '')}".strip()
+
+
+# HTML
+
+def render_html_head(exam: ExamSnapshot) -> str:
+    name = html.escape(exam.name or "Exam")
+    return (
+        f"<!DOCTYPE html>\n<html lang=\"en\">\n<head>\n<meta charset=\"utf-8\">\n<title>{name}</title>\n"
+        f"<style>{_HTML_STYLE}</style>\n</head>\n<body>\n"
+        f"<header><h1>{name}</h1>"
+        f"<p class=\"meta\">Total marks: {exam.total_marks or 0:g} &middot; Time: {exam.time_minutes or 0} minutes</p></header>\n"
+    )
+
+
+def render_section_html(section: SectionSnapshot) -> str:
+    parts = [
+        f"<section>\n<h2>{html.escape(section.name or '')}</h2>\n"
+        f"<p class=\"meta\">{html.escape(section_summary(section))}</p>\n"
+    ]
+    for question in section.questions:
+        parts.append(f"<div class=\"question\">\n<p><strong>Q{question.number}.</strong> {html.escape(question.text or '')}</p>\n")
+        if question.image_url:
+            parts.append(f"<img src=\"{html.escape(question.image_url)}\" alt=\"\">\n")
+        if question.options:
+            parts.append("<ol class=\"options\">\n")
+            for text, image_url in question.options:
+                image = f"<img src=\"{html.escape(image_url)}\" alt=\"\">" if image_url else ""
+                parts.append(f"<li>{html.escape(text or '')}{image}</li>\n")
+            parts.append("</ol>\n")
+        elif question.question_type == "NUM":
+            parts.append("<p>Answer: <span class=\"answer-box\"></span></p>\n")
+        parts.append("</div>\n")
+    parts.append("</section>\n")
+    return "".join(parts)
+
+
+def render_html_tail() -> str:
+    return "</body>\n</html>\n"
+
+
+# PDF
+
+def prepare_pdf_image(data: bytes) -> Optional[Tuple[bytes, int, int]]:
+    """Downscale and re-encode an image for embedding, returning (JPEG or PNG bytes, width, height)"""
+    if Image is None:
+        return data, 0, 0
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image.draft("RGB", (PDF_IMAGE_MAX_PIXELS, PDF_IMAGE_MAX_PIXELS))
+            image = ImageOps.exif_transpose(image)
+            has_alpha = image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info)
+            image = image.convert("RGBA" if has_alpha else "RGB")
+            image.thumbnail((PDF_IMAGE_MAX_PIXELS, PDF_IMAGE_MAX_PIXELS), Image.Resampling.LANCZOS)
+            buffer = io.BytesIO()
+            if has_alpha:
+                image.save(buffer, format="PNG", optimize=True)
+            else:
+                image.save(buffer, format="JPEG", quality=85)
+            return buffer.getvalue(), image.width, image.height
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+
+
+def prepare_section_images(
+    section: SectionSnapshot,
+    fetch: Callable[[str], Optional[bytes]]
+) -> Dict[str, Tuple[bytes, int, int]]:
+    """Fetch and prepare every image of a section for render_pdf (missing or broken images are left out)"""
+    images = {}
+    for url in dict.fromkeys(section.image_urls()):
+        data = fetch(url)
+        prepared = prepare_pdf_image(data) if data else None
+        if prepared:
+            images[url] = prepared
+    return images
+
+
+def render_pdf(exam: ExamSnapshot, images: Dict[str, Tuple[bytes, int, int]], font_path: Optional[str] = None) -> bytes:
+    """Lay out an exam as a PDF (A4), using images prepared by prepare_section_images"""
+    from fpdf import FPDF
+
+    pdf = FPDF(format="A4")
+    pdf.set_auto_page_break(True, margin=15)
+    pdf.set_title(exam.name or "Exam")
+
+    if font_path:
+        pdf.add_font("Body", "", font_path)
+        pdf.add_font("Body", "B", font_path)
+        family = "Body"
+    else:
+        family = "Helvetica"
+
+    def text(value: Optional[str]) -> str:
+        # The built-in PDF fonts only cover Latin-1
+        value = value or ""
+        if font_path:
+            return value
+        return value.translate(_LATIN1_FALLBACKS).encode("latin-1", "replace").decode("latin-1")
+
+    def line(value: str, size: float, style: str = "", height: float = 6, indent: float = 0) -> None:
+        pdf.set_font(family, style, size)
+        pdf.set_x(pdf.l_margin + indent)
+        pdf.multi_cell(pdf.epw - indent, height, text(value), new_x="LMARGIN", new_y="NEXT")
+
+    def image(url: Optional[str], max_width: float, indent: float = 0) -> None:
+        prepared = images.get(url) if url else None
+        if not prepared:
+            return
+        data, width, height = prepared
+        width_mm = min(width * PDF_PX_TO_MM, max_width) if width else max_width
+        pdf.image(io.BytesIO(data), x=pdf.l_margin + indent, w=width_mm)
+        pdf.ln(2)
+
+    pdf.add_page()
+    line(exam.name or "Exam", 18, "B", height=9)
+    line(f"Total marks: {exam.total_marks or 0:g}    Time: {exam.time_minutes or 0} minutes", 11)
+    pdf.ln(4)
+
+    for index, section in enumerate(exam.sections):
+        if index:
+            pdf.add_page()
+        line(section.name or "", 14, "B", height=8)
+        line(section_summary(section), 10)
+        pdf.ln(3)
+        for question in section.questions:
+            line(f"Q{question.number}. {question.text or ''}", 11)
+            image(question.image_url, pdf.epw * 0.8)
+            for option_index, (option_text, option_image) in enumerate(question.options):
+                line(f"({chr(ord('A') + option_index)}) {option_text or ''}", 11, indent=6)
+                image(option_image, pdf.epw * 0.4, indent=12)
+            if question.question_type == "NUM":
+                line("Answer: ____________", 11, indent=6)
+            pdf.ln(3)
+
+    return bytes(pdf.output())
@@ -1,89 +1,108 @@
-import os
 import uuid
-import firebase_admin
-from firebase_admin import credentials, storage
+import asyncio
+import logging
+from typing import Optional
 from fastapi import UploadFile
-from dotenv import load_dotenv
-import tempfile
 
-load_dotenv()
+from app.core.config import settings
+from app.utils.helpers import sniff_image_type
+from app.utils.storage_backends import get_storage_backend
+
+logger = logging.getLogger(__name__)
 
-# Initialize Firebase with credentials
-try:
-    # Path to Firebase service account JSON file
-    cred_path = os.getenv("FIREBASE_CREDENTIALS_PATH")
-    
-    if not firebase_admin._apps:
-        if cred_path and os.path.exists(cred_path):
-            cred = credentials.Certificate(cred_path)
-            firebase_admin.initialize_app(cred, {
-                'storageBucket': os.getenv("FIREBASE_STORAGE_BUCKET")
-            })
-        else:
-            # For local development/testing without credentials
-            firebase_admin.initialize_app()
-    
-    # Get bucket reference
-    bucket = storage.bucket()
-except Exception as e:
-    print(f"Firebase initialization error: {e}")
-    # This allows the app to run even if Firebase isn't properly configured yet
-    bucket = None
 
 class FirebaseStorageService:
+    """Image storage used by the services.
+    
+    Despite the name, files go to the backend selected by STORAGE_BACKEND
+    (Firebase Storage or the local filesystem).
+    """
+    
     @staticmethod
-    async def upload_image(file: UploadFile, folder: str = "questions") -> str:
+    async def upload_image(file: UploadFile, folder: str = "questions", name: Optional[str] = None) -> str:
         """
-        Upload image to Firebase Storage
+        Upload image to storage
+        
+        The file is read in chunks and streamed to the storage backend (a
+        resumable upload on Firebase), so at most one chunk is held in memory.
+        Blocking SDK calls run in a worker thread to keep the event loop free.
         
         Args:
             file: The image file to upload
-            folder: The folder path in Firebase Storage
+            folder: The folder path in storage
+            name: File name without extension (a random UUID when omitted)
             
         Returns:
             URL of the uploaded image
+            
+        Raises:
+            ValueError: If storage is not initialized, the file is not a PNG, JPEG, GIF, WebP or AVIF image,
+                or it is larger than MAX_UPLOAD_BYTES
         """
-        if not bucket:
-            raise ValueError("Firebase Storage not initialized")
+        backend = get_storage_backend()
+        max_bytes = settings.MAX_UPLOAD_BYTES
+        if file.size is not None and file.size > max_bytes:
+            raise ValueError(f"Image is larger than the maximum of {max_bytes} bytes")
+        
+        # The type comes from the file's content; the client's file name and content type are not trusted
+        chunk_size = _upload_chunk_size()
+        chunk = await file.read(chunk_size)
+        image_type = sniff_image_type(chunk)
+        if image_type is None:
+            raise ValueError("File must be a PNG, JPEG, GIF, WebP or AVIF image")
+        file_extension, content_type = image_type
         
         # Create a unique filename
-        file_extension = os.path.splitext(file.filename)[1]
-        unique_filename = f"{uuid.uuid4()}{file_extension}"
+        unique_filename = f"{name or uuid.uuid4()}{file_extension}"
         
-        # Full path in Firebase Storage
+        # Full path in storage
         file_path = f"{folder}/{unique_filename}"
         
-        # Save the file temporarily
-        with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-            # Read the file content
-            content = await file.read()
-            # Write to temporary file
-            temp_file.write(content)
-            temp_file_path = temp_file.name
+        writer = await asyncio.to_thread(backend.open_writer, file_path, content_type, chunk_size)
         
         try:
-            # Upload to Firebase Storage
-            blob = bucket.blob(file_path)
-            blob.upload_from_filename(temp_file_path)
-            
-            # Make the file publicly accessible
-            blob.make_public()
+            total = 0
+            while chunk:
+                total += len(chunk)
+                if total > max_bytes:
+                    raise ValueError(f"Image is larger than the maximum of {max_bytes} bytes")
+                await asyncio.to_thread(writer.write, chunk)
+                chunk = await file.read(chunk_size)
             
-            # Remove temporary file
-            os.unlink(temp_file_path)
+            # Publish the file (made public on Firebase)
+            await asyncio.to_thread(writer.close)
+        except BaseException:
+            # Too large, client gone, storage error or cancelled: leave nothing behind
+            await asyncio.to_thread(writer.abort)
+            raise
+        
+        # Return public URL
+        return backend.url_for(file_path)
+    
+    @staticmethod
+    async def upload_bytes(data: bytes, folder: str, extension: str, content_type: str, name: Optional[str] = None) -> str:
+        """
+        Upload already processed image bytes to storage
+        
+        Args:
+            data: The image bytes
+            folder: The folder path in storage
+            extension: File extension including the dot, e.g. ".webp"
+            content_type: MIME type of the image
+            name: File name without extension (a random UUID when omitted)
             
-            # Return public URL
-            return blob.public_url
-        except Exception as e:
-            # Clean up temporary file in case of error
-            if os.path.exists(temp_file_path):
-                os.unlink(temp_file_path)
-            raise e
+        Returns:
+            URL of the uploaded image
+        """
+        backend = get_storage_backend()
+        file_path = f"{folder}/{name or uuid.uuid4()}{extension}"
+        await asyncio.to_thread(backend.put, file_path, data, content_type)
+        return backend.url_for(file_path)
     
     @staticmethod
-    def delete_image(image_url: str) -> bool:
+    async def delete_image(image_url: str) -> bool:
         """
-        Delete an image from Firebase Storage
+        Delete an image from storage
         
         Args:
             image_url: The public URL of the image to delete
@@ -91,21 +110,21 @@ class FirebaseStorageService:
         Returns:
             True if deleted successfully, False otherwise
         """
-        if not bucket or not image_url:
+        if not image_url:
             return False
         
         try:
-            # Extract blob path from URL
-            # URL format: https://storage.googleapis.com/BUCKET_NAME/PATH
-            parts = image_url.split('/')
-            bucket_idx = parts.index(bucket.name)
-            if bucket_idx >= 0 and len(parts) > bucket_idx + 1:
-                blob_path = '/'.join(parts[bucket_idx + 1:])
-                blob = bucket.blob(blob_path)
-                if blob.exists():
-                    blob.delete()
-                    return True
+            backend = get_storage_backend()
+            file_path = backend.path_for(image_url)
+            if file_path:
+                return await asyncio.to_thread(backend.delete, file_path)
             return False
         except Exception as e:
-            print(f"Error deleting image: {e}")
-            return False
\ No newline at end of file
+            logger.error("Error deleting image %s: %s", image_url, e)
+            return False
+
+
+def _upload_chunk_size() -> int:
+    """Upload chunk size rounded to the 256 KB multiple required by resumable uploads"""
+    multiple = 256 * 1024
+    return max(multiple, settings.UPLOAD_CHUNK_SIZE // multiple * multiple)
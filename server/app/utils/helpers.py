@@ -1,6 +1,8 @@
+import hashlib
 import json
-from typing import Any, Dict, List, Union
-from fastapi import HTTPException, status
+import re
+from typing import Any, Dict, List, Optional, Tuple, Union
+from fastapi import HTTPException, Request, UploadFile, status
 
 def parse_json(json_str: str) -> Any:
     """Parse JSON string safely"""
@@ -29,4 +31,90 @@ def validate_section_questions(section, questions: List[Any]) -> None:
         handle_error(
             f"Expected {section.total_questions} questions, but got {len(questions)}",
             status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
\ No newline at end of file
+        )
+
+def normalize_question_text(text: str) -> str:
+    """Normalize question text for duplicate detection (case, punctuation and whitespace)"""
+    if not text:
+        return ""
+    cleaned = re.sub(r"[^\w\s]", " ", text.lower())
+    return " ".join(cleaned.split())
+
+
+def request_tenant(request: Request) -> str:
+    """Tenant a request's Gemini calls are scheduled under: the X-Tenant-ID header, else the client address"""
+    tenant = request.headers.get("x-tenant-id")
+    if tenant:
+        return tenant[:255]
+    return request.client.host if request.client else "anonymous"
+
+def format_sse(event: str, data: str) -> str:
+    """Format a Server-Sent Event"""
+    lines = "".join(f"data: {line}\n" for line in data.splitlines() or [""])
+    return f"event: {event}\n{lines}\n"
+
+
+async def read_upload(file: UploadFile, max_bytes: int, chunk_size: int = 1024 * 1024) -> bytes:
+    """Read an uploaded file in chunks, rejecting it as soon as it exceeds max_bytes"""
+    if file.size is not None and file.size > max_bytes:
+        raise ValueError(f"Image is larger than the maximum of {max_bytes} bytes")
+    
+    chunks = []
+    total = 0
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > max_bytes:
+            raise ValueError(f"Image is larger than the maximum of {max_bytes} bytes")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+async def hash_upload(file: UploadFile, max_bytes: int, chunk_size: int = 1024 * 1024) -> str:
+    """Stream an uploaded file through SHA-256 and rewind it, rejecting it as soon as it exceeds max_bytes"""
+    if file.size is not None and file.size > max_bytes:
+        raise ValueError(f"Image is larger than the maximum of {max_bytes} bytes")
+    
+    digest = hashlib.sha256()
+    total = 0
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > max_bytes:
+            raise ValueError(f"Image is larger than the maximum of {max_bytes} bytes")
+        digest.update(chunk)
+    await file.seek(0)
+    return digest.hexdigest()
+
+
+# Image formats accepted for upload, as (extension, content type)
+IMAGE_TYPES = {
+    "PNG": (".png", "image/png"),
+    "JPEG": (".jpg", "image/jpeg"),
+    "GIF": (".gif", "image/gif"),
+    "WEBP": (".webp", "image/webp"),
+    "AVIF": (".avif", "image/avif"),
+}
+
+
+def sniff_image_type(header: bytes) -> Optional[Tuple[str, str]]:
+    """Extension and content type of an image from its first bytes, or None if it isn't one of IMAGE_TYPES"""
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return IMAGE_TYPES["PNG"]
+    if header.startswith(b"\xff\xd8\xff"):
+        return IMAGE_TYPES["JPEG"]
+    if header.startswith((b"GIF87a", b"GIF89a")):
+        return IMAGE_TYPES["GIF"]
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return IMAGE_TYPES["WEBP"]
+    if header[4:8] == b"ftyp":
+        # ISO media file: AVIF when its major or one of its compatible brands says so
+        box_size = int.from_bytes(header[:4], "big")
+        brands = [header[8:12]] + [header[offset:offset + 4] for offset in range(16, min(box_size, len(header)), 4)]
+        if b"avif" in brands or b"avis" in brands:
+            return IMAGE_TYPES["AVIF"]
+    return None
@@ -0,0 +1,187 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from typing import Optional
+import asyncio
+import io
+import logging
+import multiprocessing
+import threading
+
+from app.core.config import settings
+
+try:
+    from PIL import Image, ImageOps, UnidentifiedImageError
+except ImportError:  # Pillow is optional; without it images are stored as uploaded
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Output format -> (file extension, content type)
+OUTPUT_FORMATS = {
+    "WEBP": (".webp", "image/webp"),
+    "AVIF": (".avif", "image/avif"),
+    "JPEG": (".jpg", "image/jpeg"),
+    "PNG": (".png", "image/png"),
+}
+
+# Formats decoded from uploads (those helpers.sniff_image_type accepts); no other Pillow plugin sees user data
+INPUT_FORMATS = ("PNG", "JPEG", "GIF", "WEBP", "AVIF")
+
+
+@dataclass
+class ProcessedImage:
+    """Result of the image pipeline: the display image and its thumbnail"""
+    data: bytes
+    thumbnail: bytes
+    extension: str
+    content_type: str
+    width: int
+    height: int
+
+
+def process_image(
+    data: bytes,
+    max_width: int,
+    max_height: int,
+    output_format: str,
+    quality: int,
+    thumbnail_size: int,
+    max_pixels: int
+) -> ProcessedImage:
+    """
+    Validate, downscale and transcode an image, and build its thumbnail
+
+    Runs in a worker process, so it only takes and returns picklable values.
+
+    Args:
+        data: The uploaded image bytes
+        max_width: Maximum width of the display image (smaller images are not upscaled)
+        max_height: Maximum height of the display image
+        output_format: One of OUTPUT_FORMATS
+        quality: Encoder quality (1-100)
+        thumbnail_size: Bounding box of the thumbnail in pixels
+        max_pixels: Images with more pixels than this are rejected before they are decoded (decompression bombs)
+
+    Returns:
+        The processed image and thumbnail
+
+    Raises:
+        ValueError: If the data is not a decodable image or is too large
+    """
+    extension, content_type = OUTPUT_FORMATS[output_format]
+
+    try:
+        with Image.open(io.BytesIO(data), formats=INPUT_FORMATS) as image:
+            # Only the header has been read so far. Pillow's own MAX_IMAGE_PIXELS check merely warns
+            # below twice its limit, and is process-wide, so the limit is checked here instead
+            if image.width * image.height > max_pixels:
+                raise ValueError(
+                    f"Image is {image.width}x{image.height} pixels, more than the maximum of {max_pixels}"
+                )
+            # Let JPEG decoders skip work when the image will be downscaled anyway
+            image.draft("RGB", (max_width, max_height))
+            image.load()
+            image = ImageOps.exif_transpose(image)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+        raise ValueError(f"Invalid image: {str(e)}")
+
+    has_alpha = image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info)
+    image = image.convert("RGBA" if has_alpha else "RGB")
+    if output_format == "JPEG" and has_alpha:
+        image = image.convert("RGB")
+
+    image.thumbnail((max_width, max_height), Image.Resampling.LANCZOS)
+    main_bytes = _encode(image, output_format, quality)
+
+    thumbnail = image.copy()
+    thumbnail.thumbnail((thumbnail_size, thumbnail_size), Image.Resampling.LANCZOS)
+    thumbnail_bytes = _encode(thumbnail, output_format, quality)
+
+    return ProcessedImage(
+        data=main_bytes,
+        thumbnail=thumbnail_bytes,
+        extension=extension,
+        content_type=content_type,
+        width=image.width,
+        height=image.height
+    )
+
+
+def _encode(image, output_format: str, quality: int) -> bytes:
+    buffer = io.BytesIO()
+    options = {"quality": quality}
+    if output_format == "WEBP":
+        options["method"] = 4  # Good size/speed trade-off
+    elif output_format == "PNG":
+        options = {"optimize": True}
+    image.save(buffer, format=output_format, **options)
+    return buffer.getvalue()
+
+
+class ImagePipeline:
+    """Runs process_image in a process pool so image work never blocks the event loop"""
+
+    def __init__(self, workers: Optional[int] = None):
+        self.workers = workers or None  # None = one process per CPU
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        """Whether uploads should go through the pipeline"""
+        return settings.IMAGE_PIPELINE_ENABLED and Image is not None
+
+    @property
+    def variant(self) -> str:
+        """Identifies the output the current settings produce, so stored results are only reused for the same settings"""
+        if not self.enabled:
+            return "original"
+        return (
+            f"{settings.IMAGE_OUTPUT_FORMAT.upper()}-q{settings.IMAGE_QUALITY}-"
+            f"{settings.IMAGE_MAX_WIDTH}x{settings.IMAGE_MAX_HEIGHT}-t{settings.IMAGE_THUMBNAIL_SIZE}"
+        )
+
+    async def process(self, data: bytes) -> ProcessedImage:
+        """Process an uploaded image in the worker pool"""
+        output_format = settings.IMAGE_OUTPUT_FORMAT.upper()
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported IMAGE_OUTPUT_FORMAT: {settings.IMAGE_OUTPUT_FORMAT}")
+
+        job = partial(
+            process_image,
+            data,
+            settings.IMAGE_MAX_WIDTH,
+            settings.IMAGE_MAX_HEIGHT,
+            output_format,
+            settings.IMAGE_QUALITY,
+            settings.IMAGE_THUMBNAIL_SIZE,
+            settings.IMAGE_MAX_PIXELS
+        )
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), job)
+
+    def shutdown(self) -> None:
+        """Stop the worker processes"""
+        with self._lock:
+            if self._executor:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # Created on first use so importing the app doesn't start processes. Workers come from a
+        # forkserver: forking this process directly would copy it mid-way through its other threads
+        # (log writer, scheduler, job workers), whose locks could then never be released in the child
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("forkserver")
+                )
+            return self._executor
+
+
+if settings.IMAGE_PIPELINE_ENABLED and Image is None:
+    logger.warning("IMAGE_PIPELINE_ENABLED is set but Pillow is not installed; images will be stored as uploaded")
+
+image_pipeline = ImagePipeline(workers=settings.IMAGE_PIPELINE_WORKERS)
@@ -0,0 +1,68 @@
+import json
+from typing import Any, AsyncIterator, Dict, List
+
+
+class JsonArrayStreamParser:
+    """Incremental parser for a JSON object holding one array of objects.
+
+    Gemini's structured output for a batch looks like `{"questions": [{...}, {...}]}`.
+    Text is fed in arbitrary chunks as it streams in, and every element of the
+    array is returned as soon as its closing brace has arrived, without waiting
+    for the rest of the document. Only the characters of the element currently
+    being read are buffered.
+    """
+
+    def __init__(self):
+        self._depth = 0  # Nesting depth of {} / [] seen so far
+        self._in_array = False  # Inside the top-level array
+        self._in_string = False
+        self._escaped = False
+        self._item: List[str] = []  # Characters of the element being read
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """Consume a chunk of text and return the array elements it completed"""
+        items = []
+        for char in chunk:
+            if self._item:
+                self._item.append(char)
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+                if char == "[" and self._depth == 2 and not self._in_array:
+                    self._in_array = True
+                elif char == "{" and self._depth == 3 and self._in_array:
+                    self._item = [char]
+            elif char in "}]":
+                self._depth -= 1
+                if char == "}" and self._depth == 2 and self._item:
+                    items.append(json.loads("".join(self._item)))
+                    self._item = []
+                elif char == "]" and self._depth == 1:
+                    self._in_array = False
+        return items
+
+
+async def ndjson_lines(chunks: AsyncIterator[bytes], max_line_bytes: int = 1024 * 1024) -> AsyncIterator[bytes]:
+    """Split a byte stream into lines, buffering only the current partial line"""
+    pending = b""
+    async for chunk in chunks:
+        pending += chunk
+        lines = pending.split(b"\n")
+        pending = lines.pop()
+        if len(pending) > max_line_bytes:
+            raise ValueError(f"Line longer than {max_line_bytes} bytes")
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
@@ -0,0 +1,104 @@
+from typing import Dict, Hashable, List, Optional, Sequence, Set, Tuple
+import hashlib
+import random
+import struct
+
+from app.utils.helpers import normalize_question_text
+
+NUM_HASHES = 64
+BANDS = 16  # 16 bands of 4 rows: pairs above ~0.5 similarity almost always share a band
+ROWS_PER_BAND = NUM_HASHES // BANDS
+SIGNATURE_PREFIX = "mh1:"  # Changes whenever the shingling or hash functions do
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_rng = random.Random(20240601)  # Fixed seed: stored signatures must stay comparable across processes
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME)) for _ in range(NUM_HASHES)]
+
+Signature = Tuple[int, ...]
+
+
+def shingles(text: str) -> Set[str]:
+    """Word bigrams of the normalized text (the single word for one-word texts)"""
+    words = normalize_question_text(text).split()
+    if len(words) < 2:
+        return set(words)
+    return {f"{first} {second}" for first, second in zip(words, words[1:])}
+
+
+def minhash_signature(text: str) -> Signature:
+    """The MinHash signature of a question text"""
+    values = [
+        int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "little")
+        for shingle in shingles(text)
+    ]
+    if not values:
+        return (_MAX_HASH,) * NUM_HASHES
+    return tuple(
+        min((a * value + b) % _MERSENNE_PRIME for value in values) & _MAX_HASH
+        for a, b in _PERMUTATIONS
+    )
+
+
+def encode_signature(signature: Signature) -> str:
+    """Compact text form of a signature for the database"""
+    return SIGNATURE_PREFIX + struct.pack(f"<{NUM_HASHES}I", *signature).hex()
+
+
+def decode_signature(value: Optional[str]) -> Optional[Signature]:
+    """Parse a stored signature (None if missing or made by an older scheme)"""
+    if not value or not value.startswith(SIGNATURE_PREFIX):
+        return None
+    try:
+        return struct.unpack(f"<{NUM_HASHES}I", bytes.fromhex(value[len(SIGNATURE_PREFIX):]))
+    except (ValueError, struct.error):
+        return None
+
+
+def similarity(first: Signature, second: Signature) -> float:
+    """Estimated Jaccard similarity of the texts two signatures were made from"""
+    return sum(a == b for a, b in zip(first, second)) / NUM_HASHES
+
+
+class NearDuplicateIndex:
+    """In-memory LSH index of question signatures.
+
+    A MinHash signature keeps, for each of NUM_HASHES seeded hash functions,
+    the smallest hash of any word bigram of the normalized text; the share of
+    positions where two signatures agree estimates the Jaccard similarity of
+    the two texts. Signatures are split into bands and only entries sharing a
+    whole band are compared, so a lookup touches a handful of candidates
+    instead of every question in the exam.
+
+    This catches questions that reuse most of the same wording (small edits,
+    reordered clauses), not paraphrases written with different words.
+    """
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        self._signatures: Dict[Hashable, Signature] = {}
+        self._bands: List[Dict[Sequence[int], List[Hashable]]] = [{} for _ in range(BANDS)]
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def add(self, key: Hashable, signature: Signature) -> None:
+        self._signatures[key] = signature
+        for band, rows in zip(self._bands, self._band_slices(signature)):
+            band.setdefault(rows, []).append(key)
+
+    def find(self, signature: Signature) -> Optional[Tuple[Hashable, float]]:
+        """The most similar indexed entry at or above the threshold, with its similarity"""
+        candidates = set()
+        for band, rows in zip(self._bands, self._band_slices(signature)):
+            candidates.update(band.get(rows, ()))
+
+        best: Optional[Tuple[Hashable, float]] = None
+        for key in candidates:
+            score = similarity(signature, self._signatures[key])
+            if score >= self.threshold and (best is None or score > best[1]):
+                best = (key, score)
+        return best
+
+    def _band_slices(self, signature: Signature) -> List[Sequence[int]]:
+        return [signature[i:i + ROWS_PER_BAND] for i in range(0, NUM_HASHES, ROWS_PER_BAND)]
@@ -0,0 +1,149 @@
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+import math
+import threading
+
+from app.utils.helpers import normalize_question_text
+
+TOPIC_WEIGHT = 3.0  # A query term in the stored section name counts this much more than one in the text
+CONTEXT_WEIGHT = 0.5  # Exam name terms only break ties between questions that already match the topic
+
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from how in is it of on or that the this to was what when which who why with "
+    "section part paper exam test questions question".split()
+)
+
+
+def terms(text: Optional[str]) -> Set[str]:
+    """Searchable terms of a text: normalized words, without stopwords and single characters"""
+    return {word for word in normalize_question_text(text or "").split() if len(word) > 1 and word not in _STOPWORDS}
+
+
+@dataclass(frozen=True)
+class BankEntry:
+    question_id: int
+    exam_id: int
+    question_type: str
+    topic: FrozenSet[str]  # Terms of the section name the question was saved under
+    text: FrozenSet[str]  # Terms of the question text
+
+
+class QuestionBankIndex:
+    """In-process inverted index of saved questions for the question bank.
+
+    Postings are keyed by (question type, term), so a lookup only touches
+    questions of the section's type that share a word with its name. A
+    match scores the IDF of each query term found, weighted by
+    TOPIC_WEIGHT when it is in the section name the question was saved
+    under. Only questions saved under a section whose name shares a term
+    with the query are returned; words in the text just rank them.
+
+    `last_question_id` is the highest question ID indexed, which lets a
+    process pick up questions other workers inserted with one cheap query.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.built = False
+        self.last_question_id = 0
+        self._entries: Dict[int, BankEntry] = {}
+        self._postings: Dict[Tuple[str, str], Set[int]] = {}
+        self._type_counts: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.built = False
+            self.last_question_id = 0
+            self._entries.clear()
+            self._postings.clear()
+            self._type_counts.clear()
+
+    def add(self, entry: BankEntry) -> None:
+        """Index a question, replacing what was indexed for it before"""
+        with self.lock:
+            self.remove(entry.question_id)
+            self._entries[entry.question_id] = entry
+            self._type_counts[entry.question_type] = self._type_counts.get(entry.question_type, 0) + 1
+            for term in entry.topic | entry.text:
+                self._postings.setdefault((entry.question_type, term), set()).add(entry.question_id)
+            self.last_question_id = max(self.last_question_id, entry.question_id)
+
+    def add_many(self, entries: Iterable[BankEntry]) -> int:
+        count = 0
+        with self.lock:
+            for entry in entries:
+                self.add(entry)
+                count += 1
+        return count
+
+    def remove(self, question_id: int) -> None:
+        with self.lock:
+            entry = self._entries.pop(question_id, None)
+            if entry is None:
+                return
+            self._type_counts[entry.question_type] -= 1
+            for term in entry.topic | entry.text:
+                key = (entry.question_type, term)
+                posting = self._postings.get(key)
+                if posting is not None:
+                    posting.discard(question_id)
+                    if not posting:
+                        del self._postings[key]
+
+    def search(
+        self,
+        question_type: str,
+        topic: Set[str],
+        context: Set[str] = frozenset(),
+        limit: int = 10,
+        exclude_exam_id: Optional[int] = None
+    ) -> List[Tuple[int, float]]:
+        """The best matching question IDs of a type as (question ID, score), highest score first"""
+        with self.lock:
+            total = self._type_counts.get(question_type, 0)
+            if not total or not topic:
+                return []
+
+            scores: Dict[int, float] = {}
+            on_topic: Set[int] = set()
+            for term in topic:
+                posting = self._postings.get((question_type, term))
+                if not posting:
+                    continue
+                idf = math.log(1 + total / len(posting))
+                for question_id in posting:
+                    entry = self._entries[question_id]
+                    if entry.exam_id == exclude_exam_id:
+                        continue
+                    weight = 1.0
+                    if term in entry.topic:
+                        weight = TOPIC_WEIGHT
+                        on_topic.add(question_id)
+                    scores[question_id] = scores.get(question_id, 0.0) + weight * idf
+
+            for term in context - topic:
+                posting = self._postings.get((question_type, term))
+                if not posting:
+                    continue
+                idf = math.log(1 + total / len(posting))
+                for question_id in posting.intersection(on_topic):
+                    scores[question_id] += CONTEXT_WEIGHT * idf
+
+        # Newer questions first among equal scores
+        ranked = sorted(
+            ((question_id, scores[question_id]) for question_id in on_topic),
+            key=lambda item: (-item[1], -item[0])
+        )
+        return ranked[:limit]
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                "questions": len(self._entries),
+                "terms": len(self._postings),
+                "last_question_id": self.last_question_id,
+                **{f"{question_type.lower()}_questions": count for question_type, count in sorted(self._type_counts.items())},
+            }
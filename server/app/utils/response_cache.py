@@ -0,0 +1,112 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from email.utils import formatdate
+from typing import Any, Dict, Hashable, Optional, Tuple
+import threading
+
+from fastapi import Response
+
+from app.core.config import settings
+
+
+@dataclass
+class CachedResponse:
+    """A serialized JSON response body together with its validators"""
+    etag: str
+    body: bytes
+    last_modified: Optional[str] = None
+
+    def headers(self) -> Dict[str, str]:
+        return validator_headers(self.etag, self.last_modified)
+
+    def to_response(self) -> Response:
+        return Response(content=self.body, media_type="application/json", headers=self.headers())
+
+
+class ResponseCache:
+    """Small in-process LRU of serialized GET responses.
+
+    Entries are stored with the ETag they were built for and only returned
+    while the caller's current ETag still matches, so a stale entry (for
+    example after a write handled by another worker) is never served.
+    Question updates also invalidate their entries right away.
+    Keys are tuples starting with a kind and an object ID, e.g.
+    ("question", 12) or ("exam", 3, include_counts).
+    """
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[Hashable, ...], CachedResponse]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def get(self, key: Tuple[Hashable, ...], etag: str) -> Optional[CachedResponse]:
+        """Get the cached response for a key if it was built for this ETag"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.etag != etag:
+                self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+            return entry
+
+    def set(self, key: Tuple[Hashable, ...], entry: CachedResponse) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, kind: str, object_id: Any) -> None:
+        """Drop every entry for an object, whatever the rest of its key"""
+        with self._lock:
+            stale = [key for key in self._entries if key[:2] == (kind, object_id)]
+            for key in stale:
+                del self._entries[key]
+            self._counters["invalidations"] += len(stale)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._counters, "entries": len(self._entries), "max_entries": self.max_entries}
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check an If-None-Match header against an ETag (weak comparison, as for GET)"""
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+def http_date(timestamp: Optional[str]) -> Optional[str]:
+    """Format one of our ISO timestamps as an HTTP date (None if unset or unparsable)"""
+    if not timestamp:
+        return None
+    try:
+        return formatdate(datetime.fromisoformat(timestamp).timestamp(), usegmt=True)
+    except ValueError:
+        return None
+
+
+def validator_headers(etag: str, last_modified: Optional[str] = None) -> Dict[str, str]:
+    """ETag/Last-Modified headers, telling clients to revalidate before reusing a response"""
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if last_modified:
+        headers["Last-Modified"] = last_modified
+    return headers
+
+
+def not_modified_response(etag: str, last_modified: Optional[str] = None) -> Response:
+    return Response(status_code=304, headers=validator_headers(etag, last_modified))
+
+
+# Shared by the routes (lookups) and the services (invalidation on writes)
+response_cache = ResponseCache(max_entries=settings.RESPONSE_CACHE_ENTRIES)
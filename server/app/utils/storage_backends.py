@@ -0,0 +1,250 @@
+from abc import ABC, abstractmethod
+from typing import Optional
+from urllib.parse import urlparse
+import logging
+import os
+import tempfile
+import threading
+
+from dotenv import load_dotenv
+
+from app.core.config import settings
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+class StorageWriter(ABC):
+    """A file being written to storage. Nothing becomes visible until close()."""
+
+    @abstractmethod
+    def write(self, data: bytes) -> None:
+        ...
+
+    @abstractmethod
+    def close(self) -> None:
+        """Finish the upload and publish the file"""
+
+    @abstractmethod
+    def abort(self) -> None:
+        """Give up on the upload, leaving nothing behind"""
+
+
+class StorageBackend(ABC):
+    """Where uploaded images are kept.
+
+    Methods are blocking; FirebaseStorageService calls them from worker
+    threads. Paths are relative, e.g. "questions/3/<hash>.webp".
+    """
+
+    @abstractmethod
+    def open_writer(self, path: str, content_type: Optional[str], chunk_size: int) -> StorageWriter:
+        """Start streaming a file to the given path"""
+
+    def put(self, path: str, data: bytes, content_type: Optional[str]) -> None:
+        """Store a file in one go"""
+        writer = self.open_writer(path, content_type, max(len(data), 1))
+        writer.write(data)
+        writer.close()
+
+    @abstractmethod
+    def read(self, path: str) -> bytes:
+        """Contents of a stored file (FileNotFoundError if it doesn't exist)"""
+
+    @abstractmethod
+    def delete(self, path: str) -> bool:
+        """Delete a file. Returns False if it didn't exist."""
+
+    @abstractmethod
+    def url_for(self, path: str) -> str:
+        """Public URL of a stored file"""
+
+    @abstractmethod
+    def path_for(self, url: str) -> Optional[str]:
+        """Storage path of a public URL, or None if the URL isn't from this backend"""
+
+
+class FirebaseStorageBackend(StorageBackend):
+    """Firebase Storage, with files made public after upload.
+
+    The Firebase app is initialized on first use rather than at import, so
+    the API starts (and the local backend works) without credentials.
+    """
+
+    def __init__(self):
+        self._bucket = None
+        self._lock = threading.Lock()
+
+    @property
+    def bucket(self):
+        with self._lock:
+            if self._bucket is None:
+                self._bucket = _init_firebase_bucket()
+            if self._bucket is None:
+                raise ValueError("Firebase Storage not initialized")
+            return self._bucket
+
+    def open_writer(self, path: str, content_type: Optional[str], chunk_size: int) -> StorageWriter:
+        blob = self.bucket.blob(path)
+        return _FirebaseWriter(blob, blob.open("wb", chunk_size=chunk_size, content_type=content_type))
+
+    def put(self, path: str, data: bytes, content_type: Optional[str]) -> None:
+        blob = self.bucket.blob(path)
+        blob.upload_from_string(data, content_type=content_type)
+        blob.make_public()
+
+    def read(self, path: str) -> bytes:
+        from google.api_core.exceptions import NotFound
+
+        try:
+            return self.bucket.blob(path).download_as_bytes()
+        except NotFound:
+            raise FileNotFoundError(path)
+
+    def delete(self, path: str) -> bool:
+        blob = self.bucket.blob(path)
+        if blob.exists():
+            blob.delete()
+            return True
+        return False
+
+    def url_for(self, path: str) -> str:
+        return self.bucket.blob(path).public_url
+
+    def path_for(self, url: str) -> Optional[str]:
+        # URL format: https://storage.googleapis.com/BUCKET_NAME/PATH
+        parts = url.split('/')
+        if self.bucket.name not in parts:
+            return None
+        bucket_idx = parts.index(self.bucket.name)
+        if len(parts) > bucket_idx + 1:
+            return '/'.join(parts[bucket_idx + 1:])
+        return None
+
+
+class _FirebaseWriter(StorageWriter):
+    def __init__(self, blob, writer):
+        self.blob = blob
+        self.writer = writer
+
+    def write(self, data: bytes) -> None:
+        self.writer.write(data)
+
+    def close(self) -> None:
+        self.writer.close()
+        self.blob.make_public()
+
+    def abort(self) -> None:
+        # The resumable upload is never finalized, so no object is created
+        pass
+
+
+class LocalStorageBackend(StorageBackend):
+    """Files on the local disk, served by the API itself (see storage_routes)"""
+
+    def __init__(self, root: str, base_url: str):
+        self.root = os.path.realpath(root)
+        self.base_url = base_url.rstrip("/")
+
+    def resolve(self, path: str) -> str:
+        """Absolute file path for a storage path, refusing paths that escape the root"""
+        full_path = os.path.realpath(os.path.join(self.root, path))
+        if os.path.commonpath([self.root, full_path]) != self.root or full_path == self.root:
+            raise ValueError(f"Invalid storage path: {path}")
+        return full_path
+
+    def open_writer(self, path: str, content_type: Optional[str], chunk_size: int) -> StorageWriter:
+        full_path = self.resolve(path)
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+        # Written next to the target and renamed on close, so readers never see a partial file
+        handle = tempfile.NamedTemporaryFile(dir=directory, prefix=".upload-", delete=False)
+        return _LocalWriter(handle, full_path)
+
+    def read(self, path: str) -> bytes:
+        with open(self.resolve(path), "rb") as handle:
+            return handle.read()
+
+    def delete(self, path: str) -> bool:
+        try:
+            os.remove(self.resolve(path))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def url_for(self, path: str) -> str:
+        return f"{self.base_url}/{path}"
+
+    def path_for(self, url: str) -> Optional[str]:
+        prefix = f"{self.base_url}/"
+        return url[len(prefix):] if url.startswith(prefix) else None
+
+    @property
+    def route_prefix(self) -> str:
+        """URL path the files are served under, e.g. "/media" """
+        return urlparse(self.base_url).path.rstrip("/")
+
+
+class _LocalWriter(StorageWriter):
+    def __init__(self, handle, final_path: str):
+        self.handle = handle
+        self.final_path = final_path
+
+    def write(self, data: bytes) -> None:
+        self.handle.write(data)
+
+    def close(self) -> None:
+        self.handle.close()
+        os.chmod(self.handle.name, 0o644)
+        os.replace(self.handle.name, self.final_path)
+
+    def abort(self) -> None:
+        self.handle.close()
+        try:
+            os.remove(self.handle.name)
+        except FileNotFoundError:
+            pass  # close() got as far as renaming it
+
+
+def _init_firebase_bucket():
+    """Initialize the Firebase app and get the storage bucket, or None if Firebase isn't configured"""
+    import firebase_admin
+    from firebase_admin import credentials, storage
+
+    try:
+        # Path to Firebase service account JSON file
+        cred_path = os.getenv("FIREBASE_CREDENTIALS_PATH")
+
+        if not firebase_admin._apps:
+            if cred_path and os.path.exists(cred_path):
+                cred = credentials.Certificate(cred_path)
+                firebase_admin.initialize_app(cred, {
+                    'storageBucket': os.getenv("FIREBASE_STORAGE_BUCKET")
+                })
+            else:
+                # For local development/testing without credentials
+                firebase_admin.initialize_app()
+
+        return storage.bucket()
+    except Exception as e:
+        logger.error("Firebase initialization error: %s", e)
+        return None
+
+
+_backend: Optional[StorageBackend] = None
+_backend_lock = threading.Lock()
+
+
+def get_storage_backend() -> StorageBackend:
+    """The storage backend selected by STORAGE_BACKEND"""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if settings.STORAGE_BACKEND == "local":
+                _backend = LocalStorageBackend(settings.LOCAL_STORAGE_PATH, settings.LOCAL_STORAGE_URL)
+            elif settings.STORAGE_BACKEND == "firebase":
+                _backend = FirebaseStorageBackend()
+            else:
+                raise ValueError(f"Unknown STORAGE_BACKEND: {settings.STORAGE_BACKEND}")
+        return _backend
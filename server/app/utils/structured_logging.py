@@ -0,0 +1,114 @@
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Optional
+import json
+import logging
+import queue
+
+# Attributes every LogRecord has; anything else was passed with extra= (or set by a filter) and becomes a field.
+# color_message is uvicorn's copy of the message with terminal colour codes.
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", logging.INFO, "", 0, "", (), None))) | {"message", "asctime", "color_message"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line.
+
+    Every line has the time, level, logger and message; exceptions and stack
+    traces are added as text, and attributes passed with extra= (or set by
+    filters, like the request ID) become fields of their own. Values JSON
+    can't represent are written as their str().
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES and value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class ContextFilter(logging.Filter):
+    """Copies a context variable onto records as an attribute, when it is set.
+
+    Filters run in the thread that logs, so on a queue handler this captures
+    the context of the caller rather than the listener's.
+    """
+
+    def __init__(self, attribute: str, variable: ContextVar):
+        super().__init__()
+        self.attribute = attribute
+        self.variable = variable
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        value = self.variable.get(None)
+        if value is not None:
+            setattr(record, self.attribute, value)
+        return True
+
+
+class BackgroundQueueHandler(QueueHandler):
+    """Hands records to a QueueListener thread, which formats and writes them.
+
+    The stock QueueHandler formats every record before queueing it; this one
+    queues the record as it is, so the message arguments are only formatted
+    (and the traceback only rendered) on the listener thread. Arguments
+    must therefore not be mutated after they are logged. When the queue is
+    full the record is dropped and counted instead of blocking the caller.
+    """
+
+    def __init__(self, records: queue.Queue):
+        super().__init__(records)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # handle() holds the handler lock around emit(), so this is not racing other threads
+            self.dropped += 1
+
+    def stats(self) -> dict:
+        return {"queued": self.queue.qsize(), "dropped": self.dropped}
+
+
+class BackgroundQueueListener(QueueListener):
+    """QueueListener that can be stopped while its queue is full.
+
+    The stock listener puts its stop sentinel without waiting, which fails
+    on a full bounded queue; this one waits for room, so stop() still
+    writes out every queued record.
+    """
+
+    def enqueue_sentinel(self) -> None:
+        self.queue.put(self._sentinel)
+
+
+class Truncated:
+    """Log argument that is cut to a number of characters when the record is formatted, not when it is logged"""
+
+    __slots__ = ("value", "limit")
+
+    def __init__(self, value: Any, limit: Optional[int]):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self) -> str:
+        text = self.value if isinstance(self.value, str) else str(self.value)
+        if not self.limit or len(text) <= self.limit:
+            return text
+        return f"{text[:self.limit]}... ({len(text) - self.limit} more characters)"
@@ -0,0 +1,83 @@
+"""Compare the tokens each generation profile spends per question.
+
+Usage (from the server directory):
+    python -m benchmarks.bench_generation_profiles [--questions 10] [--sections 3] [--profiles lean full]
+
+Generates the same MCQ, MSQ and numerical sections under each profile,
+bypassing the generation cache, and reports prompt and response tokens per
+question from the responses' usage metadata. Calls go to whichever client
+the settings select: with GEMINI_USE_STUB=true the counts are the stub's
+estimates (about 4 characters per token), otherwise they are billed tokens.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.models.models import Exam, QuestionType, Section  # noqa: E402
+from app.services.gemini_service import (  # noqa: E402
+    GENERATION_PROFILES, GeminiService, stop_generation_scheduler, token_usage_report
+)
+
+SECTION_NAMES = ["Mechanics", "Organic Chemistry", "Probability", "Thermodynamics", "Linear Algebra", "Genetics"]
+
+
+def make_sections(questions: int, sections: int):
+    """Unsaved sections of each question type, identical for every profile"""
+    exam = Exam(name="Token benchmark", time_minutes=60)
+    return [
+        Section(
+            exam=exam,
+            name=SECTION_NAMES[index % len(SECTION_NAMES)],
+            total_questions=questions,
+            questions_to_attempt=questions,
+            marks_per_question=4,
+            negative_marking_allowed=True,
+            negative_marks=1,
+            question_type=question_type,
+        )
+        for question_type in (QuestionType.MCQ, QuestionType.MSQ, QuestionType.NUM)
+        for index in range(sections)
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=10, help="questions per section")
+    parser.add_argument("--sections", type=int, default=3, help="sections per question type")
+    parser.add_argument("--profiles", nargs="+", default=list(GENERATION_PROFILES), choices=list(GENERATION_PROFILES))
+    args = parser.parse_args()
+
+    sections = make_sections(args.questions, args.sections)
+    try:
+        for profile in args.profiles:
+            service = GeminiService(profile=profile)
+            start = time.perf_counter()
+            for section in sections:
+                service.generate_questions(section, bypass_cache=True)
+            print(f"{profile}: {len(sections)} sections in {time.perf_counter() - start:.1f}s")
+    finally:
+        stop_generation_scheduler()
+
+    report = token_usage_report()
+    print(f"\n{'profile':8} {'type':4} {'questions':>9} {'prompt/q':>9} {'response/q':>10} {'total/q':>8}")
+    totals = {}
+    for profile in args.profiles:
+        for question_type, stats in sorted(report.get(profile, {}).items()):
+            per_question = stats["prompt_tokens_per_question"] + stats["response_tokens_per_question"]
+            print(f"{profile:8} {question_type:4} {stats['questions']:>9.0f} {stats['prompt_tokens_per_question']:>9.1f} "
+                  f"{stats['response_tokens_per_question']:>10.1f} {per_question:>8.1f}")
+        profile_stats = report.get(profile, {}).values()
+        questions = sum(stats["questions"] for stats in profile_stats)
+        if questions:
+            totals[profile] = sum(stats["prompt_tokens"] + stats["response_tokens"] for stats in profile_stats) / questions
+
+    if "lean" in totals and "full" in totals:
+        saving = 1 - totals["lean"] / totals["full"]
+        print(f"\nlean uses {totals['lean']:.1f} tokens per question, full {totals['full']:.1f} ({saving:.0%} fewer)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Benchmark the image pipeline: images processed per second, per core.
+
+Usage (from the server directory):
+    python -m benchmarks.bench_image_pipeline [--images 24] [--width 4032] [--height 3024] [--workers 1 2 4]
+
+Synthetic phone-sized photos are generated once, then processed with the
+current IMAGE_* settings, first in-process and then through a process pool
+for each worker count.
+"""
+import argparse
+import io
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image  # noqa: E402
+
+from app.core.config import settings  # noqa: E402
+from app.utils.image_pipeline import process_image  # noqa: E402
+
+
+def make_photo(width: int, height: int, seed: int) -> bytes:
+    """Build a noisy JPEG that compresses about as badly as a real photo"""
+    noise = Image.effect_noise((width // 4, height // 4), 64 + seed % 32).convert("RGB")
+    image = noise.resize((width, height), Image.Resampling.BILINEAR)
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=92)
+    return buffer.getvalue()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=24)
+    parser.add_argument("--width", type=int, default=4032)
+    parser.add_argument("--height", type=int, default=3024)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count() or 1])
+    args = parser.parse_args()
+
+    job = partial(
+        process_image,
+        max_width=settings.IMAGE_MAX_WIDTH,
+        max_height=settings.IMAGE_MAX_HEIGHT,
+        output_format=settings.IMAGE_OUTPUT_FORMAT.upper(),
+        quality=settings.IMAGE_QUALITY,
+        thumbnail_size=settings.IMAGE_THUMBNAIL_SIZE,
+        max_pixels=settings.IMAGE_MAX_PIXELS,
+    )
+
+    photos = [make_photo(args.width, args.height, i) for i in range(args.images)]
+    input_mb = sum(len(photo) for photo in photos) / 1e6
+    print(f"{args.images} images {args.width}x{args.height}, {input_mb:.1f} MB in, "
+          f"-> {settings.IMAGE_OUTPUT_FORMAT} max {settings.IMAGE_MAX_WIDTH}x{settings.IMAGE_MAX_HEIGHT}")
+
+    start = time.perf_counter()
+    results = [job(photo) for photo in photos]
+    elapsed = time.perf_counter() - start
+    output_mb = sum(len(r.data) + len(r.thumbnail) for r in results) / 1e6
+    print(f"in-process:  {args.images / elapsed:6.2f} images/s  ({elapsed / args.images * 1000:.0f} ms/image, "
+          f"{output_mb:.1f} MB out)")
+
+    for workers in args.workers:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(job, photos[:workers]))  # Warm up the workers
+            start = time.perf_counter()
+            list(executor.map(job, photos))
+            elapsed = time.perf_counter() - start
+        rate = args.images / elapsed
+        print(f"{workers:2d} workers:  {rate:6.2f} images/s  ({rate / workers:.2f} images/s per core)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Measure what logging costs the code that logs, with a direct and a queued handler.
+
+Usage (from the server directory):
+    python -m benchmarks.bench_logging [--requests 200] [--records 0 10 100] [--write-ms 0.2]
+
+Each simulated request logs a number of records, one in ten carrying a 4 KB
+payload, and is timed from the first record to the last. "direct" is the
+old setup (logging.basicConfig: records are formatted and written by the
+thread that logs them, here with the same JSON format); "queued" is configure_logging (records are queued
+and a background thread formats and writes them). Output goes to a stream
+whose writes take --write-ms, standing in for a slow terminal, pipe or log
+shipper; nothing is shown on the console.
+"""
+import argparse
+import logging
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("LOG_FORMAT", "json")
+
+from app.core.config import settings  # noqa: E402
+from app.core.logging_config import configure_logging, logging_stats, stop_logging  # noqa: E402
+from app.utils.structured_logging import JsonFormatter, Truncated  # noqa: E402
+
+PAYLOAD = "x" * 4096
+
+
+class SlowStream:
+    """Stream whose writes take a fixed time and are thrown away"""
+
+    def __init__(self, write_seconds: float):
+        self.write_seconds = write_seconds
+        self.writes = 0
+
+    def write(self, text: str) -> int:
+        self.writes += 1
+        if self.write_seconds:
+            time.sleep(self.write_seconds)
+        return len(text)
+
+    def flush(self) -> None:
+        pass
+
+
+def run_requests(requests: int, records: int) -> list:
+    """Latency of each simulated request, in milliseconds"""
+    logger = logging.getLogger("benchmark")
+    latencies = []
+    for request in range(requests):
+        start = time.perf_counter()
+        for index in range(records):
+            if index % 10 == 0:
+                logger.info("Response for request %d: %s", request, Truncated(PAYLOAD, settings.LOG_PAYLOAD_MAX_CHARS))
+            else:
+                logger.info("Request %d step %d for section %s", request, index, "Physics")
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def report(mode: str, records: int, latencies: list) -> None:
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{mode:7} {records:>8} {statistics.median(latencies):>9.3f} {p99:>9.3f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200, help="simulated requests per record count")
+    parser.add_argument("--records", type=int, nargs="+", default=[0, 10, 100], help="records logged per request")
+    parser.add_argument("--write-ms", type=float, default=0.2, help="time each write to the log stream takes")
+    args = parser.parse_args()
+
+    stream = SlowStream(args.write_ms / 1000)
+    print(f"{'mode':7} {'records':>8} {'p50 ms':>9} {'p99 ms':>9}")
+
+    logging.basicConfig(level=logging.INFO, stream=stream, force=True)
+    logging.getLogger().handlers[0].setFormatter(JsonFormatter())
+    for records in args.records:
+        report("direct", records, run_requests(args.requests, records))
+
+    stderr, sys.stderr = sys.stderr, stream
+    try:
+        configure_logging()
+        for records in args.records:
+            report("queued", records, run_requests(args.requests, records))
+        stats = logging_stats()
+        stop_logging()
+    finally:
+        sys.stderr = stderr
+    print(f"\nqueued: {stats['dropped']} records dropped (LOG_QUEUE_SIZE={settings.LOG_QUEUE_SIZE}), {stream.writes} writes in total")
+
+
+if __name__ == "__main__":
+    main()
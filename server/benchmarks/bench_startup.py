@@ -0,0 +1,121 @@
+"""Benchmark API cold start: import time per module and time to first request.
+
+Usage (from the server directory):
+    python -m benchmarks.bench_startup [--runs 5] [--port 8765] [--max-import-ms 0]
+
+Every import is measured in a fresh interpreter, so each number includes the
+module's own dependencies that weren't already loaded by Python itself. Time
+to first request starts uvicorn in a subprocess and polls until `/` answers,
+then times the first database-backed request. The server runs against a
+throwaway SQLite database with the offline Gemini stub, so no network or
+credentials are needed.
+
+With --max-import-ms, the script exits non-zero when importing `main` takes
+longer than that, so it can guard against startup regressions in CI.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = [
+    "app.core.config",
+    "app.core.database",
+    "app.models.models",
+    "app.services.gemini_service",
+    "app.utils.firebase_utils",
+    "app.utils.image_pipeline",
+    "app.services.question_service",
+    "app.routes.exam_routes",
+    "main",
+]
+
+IMPORT_SNIPPET = (
+    "import time; start = time.perf_counter(); import {module}; "
+    "print((time.perf_counter() - start) * 1000)"
+)
+
+
+def benchmark_env(database_path: str) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": f"sqlite:///{database_path}",
+        "GEMINI_USE_STUB": "true",
+        "GENERATION_CACHE_ENABLED": "false",
+        "JOB_WORKERS": "0",
+    })
+    return env
+
+
+def import_ms(module: str, env: dict) -> float:
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET.format(module=module)],
+        cwd=SERVER_DIR, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def wait_for(url: str, deadline: float) -> None:
+    while True:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                response.read()
+                return
+        except (urllib.error.URLError, ConnectionError):
+            if time.perf_counter() > deadline:
+                raise RuntimeError(f"Server did not answer {url} in time")
+            time.sleep(0.01)
+
+
+def first_request_ms(port: int, env: dict) -> tuple:
+    """Start the server and return (ms until `/` answers, ms for the first DB-backed request)"""
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=SERVER_DIR, env=env
+    )
+    try:
+        wait_for(f"http://127.0.0.1:{port}/", start + 60)
+        ready = time.perf_counter()
+        wait_for(f"http://127.0.0.1:{port}/api/exams/?limit=1", ready + 60)
+        return (ready - start) * 1000, (time.perf_counter() - ready) * 1000
+    finally:
+        server.terminate()
+        server.wait(10)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--max-import-ms", type=float, default=0, help="Fail if importing main takes longer (0 = no limit)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        env = benchmark_env(os.path.join(directory, "bench.db"))
+
+        print(f"Import time, median of {args.runs} fresh interpreters:")
+        medians = {}
+        for module in MODULES:
+            medians[module] = statistics.median(import_ms(module, env) for _ in range(args.runs))
+            print(f"  {module:<32} {medians[module]:8.1f} ms")
+
+        ready, first = zip(*(first_request_ms(args.port, env) for _ in range(args.runs)))
+        print(f"Time to first request, median of {args.runs} server starts:")
+        print(f"  {'server answering /':<32} {statistics.median(ready):8.1f} ms")
+        print(f"  {'first database request':<32} {statistics.median(first):8.1f} ms")
+
+    if args.max_import_ms and medians["main"] > args.max_import_ms:
+        print(f"Importing main took {medians['main']:.1f} ms, over the {args.max_import_ms:.1f} ms limit")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,69 @@
 import os
+import asyncio
+import logging
 import uvicorn
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from app.routes.exam_routes import router as exam_router
-from app.core.database import Base, engine
+from app.routes.job_routes import router as job_router, job_service
+from app.routes.system_routes import router as system_router
+from app.routes.storage_routes import router as storage_router
+from app.core.logging_config import RequestIdMiddleware, configure_logging
+from app.core.metrics import RequestMetricsMiddleware
+from app.services.export_service import exam_exporter
+from app.services.gemini_service import close_gemini_client, stop_generation_scheduler
+from app.services.job_service import JobWorkerPool
+from app.utils.image_pipeline import image_pipeline
+from app.core.config import settings
+from app.core.database import Base, async_engine, engine
+from app.core.migrations import run_migrations
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-# Create tables in the database
-Base.metadata.create_all(bind=engine)
+# Logging is configured by the application, not by the modules it imports
+configure_logging()
+logger = logging.getLogger(__name__)
+
+# Background generation workers
+job_worker_pool = JobWorkerPool(job_service)
+
+
+def create_schema():
+    """Create missing tables and apply the startup migrations"""
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Set up and tear down shared resources.
+    
+    Nothing expensive happens at import: the schema is created here, and the
+    Gemini client, generation cache, rate limiter, storage backend, image
+    worker pool and export threads are created on first use, so shutdown only closes what was
+    started.
+    """
+    if settings.DB_CREATE_SCHEMA:
+        try:
+            await asyncio.to_thread(create_schema)
+        except Exception:
+            logger.exception("Database schema setup failed")
+            raise
+    job_worker_pool.start()
+    try:
+        yield
+    finally:
+        job_worker_pool.stop()
+        stop_generation_scheduler()
+        image_pipeline.shutdown()
+        exam_exporter.shutdown()
+        await close_gemini_client()
+        await async_engine.dispose()
+        engine.dispose()
+
 
 # Create FastAPI instance
 app = FastAPI(
@@ -18,7 +71,8 @@ app = FastAPI(
     description="API for generating exam questions using Gemini AI",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan
 )
 
 # Add CORS middleware to allow cross-origin requests
@@ -28,10 +82,30 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allows all methods
     allow_headers=["*"],  # Allows all headers
+    expose_headers=["X-Next-Cursor", "X-Request-ID"],  # Keyset pagination cursor for the exam list, request ID of the logs
 )
 
+# Tags the records logged while handling each request with its ID
+app.add_middleware(RequestIdMiddleware)
+
+# Outermost, so the time includes the other middleware
+if settings.METRICS_ENABLED:
+    app.add_middleware(RequestMetricsMiddleware)
+
 # Include routers
 app.include_router(exam_router)
+app.include_router(job_router)
+app.include_router(system_router)
+
+# Prometheus metrics of this process
+if settings.METRICS_ENABLED:
+    from app.routes.metrics_routes import router as metrics_router
+
+    app.include_router(metrics_router)
+
+# Uploaded images are served by the API itself when they are stored on local disk
+if settings.STORAGE_BACKEND == "local":
+    app.include_router(storage_router)
 
 # Root endpoint
 @app.get("/")
@@ -0,0 +1,113 @@
+import unittest
+
+from app.services.rate_limiter import (
+    GenerationScheduler,
+    MemoryTokenBucketStore,
+    Priority,
+    RateLimiter,
+    RateLimitTimeout,
+    generation_context,
+)
+
+
+class FakeClock:
+    """Clock that only moves when told to"""
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+def make_scheduler(requests_per_minute: int = 60, tokens_per_minute: int = 0, queue_timeout: float = 120.0):
+    clock = FakeClock()
+    limiter = RateLimiter(requests_per_minute, tokens_per_minute, MemoryTokenBucketStore(), clock)
+    return GenerationScheduler(limiter, queue_timeout=queue_timeout, clock=clock, background=False), clock
+
+
+def drain(scheduler: GenerationScheduler) -> None:
+    """Use up the request bucket so later calls have to queue"""
+    while scheduler.limiter.try_acquire(0) == 0:
+        pass
+
+
+def submit(scheduler: GenerationScheduler, priority: Priority, tenant: str):
+    with generation_context(priority, tenant):
+        return scheduler.submit(0)
+
+
+class GenerationSchedulerTest(unittest.TestCase):
+    def grant_one(self, scheduler, clock):
+        """Let one request's worth of quota refill and dispatch"""
+        clock.advance(1)
+        scheduler.dispatch()
+
+    def test_interactive_calls_go_before_bulk(self):
+        scheduler, clock = make_scheduler()
+        drain(scheduler)
+        bulk = submit(scheduler, Priority.BULK, "a")
+        interactive = submit(scheduler, Priority.INTERACTIVE, "a")
+
+        self.grant_one(scheduler, clock)
+        self.assertEqual(interactive.state, "granted")
+        self.assertEqual(bulk.state, "queued")
+
+        self.grant_one(scheduler, clock)
+        self.assertEqual(bulk.state, "granted")
+
+    def test_tenants_take_turns(self):
+        scheduler, clock = make_scheduler()
+        drain(scheduler)
+        tickets = [submit(scheduler, Priority.BULK, "a") for _ in range(3)]
+        tickets.append(submit(scheduler, Priority.BULK, "b"))
+
+        order = []
+        for _ in tickets:
+            self.grant_one(scheduler, clock)
+            order.extend(ticket for ticket in tickets if ticket.state == "granted" and ticket not in order)
+        self.assertEqual(order, [tickets[0], tickets[3], tickets[1], tickets[2]])
+
+    def test_dispatch_reports_wait_until_next_grant(self):
+        scheduler, clock = make_scheduler()
+        drain(scheduler)
+        self.assertIsNone(scheduler.dispatch())
+        submit(scheduler, Priority.INTERACTIVE, "a")
+        self.assertAlmostEqual(scheduler.dispatch(), 1.0)
+
+    def test_acquire_times_out_and_leaves_the_queue(self):
+        scheduler, clock = make_scheduler(queue_timeout=0.01)
+        drain(scheduler)
+        with self.assertRaises(RateLimitTimeout):
+            scheduler.acquire(0)
+
+        stats = scheduler.stats()["priorities"]["interactive"]
+        self.assertEqual(stats["timeouts"], 1)
+        self.assertEqual(stats["queue_depth"], 0)
+        self.assertIsNone(scheduler.dispatch())
+
+    def test_tokens_are_returned_when_the_call_gave_up_while_dispatching(self):
+        scheduler, clock = make_scheduler()
+        drain(scheduler)
+        ticket = submit(scheduler, Priority.INTERACTIVE, "a")
+        clock.advance(1)
+
+        take = scheduler.limiter.store.take
+
+        def take_then_cancel(costs, now):
+            # The caller's timeout fires between taking the tokens and granting the ticket
+            wait = take(costs, now)
+            scheduler._cancel(ticket)
+            return wait
+
+        scheduler.limiter.store.take = take_then_cancel
+        self.assertIsNone(scheduler.dispatch())
+        self.assertEqual(ticket.state, "cancelled")
+        self.assertAlmostEqual(scheduler.limiter.levels()["requests"], 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()